@@ -0,0 +1,272 @@
+"""
+端到端基准测试：在本地飞书替身（scripts/mock_feishu.py）上运行 orchestrator.run + merge_run_state
+- --session browser：Playwright 打开替身的会话页面，走真实的消息检测与下载流程（需已安装浏览器内核）
+- --session http：不启动浏览器，用 HttpChatSession 通过替身的 /api/messages 与文件链接模拟会话，
+  用于衡量编排、导出请求与合并本身的开销
+输出：窗口数/分钟、导出调用次数、浪费的父窗口导出（split）次数、编排与合并耗时，并校验合并条数是否等于替身的真实总数。
+
+示例：python scripts/benchmark.py --start 2025-01-01 --end 2025-03-31 --in-flight 4 --strategy adaptive
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from scripts.file_fetch import FileFetcher  # noqa: E402
+from scripts.hashing import DownloadedFile  # noqa: E402
+from scripts.merge_and_validate import merge_run_state  # noqa: E402
+from scripts.mock_feishu import BOT_NAME, MESSENGER_PATH, MockConfig, MockServer  # noqa: E402
+from scripts.orchestrator import run as orchestrator_run  # noqa: E402
+from scripts.run_state import open_store  # noqa: E402
+from scripts.web_download import _parse_declared_count  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+class HttpChatSession:
+    """BrowserSession 的无浏览器替身：通过替身服务的 /api/messages 读取机器人消息，文件经 HTTP 直接下载。"""
+
+    def __init__(self, cfg: dict, base_url: str, poll_interval: float = 0.05, crash_after: int = 0) -> None:
+        dcfg = cfg.get("download", {})
+        self.base_url = base_url.rstrip("/")
+        self.download_dir = dcfg.get("download_dir", "./output/raw")
+        self.max_wait_seconds = int(dcfg.get("max_wait_seconds", 90))
+        self.poll_interval = poll_interval
+        self._http = requests.Session()
+        self._fetcher = FileFetcher(cfg)
+        self.last_timings: Dict[str, float] = {}
+        # crash_after>0：下载满 N 个文件后的下一次下载抛出异常，模拟运行中途崩溃
+        self.crash_after = crash_after
+        self._downloads = 0
+
+    def _messages(self, since: int = 0) -> List[Dict[str, Any]]:
+        try:
+            return self._http.get(f"{self.base_url}/api/messages", params={"since": since}, timeout=10).json()
+        except Exception:
+            logger.exception("http_chat: read messages failed")
+            return []
+
+    def ensure_chat_open(self, force: bool = False) -> bool:
+        return True
+
+    def snapshot_state(self) -> Tuple[int, str]:
+        msgs = self._messages()
+        return len(msgs), (msgs[-1]["text"] if msgs else "")
+
+    def poll_new_messages(self, seen_count: int, wait_seconds: float = 0.0) -> List[Tuple[int, str]]:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            msgs = self._messages(seen_count)
+            if msgs or time.monotonic() >= deadline:
+                return [(int(m["idx"]), str(m["text"])) for m in msgs]
+            time.sleep(self.poll_interval)
+
+    def wait_and_download_new(self, pre_count: int, pre_sig: str = "") -> Optional[Tuple[DownloadedFile, int]]:
+        start = time.monotonic()
+        msgs = self.poll_new_messages(pre_count, self.max_wait_seconds)
+        self.last_timings = {"wait": time.monotonic() - start}
+        if not msgs:
+            return None
+        idx, text = msgs[-1]
+        saved = self.download_at(idx)
+        self.last_timings["download"] = time.monotonic() - start - self.last_timings["wait"]
+        return (saved, int(_parse_declared_count(text) or 0)) if saved else None
+
+    def download_at(self, idx: int) -> Optional[DownloadedFile]:
+        return self.download_many([idx])[0]
+
+    def download_many(self, indices: List[int]) -> List[Optional[DownloadedFile]]:
+        if self.crash_after and self._downloads >= self.crash_after:
+            raise RuntimeError(f"benchmark: simulated crash after {self._downloads} downloads")
+        self._downloads += len(indices)
+        jobs = [(f"{self.base_url}/files/{i}.xlsx", "", self.download_dir, f"export_{i}.xlsx") for i in indices]
+        return self._fetcher.fetch_many(jobs)
+
+    def close(self) -> None:
+        self._fetcher.close()
+        self._http.close()
+
+
+def build_config(args: argparse.Namespace, base_url: str, work_dir: Path) -> dict:
+    return {
+        "start_date": args.start,
+        "end_date": args.end,
+        "split_days_sequence": [int(x) for x in args.split_days.split(",")],
+        "max_count_per_file": args.max_count,
+        "planner": {"strategy": args.strategy},
+        "pipeline": {"in_flight": args.in_flight, "poll_interval_seconds": 0.2,
+                     "message_has_range": not args.dateless},
+        "retry": {"max_attempts": 3, "backoff_seconds": 0.2, "max_backoff_seconds": 2,
+                  "window_backoff_seconds": 1, "window_max_backoff_seconds": 5},
+        "http": {"base_url": base_url, "backend": args.backend, "concurrency": args.in_flight},
+        "export_headers": {"cookie": "mock=1"},
+        "download": {
+            "download_dir": str(work_dir / "raw"),
+            "user_data_dir": str(work_dir / "profile"),
+            "messenger_url": base_url + MESSENGER_PATH,
+            "bot_chat_name": BOT_NAME,
+            "max_wait_seconds": args.max_wait,
+            "headless": True,
+            "mode": args.download_mode,
+        },
+        "merge": {"output_path_pattern": str(work_dir / "merged" / "合同协同_合并_共{TOTAL}条.xlsx"),
+                  "cache_dir": str(work_dir / "parse_cache") if args.parse_cache else "", "workers": args.merge_workers,
+                  "dedup_key": ["协同记录ID"]},
+        "postprocess": {"workers": args.post_workers, "executor": args.post_executor},
+        "run_state": {"csv_path": str(work_dir / "run_windows.csv"), "resume_mode": "fresh"},
+        "probe": {"enabled": args.probe, "density_path": str(work_dir / "density_map.json"), "refresh_recent_days": 0},
+        "metrics": {"json_path": str(work_dir / "run_metrics.json"), "textfile_path": str(work_dir / "run_metrics.prom")},
+    }
+
+
+def _unrecorded_files(cfg: dict) -> List[str]:
+    """已按标准名落盘、但运行状态中没有对应 with_data/manual 记录的文件（崩溃后续跑会重新导出这些窗口）。"""
+    raw_dir = Path(cfg["download"]["download_dir"])
+    with open_store(cfg) as store:
+        recorded = {Path(r.get("file_path") or "").name for r in store.records()
+                    if r.get("status") in ("with_data", "manual")}
+    return sorted(p.name for p in raw_dir.glob("合同协同_*.xlsx") if p.name not in recorded)
+
+
+def _crash_run(cfg: dict, base_url: str, crash_after: int) -> List[str]:
+    """先运行一次并在下载满 crash_after 个文件后模拟崩溃，返回崩溃后未记入运行状态的文件。"""
+    session = HttpChatSession(cfg, base_url, crash_after=crash_after)
+    try:
+        with open_store(cfg) as store:
+            orchestrator_run(cfg, store, session)
+        logger.warning("benchmark: run finished before the simulated crash (crash_after=%s)", crash_after)
+    except RuntimeError as e:
+        logger.info("benchmark: %s", e)
+    finally:
+        session.close()
+    return _unrecorded_files(cfg)
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    mock_cfg = MockConfig(
+        daily_min=args.daily_min, daily_max=args.daily_max,
+        spikes={k: int(v) for k, v in (s.split("=", 1) for s in args.spike)}, seed=args.seed,
+        max_count=args.max_count, latency_ms=args.latency_ms, message_delay_ms=args.message_delay_ms,
+        throttle_rps=args.throttle_rps, error_rate=args.error_rate, dateless_messages=args.dateless,
+    )
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="feishu_bench_"))
+    with MockServer(mock_cfg) as server:
+        cfg = build_config(args, server.base_url, work_dir)
+        expected = server.mock.range_total(args.start, args.end)
+        unrecorded: Optional[List[str]] = None
+        if args.crash_after:
+            # 崩溃路径：第一次运行中途崩溃，随后按 resume 续跑到完成，合并条数仍应与真实总数一致
+            unrecorded = _crash_run(cfg, server.base_url, args.crash_after)
+            cfg["run_state"]["resume_mode"] = "resume"
+        session = HttpChatSession(cfg, server.base_url) if args.session == "http" else None
+        with open_store(cfg) as store:
+            t0 = time.monotonic()
+            try:
+                orchestrator_run(cfg, store, session)
+            finally:
+                if session is not None:
+                    session.close()
+            run_seconds = time.monotonic() - t0
+            t1 = time.monotonic()
+            merged = merge_run_state(cfg, store)
+            merge_seconds = time.monotonic() - t1
+            statuses: Dict[str, int] = {}
+            for row in store.records():
+                statuses[row.get("status", "")] = statuses.get(row.get("status", ""), 0) + 1
+            # 运行内重试后仍失败的窗口（以每个窗口的最后一条记录为准）
+            still_failed = sum(1 for wid in {r["window_id"] for r in store.records()} if store.status(wid) == "failed")
+        stats = dict(server.mock.stats)
+
+    leaf = sum(statuses.get(s, 0) for s in ("with_data", "no_data", "manual"))
+    merged_rows = 0
+    report_path = Path(str(merged)).with_name(Path(str(merged)).stem + "_validation.json") if merged else None
+    if report_path and report_path.exists():
+        merged_rows = int(json.loads(report_path.read_text(encoding="utf-8")).get("rows_written", 0))
+    # 编排阶段写出的分阶段耗时汇总（见 scripts/metrics.py）
+    phases: Dict[str, Any] = {}
+    metrics_path = work_dir / "run_metrics.json"
+    if metrics_path.exists():
+        phases = {k: v["sum_seconds"] for k, v in json.loads(metrics_path.read_text(encoding="utf-8")).get("phases", {}).items()}
+    return {
+        "session": args.session,
+        "strategy": args.strategy,
+        "in_flight": args.in_flight,
+        "range": f"{args.start}..{args.end}",
+        "windows_completed": leaf,
+        "windows_per_min": round(leaf / (run_seconds / 60.0), 2) if run_seconds > 0 else 0.0,
+        "export_calls": stats.get("export_calls", 0),
+        "probe_calls": stats.get("probe_calls", 0),
+        "throttled": stats.get("throttled", 0),
+        "wasted_parent_exports": statuses.get("split", 0),
+        "failed_windows": still_failed,
+        "statuses": statuses,
+        "run_seconds": round(run_seconds, 2),
+        "merge_seconds": round(merge_seconds, 2),
+        "phase_seconds": phases,
+        "expected_rows": expected,
+        "merged_rows": merged_rows,
+        "rows_match": merged_rows == expected,
+        "crash_unrecorded_files": len(unrecorded) if unrecorded is not None else None,
+        "merged_path": str(merged) if merged else "",
+        "work_dir": str(work_dir),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="在本地飞书替身上运行端到端基准测试")
+    parser.add_argument("--start", default="2025-01-01")
+    parser.add_argument("--end", default="2025-03-31")
+    parser.add_argument("--session", choices=["http", "browser"], default="http")
+    parser.add_argument("--strategy", choices=["sequence", "adaptive", "bisect"], default="sequence")
+    parser.add_argument("--split-days", default="7,3,1")
+    parser.add_argument("--probe", action="store_true", help="导出前先用列表接口探测每日条数（probe.enabled）")
+    parser.add_argument("--max-count", type=int, default=1000)
+    parser.add_argument("--in-flight", type=int, default=1)
+    parser.add_argument("--backend", choices=["sync", "async"], default="sync")
+    parser.add_argument("--download-mode", choices=["ui", "direct"], default="ui")
+    parser.add_argument("--max-wait", type=int, default=5, help="单窗口等待消息秒数（替身无数据时不发消息）")
+    parser.add_argument("--merge-workers", type=int, default=1)
+    parser.add_argument("--post-workers", type=int, default=2, help="下载后台处理池大小（postprocess.workers），0 为主线程内处理")
+    parser.add_argument("--post-executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--parse-cache", action="store_true",
+                        help="启用解析缓存（merge.cache_dir），后台处理同时把文件转换为中间文件，合并直接命中缓存")
+    parser.add_argument("--daily-min", type=int, default=0)
+    parser.add_argument("--daily-max", type=int, default=200)
+    parser.add_argument("--spike", action="append", default=[], help="指定某日条数，格式 YYYY-MM-DD=N，可重复")
+    parser.add_argument("--seed", type=int, default=7, help="每日条数的随机种子")
+    parser.add_argument("--latency-ms", type=int, default=50)
+    parser.add_argument("--message-delay-ms", type=int, default=300)
+    parser.add_argument("--throttle-rps", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dateless", action="store_true",
+                        help="替身消息不含日期区间（真实机器人文案），此时流水线退回逐窗口串行")
+    parser.add_argument("--crash-after", type=int, default=0,
+                        help="先运行一次并在下载 N 个文件后模拟崩溃，再续跑完成；crash_unrecorded_files 应为 0（仅 --session http）")
+    parser.add_argument("--work-dir", default="", help="输出目录（默认临时目录）")
+    parser.add_argument("--json", default="", help="把结果写入该 JSON 文件")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    if args.crash_after and args.session != "http":
+        parser.error("--crash-after 仅支持 --session http")
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING),
+                        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+
+    result = run_benchmark(args)
+    for k, v in result.items():
+        print(f"{k:>22}: {v}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
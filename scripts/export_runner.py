@@ -18,6 +18,9 @@ if str(BASE_DIR) not in sys.path:
 
 from scripts.orchestrator import run as orchestrator_run  # noqa: E402
 from scripts.merge_and_validate import merge_run_state  # noqa: E402
+from scripts.run_state import open_store  # noqa: E402
+from scripts.web_download import interactive_login  # noqa: E402
+from scripts.incremental import advance_watermark, from_config as incremental_from_cfg, plan_range, run_config  # noqa: E402
 
 
 def load_config(config_path: Path) -> dict:
@@ -34,11 +37,15 @@ def summarize(cfg: dict) -> str:
     time_range = f"{cfg.get('start_date')} → {cfg.get('end_date')}"
     summary = [
         f"时间范围: {time_range}",
-        f"拆分序列: {cfg.get('split_days_sequence')}",
+        f"拆分序列: {cfg.get('split_days_sequence')}  窗口规划: {cfg.get('planner', {}).get('strategy', 'sequence')}",
         f"阈值: max_count_per_file={cfg.get('max_count_per_file')}",
         f"断点续跑: {rs.get('resume_mode','resume')} (已完成态: {rs.get('completed_statuses')})",
         f"下载目录: {dl.get('download_dir')}  机器人: {dl.get('bot_chat_name')}  超时: {dl.get('max_wait_seconds')}s",
+        f"浏览器: headless={dl.get('headless', False)}  下载页面数: {dl.get('pages', 1)}  下载方式: {dl.get('mode', 'ui')}",
     ]
+    q = cfg.get("queue", {})
+    if str(q.get("backend", "none") or "none").lower() != "none":
+        summary.append(f"工作队列: {q.get('backend')}  {q.get('path', './state/work_queue.sqlite')}  节点: {q.get('worker_id') or '(主机名-进程号)'}")
     return "\n".join(summary)
 
 
@@ -74,6 +81,16 @@ def main() -> None:
         default=str(Path("config") / "config.yaml"),
         help="配置文件路径 (默认: config/config.yaml)",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="增量同步：只导出水位线之后（含回看天数）的日期并推进水位线，等同 incremental.enabled=true",
+    )
+    parser.add_argument(
+        "--login",
+        action="store_true",
+        help="仅以有界面模式打开浏览器完成扫码登录（登录态保存在 download.user_data_dir），之后可设置 download.headless=true 运行",
+    )
     args = parser.parse_args()
 
     base_dir = Path(__file__).resolve().parents[1]
@@ -94,15 +111,35 @@ def main() -> None:
     logging.info("日志文件: %s", log_file)
     logging.info("%s", summarize(cfg))
 
-    # Step 5：编排执行（遍历窗口、细分、导出、下载、CSV记录）
-    logging.info("[执行] 开始编排（Step 5）...")
-    orchestrator_run(cfg)
-    logging.info("[完成] 编排结束。状态已写入 state/run_windows.csv")
-
-    # Step 6：合并与输出
-    logging.info("[执行] 开始合并（Step 6）...")
-    merged_path = merge_run_state(cfg)
-    logging.info("[完成] 合并输出: %s", merged_path)
+    if args.login:
+        logging.info("[登录] 请在打开的浏览器中扫码登录...")
+        ok = interactive_login(cfg)
+        logging.info("[登录] %s", "完成，登录态已保存" if ok else "未能打开机器人会话，请检查登录状态与 bot_chat_name")
+        return
+
+    run_cfg = cfg
+    run_range = None
+    if args.incremental or incremental_from_cfg(cfg).enabled:
+        # 增量同步：按水位线与回看天数确定本次范围，范围内窗口全部重新导出
+        run_range = plan_range(cfg)
+        if run_range is None:
+            logging.info("[增量] 已是最新，无需导出")
+            return
+        logging.info("[增量] 本次范围: %s → %s", *run_range)
+        run_cfg = run_config(cfg, *run_range)
+
+    with open_store(run_cfg) as store:
+        # Step 5：编排执行（遍历窗口、细分、导出、下载、CSV记录）
+        logging.info("[执行] 开始编排（Step 5）...")
+        orchestrator_run(run_cfg, store)
+        logging.info("[完成] 编排结束。状态已写入 %s", store.cfg.csv_path)
+        if run_range is not None:
+            logging.info("[增量] 水位线: %s", advance_watermark(cfg, store, run_range))
+
+        # Step 6：合并与输出
+        logging.info("[执行] 开始合并（Step 6）...")
+        merged_path = merge_run_state(cfg, store)
+        logging.info("[完成] 合并输出: %s", merged_path)
 
 
 if __name__ == "__main__":
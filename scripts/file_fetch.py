@@ -0,0 +1,114 @@
+"""
+直接下载导出文件（download.mode=direct）
+- 从机器人消息中取得文件链接后，带上浏览器会话的 Cookie，用带连接池的 requests.Session 直接拉取
+- 流式写入 <download_dir>/<文件名>.part，写入时同步计算摘要，完成后改名，避免半截文件被当作结果
+- 每个任务写入唯一文件名（<fallback_name 主名>_<随机串><扩展名>）：真实导出同一天的文件同名（协商操作记录-YYYYMMDD.xlsx），
+  按服务端文件名保存会让并行下载互相覆盖；窗口对应确定后再由编排器重命名为标准名
+- fetch_many 用线程池并行下载同一批消息的文件
+"""
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+import logging
+import os
+import re
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .hashing import DigestWriter, DownloadedFile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+
+
+def _filename_from_response(resp: requests.Response, url: str, fallback: str) -> str:
+    cd = resp.headers.get("Content-Disposition", "") or ""
+    m = re.search(r"filename\*\s*=\s*[^']*''([^;]+)", cd, flags=re.IGNORECASE)
+    if m:
+        name = unquote(m.group(1).strip().strip('"'))
+    else:
+        m = re.search(r'filename\s*=\s*"?([^";]+)"?', cd, flags=re.IGNORECASE)
+        name = m.group(1).strip() if m else os.path.basename(unquote(urlparse(url).path))
+    # 只保留文件名部分，防止路径穿越
+    name = os.path.basename(name.replace("\\", "/")).strip()
+    return name or fallback
+
+
+def _unique_name(server_name: str, fallback: str) -> str:
+    suffix = Path(server_name).suffix or Path(fallback).suffix or ".xlsx"
+    return f"{Path(fallback).stem}_{uuid.uuid4().hex[:8]}{suffix}"
+
+
+class FileFetcher:
+    def __init__(self, cfg: dict) -> None:
+        http_cfg = cfg.get("http", {})
+        dcfg = cfg.get("download", {})
+        self.timeout_seconds = int(http_cfg.get("timeout_seconds", 30))
+        self.workers = max(1, int(dcfg.get("direct_workers", 4)))
+        self.digest_algo = str(dcfg.get("digest_algo", "md5")).lower()
+        self._session = requests.Session()
+        self._session.headers.update({"User-Agent": "Mozilla/5.0", "Accept": "*/*"})
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(self.workers, int(http_cfg.get("pool_size", 4))))
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        logger.debug("file_fetch: workers=%s timeout=%s", self.workers, self.timeout_seconds)
+
+    def fetch(self, url: str, cookie: str, dest_dir: str, fallback_name: str = "export.xlsx") -> Optional[DownloadedFile]:
+        """下载 url 到 dest_dir，返回保存的文件（路径、字节数、摘要）；失败返回 None（由调用方回退到界面下载）。"""
+        start = time.monotonic()
+        tmp: Optional[Path] = None
+        try:
+            headers = {"Cookie": cookie} if cookie else {}
+            with self._session.get(url, headers=headers, stream=True, timeout=self.timeout_seconds) as resp:
+                if not (200 <= resp.status_code < 300):
+                    logger.warning("file_fetch: non-2xx status=%s url=%s", resp.status_code, url)
+                    return None
+                ctype = resp.headers.get("Content-Type", "") or ""
+                if "text/html" in ctype or "application/json" in ctype:
+                    # 登录页/错误信息而非文件
+                    logger.warning("file_fetch: unexpected content-type=%s url=%s", ctype, url)
+                    return None
+                server_name = _filename_from_response(resp, url, fallback_name)
+                dest = Path(dest_dir) / _unique_name(server_name, fallback_name)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                tmp = dest.with_name(dest.name + ".part")
+                with tmp.open("wb") as fh:
+                    writer = DigestWriter(fh, self.digest_algo)
+                    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            writer.write(chunk)
+            os.replace(tmp, dest)
+            logger.debug("file_fetch: saved %s (server name %s) bytes=%s in %.2fs", dest, server_name, writer.size,
+                         time.monotonic() - start)
+            return DownloadedFile(path=str(dest), size=writer.size, digest=writer.digest)
+        except Exception:
+            logger.exception("file_fetch: download failed url=%s", url)
+            try:
+                if tmp is not None:
+                    tmp.unlink(missing_ok=True)
+            except Exception:
+                pass
+            return None
+
+    def fetch_many(self, jobs: List[Tuple[str, str, str, str]]) -> List[Optional[DownloadedFile]]:
+        """并行下载 [(url, cookie, dest_dir, fallback_name)]，返回与 jobs 一一对应的保存结果；各任务的 fallback_name 应互不相同。"""
+        if len(jobs) <= 1 or self.workers <= 1:
+            return [self.fetch(*job) for job in jobs]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as ex:
+            return list(ex.map(lambda job: self.fetch(*job), jobs))
+
+    def close(self) -> None:
+        try:
+            self._session.close()
+        except Exception:
+            pass
+
+
+def cookie_header(cookies: List[Dict[str, str]]) -> str:
+    """把 Playwright context.cookies(url) 的结果拼成 Cookie 请求头。"""
+    return "; ".join(f"{c.get('name')}={c.get('value')}" for c in cookies if c.get("name"))
@@ -0,0 +1,94 @@
+"""
+文件摘要
+- 下载落盘时边写边算摘要与字节数（DigestWriter / copy_with_digest），不再写完后重新整读一遍
+- 摘要算法由 download.digest_algo 指定：md5（默认）| blake2b | xxh64 / xxh3_64（需 xxhash）| blake3（需 blake3）
+- 非 md5 的摘要记为 "<算法>:<十六进制>"，合并阶段按前缀用同一算法校验
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Union
+import hashlib
+import os
+
+CHUNK_SIZE = 1 << 20
+ALGOS = ("md5", "blake2b", "xxh64", "xxh3_64", "blake3")
+
+
+@dataclass
+class DownloadedFile:
+    path: str
+    size: int
+    digest: str
+
+
+def new_hasher(algo: str = "md5") -> Any:
+    algo = (algo or "md5").lower()
+    if algo == "md5":
+        return hashlib.md5()
+    if algo == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    if algo in ("xxh64", "xxh3_64"):
+        try:
+            import xxhash  # type: ignore
+        except ImportError as e:
+            raise RuntimeError(f"digest_algo={algo} 需要依赖 xxhash，请先运行: pip install xxhash") from e
+        return xxhash.xxh64() if algo == "xxh64" else xxhash.xxh3_64()
+    if algo == "blake3":
+        try:
+            import blake3  # type: ignore
+        except ImportError as e:
+            raise RuntimeError("digest_algo=blake3 需要依赖 blake3，请先运行: pip install blake3") from e
+        return blake3.blake3()
+    raise ValueError(f"不支持的摘要算法: {algo}（可选: {', '.join(ALGOS)}）")
+
+
+def format_digest(algo: str, hexdigest: str) -> str:
+    algo = (algo or "md5").lower()
+    return hexdigest if algo == "md5" else f"{algo}:{hexdigest}"
+
+
+def algo_of(digest: str) -> str:
+    """由记录的摘要值得到算法名；无前缀的视为 md5（兼容旧的 file_md5）。"""
+    if digest and ":" in digest:
+        return digest.split(":", 1)[0]
+    return "md5"
+
+
+def digest_file(path: Union[str, Path], algo: str = "md5") -> str:
+    h = new_hasher(algo)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return format_digest(algo, h.hexdigest())
+
+
+class DigestWriter:
+    """包装二进制文件句柄：write 时同步更新摘要与字节数。"""
+
+    def __init__(self, fh: BinaryIO, algo: str = "md5") -> None:
+        self._fh = fh
+        self.algo = algo
+        self._hasher = new_hasher(algo)
+        self.size = 0
+
+    def write(self, chunk: bytes) -> int:
+        self._hasher.update(chunk)
+        self.size += len(chunk)
+        return self._fh.write(chunk)
+
+    @property
+    def digest(self) -> str:
+        return format_digest(self.algo, self._hasher.hexdigest())
+
+
+def copy_with_digest(src: Union[str, Path], dest: Union[str, Path], algo: str = "md5") -> DownloadedFile:
+    """把 src 复制到 dest（先写 .part 再改名），复制的同时计算摘要。"""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".part")
+    with open(src, "rb") as fin, tmp.open("wb") as fout:
+        writer = DigestWriter(fout, algo)
+        for chunk in iter(lambda: fin.read(CHUNK_SIZE), b""):
+            writer.write(chunk)
+    os.replace(tmp, dest)
+    return DownloadedFile(path=str(dest), size=writer.size, digest=writer.digest)
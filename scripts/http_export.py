@@ -1,14 +1,38 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
+import asyncio
+import threading
 import time
 import json
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+
+from .rate_limit import RateController, backoff_delay, is_throttle_status, parse_retry_after, from_config as rate_from_config
 
 logger = logging.getLogger(__name__)
 
 
-def _endpoint_url() -> str:
-    return "https://contract.feishu.cn/clm/api/cooperation/exportCooperationRecords"
+DEFAULT_BASE_URL = "https://contract.feishu.cn"
+
+
+def _endpoint_url(cfg: Optional[dict] = None) -> str:
+    base = str(((cfg or {}).get("http", {}) or {}).get("base_url") or DEFAULT_BASE_URL).rstrip("/")
+    return f"{base}/clm/api/cooperation/exportCooperationRecords"
+
+
+def _result_from_response(status: int, text: str, data: Optional[Any]) -> Optional[Dict[str, Any]]:
+    """2xx 时返回成功结果，否则返回 None 由调用方决定是否重试。"""
+    logger.debug("submit_export: status=%s text_len=%s", status, len(text) if text else 0)
+    if 200 <= status < 300:
+        logger.debug("submit_export: success")
+        return {"ok": True, "status_code": status, "data": data, "text": text}
+    logger.warning("submit_export: non-2xx status=%s", status)
+    return None
+
+
+def _failed_result(max_attempts: int, last_err: Optional[str]) -> Dict[str, Any]:
+    logger.error("submit_export: failed after %s attempts, last_err=%s", max_attempts, last_err)
+    return {"ok": False, "status_code": None, "data": None, "text": None, "error": last_err}
 
 
 def compose_headers(cfg: dict) -> Dict[str, str]:
@@ -54,55 +78,258 @@ def build_body(from_date: str, to_date: str, keyword: str = "", search_tab_enum_
     return body
 
 
+class _ExportClientBase:
+    """同步/异步客户端共用的配置、退避与限速逻辑。"""
+
+    def _init_common(self, cfg: dict) -> None:
+        http_cfg = cfg.get("http", {})
+        retry_cfg = cfg.get("retry", {})
+        self.url = _endpoint_url(cfg)
+        self.headers = compose_headers(cfg)
+        self.max_attempts = int(retry_cfg.get("max_attempts", 3))
+        self.backoff_seconds = float(retry_cfg.get("backoff_seconds", 5))
+        self.max_backoff_seconds = float(retry_cfg.get("max_backoff_seconds", 60))
+        self.jitter = bool(retry_cfg.get("jitter", True))
+        self.timeout_seconds = int(http_cfg.get("timeout_seconds", 30))
+        # 整个客户端（即整个运行）共享一个限速器
+        self.limiter: Optional[RateController] = rate_from_config(cfg)
+
+    def _on_success(self) -> None:
+        if self.limiter is not None:
+            self.limiter.on_success()
+
+    def _on_failure(self, status: Optional[int] = None, retry_after: Optional[str] = None) -> Optional[float]:
+        """每次失败后调用（含最后一次尝试）：429/5xx 通知限速器降速，返回服务端 Retry-After 秒数。"""
+        hint = parse_retry_after(retry_after)
+        if self.limiter is not None and is_throttle_status(status):
+            self.limiter.on_throttle(status, hint)
+        return hint
+
+    def _retry_delay(self, attempt: int, hint: Optional[float] = None) -> float:
+        """重试前的等待秒数：带抖动的指数退避，且不短于服务端 Retry-After。"""
+        delay = backoff_delay(attempt, self.backoff_seconds, self.max_backoff_seconds, self.jitter)
+        if hint is not None:
+            delay = max(delay, hint)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return self.limiter.snapshot() if self.limiter is not None else {}
+
+    def _log_stats(self) -> None:
+        if self.limiter is not None:
+            logger.info("export_client: rate_limit %s", self.limiter.snapshot())
+
+
+class ExportClient(_ExportClientBase):
+    """导出接口客户端：整个运行期间复用同一个带连接池的 requests.Session（HTTP keep-alive），
+    请求头只在初始化时组装一次，避免每个窗口重新握手 TCP+TLS。"""
+
+    def __init__(self, cfg: dict) -> None:
+        http_cfg = cfg.get("http", {})
+        self._init_common(cfg)
+        pool_size = int(http_cfg.get("pool_size", 4))
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        logger.debug("export_client: url=%s pool_size=%s timeout=%s attempts/backoff=%s/%s",
+                     self.url, pool_size, self.timeout_seconds, self.max_attempts, self.backoff_seconds)
+
+    def submit(self, from_date: str, to_date: str, keyword: str = "", search_tab_enum_code: int = 0,
+               extra_body: Optional[Dict[str, Any]] = None, timeout_seconds: Optional[int] = None) -> Dict[str, Any]:
+        body = build_body(from_date, to_date, keyword, search_tab_enum_code, extra_body)
+        payload = json.dumps(body)
+        timeout = timeout_seconds or self.timeout_seconds
+        logger.debug("submit_export: body=%s", body)
+
+        max_attempts = self.max_attempts
+        last_err: Optional[str] = None
+        start = time.monotonic()
+        for attempt in range(1, max_attempts + 1):
+            status: Optional[int] = None
+            retry_after: Optional[str] = None
+            try:
+                if self.limiter is not None:
+                    self.limiter.acquire()
+                logger.debug("submit_export: attempt=%s/%s", attempt, max_attempts)
+                resp = self._session.post(self.url, data=payload, timeout=timeout)
+                data: Optional[Any] = None
+                try:
+                    data = resp.json()
+                except Exception:
+                    data = None
+                result = _result_from_response(resp.status_code, resp.text, data)
+                if result is not None:
+                    self._on_success()
+                    result["elapsed_seconds"] = time.monotonic() - start
+                    result["attempts"] = attempt
+                    return result
+                status, retry_after = resp.status_code, resp.headers.get("Retry-After")
+                last_err = f"HTTP {status}"
+            except Exception as e:  # 请求异常
+                last_err = str(e)
+                logger.exception("submit_export: request error")
+
+            hint = self._on_failure(status, retry_after)
+            if attempt < max_attempts:
+                delay = self._retry_delay(attempt, hint)
+                logger.debug("submit_export: backoff %.2fs before retry", delay)
+                time.sleep(delay)
+
+        result = _failed_result(max_attempts, last_err)
+        result["elapsed_seconds"] = time.monotonic() - start
+        result["attempts"] = max_attempts
+        return result
+
+    def submit_many(self, windows: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """按顺序逐个提交，返回与 windows 一一对应的结果。"""
+        return [self.submit(fr, to) for fr, to in windows]
+
+    def close(self) -> None:
+        self._log_stats()
+        try:
+            self._session.close()
+        except Exception:
+            pass
+
+    def __enter__(self) -> "ExportClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
 def submit_export(cfg: dict, from_date: str, to_date: str, keyword: str = "",
                   search_tab_enum_code: int = 0, extra_body: Optional[Dict[str, Any]] = None,
                   timeout_seconds: int = 30) -> Dict[str, Any]:
-    url = _endpoint_url()
-    headers = compose_headers(cfg)
-    body = build_body(from_date, to_date, keyword, search_tab_enum_code, extra_body)
-    try:
-        logger.debug(
-            "submit_export: url=%s timeout=%s attempts/backoff=%s/%s",
-            url,
-            timeout_seconds,
-            int(cfg.get("retry", {}).get("max_attempts", 3)),
-            int(cfg.get("retry", {}).get("backoff_seconds", 5)),
-        )
-        logger.debug("submit_export: body=%s", body)
-    except Exception:
-        pass
+    """单次提交（临时客户端）；批量提交请复用同一个 ExportClient。"""
+    with ExportClient(cfg) as client:
+        return client.submit(from_date, to_date, keyword, search_tab_enum_code, extra_body, timeout_seconds)
+
 
-    retry_cfg = cfg.get("retry", {})
-    max_attempts = int(retry_cfg.get("max_attempts", 3))
-    backoff_seconds = int(retry_cfg.get("backoff_seconds", 5))
+class AsyncExportClient(_ExportClientBase):
+    """异步导出客户端（http.backend=async，需要可选依赖 httpx）。
 
-    last_err: Optional[str] = None
-    for attempt in range(1, max_attempts + 1):
+    在独立线程中运行一个事件循环并持有 httpx.AsyncClient：submit_many 把一批窗口并发提交，
+    并发数由 http.concurrency 的信号量限制；重试退避使用 asyncio.sleep，不阻塞同批的其它提交。
+    对外接口与 ExportClient 相同（submit / submit_many / close），编排器无需区分；
+    使用独立线程也避免与 Playwright 同步 API 自身的事件循环冲突。
+    """
+
+    def __init__(self, cfg: dict) -> None:
         try:
-            logger.debug("submit_export: attempt=%s/%s", attempt, max_attempts)
-            resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=timeout_seconds)
-            status = resp.status_code
-            text = resp.text
-            data: Optional[Any] = None
+            import httpx  # type: ignore
+        except ImportError as e:
+            raise RuntimeError("http.backend=async 需要依赖 httpx，请先运行: pip install httpx") from e
+        http_cfg = cfg.get("http", {})
+        self._init_common(cfg)
+        self.concurrency = max(1, int(http_cfg.get("concurrency", 4)))
+        pool_size = max(self.concurrency, int(http_cfg.get("pool_size", 4)))
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="export-async", daemon=True)
+        self._thread.start()
+
+        async def _init() -> None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout_seconds,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+            self._sem = asyncio.Semaphore(self.concurrency)
+
+        self._call(_init())
+        logger.debug("export_client_async: url=%s concurrency=%s pool_size=%s timeout=%s attempts/backoff=%s/%s",
+                     self.url, self.concurrency, pool_size, self.timeout_seconds, self.max_attempts, self.backoff_seconds)
+
+    def _call(self, coro: Any) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def asubmit(self, from_date: str, to_date: str, keyword: str = "", search_tab_enum_code: int = 0,
+                      extra_body: Optional[Dict[str, Any]] = None, timeout_seconds: Optional[int] = None) -> Dict[str, Any]:
+        body = build_body(from_date, to_date, keyword, search_tab_enum_code, extra_body)
+        payload = json.dumps(body)
+        timeout = timeout_seconds or self.timeout_seconds
+        logger.debug("submit_export: body=%s", body)
+
+        max_attempts = self.max_attempts
+        last_err: Optional[str] = None
+        start = time.monotonic()
+        for attempt in range(1, max_attempts + 1):
+            status: Optional[int] = None
+            retry_after: Optional[str] = None
             try:
-                data = resp.json()
-            except Exception:
-                data = None
-            ok = 200 <= status < 300
-            logger.debug("submit_export: status=%s text_len=%s", status, len(text) if text else 0)
-            if ok:
-                logger.debug("submit_export: success")
-                return {"ok": True, "status_code": status, "data": data, "text": text}
-            else:
+                async with self._sem:
+                    if self.limiter is not None:
+                        await self.limiter.aacquire()
+                    logger.debug("submit_export: attempt=%s/%s fr=%s to=%s", attempt, max_attempts, from_date, to_date)
+                    resp = await self._client.post(self.url, content=payload, timeout=timeout)
+                data: Optional[Any] = None
+                try:
+                    data = resp.json()
+                except Exception:
+                    data = None
+                result = _result_from_response(resp.status_code, resp.text, data)
+                if result is not None:
+                    self._on_success()
+                    result["elapsed_seconds"] = time.monotonic() - start
+                    result["attempts"] = attempt
+                    return result
+                status, retry_after = resp.status_code, resp.headers.get("Retry-After")
                 last_err = f"HTTP {status}"
-                logger.warning("submit_export: non-2xx status=%s", status)
-        except Exception as e:  # 请求异常
-            last_err = str(e)
-            logger.exception("submit_export: request error")
+            except Exception as e:  # 请求异常
+                last_err = str(e) or type(e).__name__
+                logger.exception("submit_export: request error")
 
-        if attempt < max_attempts:
-            logger.debug("submit_export: backoff %ss before retry", backoff_seconds)
-            time.sleep(backoff_seconds)
+            hint = self._on_failure(status, retry_after)
+            if attempt < max_attempts:
+                # 退避期间释放信号量，其它窗口继续提交
+                delay = self._retry_delay(attempt, hint)
+                logger.debug("submit_export: backoff %.2fs before retry", delay)
+                await asyncio.sleep(delay)
 
-    logger.error("submit_export: failed after %s attempts, last_err=%s", max_attempts, last_err)
-    return {"ok": False, "status_code": None, "data": None, "text": None, "error": last_err}
+        result = _failed_result(max_attempts, last_err)
+        result["elapsed_seconds"] = time.monotonic() - start
+        result["attempts"] = max_attempts
+        return result
+
+    async def asubmit_many(self, windows: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*(self.asubmit(fr, to) for fr, to in windows)))
+
+    def submit(self, from_date: str, to_date: str, keyword: str = "", search_tab_enum_code: int = 0,
+               extra_body: Optional[Dict[str, Any]] = None, timeout_seconds: Optional[int] = None) -> Dict[str, Any]:
+        return self._call(self.asubmit(from_date, to_date, keyword, search_tab_enum_code, extra_body, timeout_seconds))
+
+    def submit_many(self, windows: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """并发提交一批窗口，返回与 windows 一一对应的结果。"""
+        start = time.monotonic()
+        results = self._call(self.asubmit_many(windows))
+        logger.debug("export_client_async: submitted %s windows in %.2fs", len(windows), time.monotonic() - start)
+        return results
+
+    def close(self) -> None:
+        self._log_stats()
+        try:
+            self._call(self._client.aclose())
+        except Exception:
+            pass
+        try:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+        except Exception:
+            pass
+
+    def __enter__(self) -> "AsyncExportClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def open_export_client(cfg: dict) -> Any:
+    """按 http.backend 创建导出客户端：sync（默认，requests 连接池）或 async（httpx 并发提交）。"""
+    backend = str(cfg.get("http", {}).get("backend", "sync")).lower()
+    if backend == "async":
+        return AsyncExportClient(cfg)
+    return ExportClient(cfg)
@@ -0,0 +1,135 @@
+"""
+增量同步（incremental.enabled=true 或 export_runner --incremental）
+- 水位线（watermark）记录“该日及之前已同步完成”的最后一天，保存在 incremental.watermark_path（JSON）
+- 每次运行只导出 [水位线 + 1 - lookback_days, 今天/昨天]，回看天数用于补上迟到的记录；
+  首次运行（尚无水位线）从 start_date 开始做一次全量回溯
+- 回看起点向前对齐到包含它的历史窗口起点，使旧窗口被新窗口整体覆盖；合并时被覆盖的旧 with_data 窗口不再参与
+- 本次运行后，从起点起连续被已完成窗口覆盖的最后一天成为新的水位线（失败的日期不会被越过）
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+from datetime import date, datetime, timedelta
+from pathlib import Path
+import copy
+import json
+import logging
+import os
+
+from .run_state import RunStateStore, from_config as rs_from_cfg, read_records
+from .window_gen import generate_initial_windows
+
+logger = logging.getLogger(__name__)
+
+COMPLETED_STATUSES = ("with_data", "no_data", "manual")
+
+
+@dataclass
+class IncrementalConfig:
+    enabled: bool = False
+    watermark_path: str = "./state/watermark.json"
+    lookback_days: int = 3
+    until: str = "today"
+
+
+def from_config(root_cfg: dict) -> IncrementalConfig:
+    icfg = root_cfg.get("incremental", {})
+    return IncrementalConfig(
+        enabled=bool(icfg.get("enabled", False)),
+        watermark_path=str(icfg.get("watermark_path", "./state/watermark.json")),
+        lookback_days=max(0, int(icfg.get("lookback_days", 3))),
+        until=str(icfg.get("until", "today")).lower(),
+    )
+
+
+def load_watermark(path: str) -> Optional[str]:
+    p = Path(path)
+    if not p.exists():
+        return None
+    try:
+        return str(json.loads(p.read_text(encoding="utf-8")).get("watermark") or "") or None
+    except Exception:
+        logger.exception("incremental: watermark unreadable path=%s", path)
+        return None
+
+
+def save_watermark(path: str, day: str, run_range: Tuple[str, str]) -> None:
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(p.name + ".tmp")
+    tmp.write_text(json.dumps({
+        "watermark": day,
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+        "last_range": list(run_range),
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def _completed_windows(rows: Iterable[Dict[str, str]]) -> Dict[str, Tuple[str, str]]:
+    out: Dict[str, Tuple[str, str]] = {}
+    for row in rows:
+        wid = (row.get("window_id") or "").strip()
+        if (row.get("status") or "").strip() in COMPLETED_STATUSES and wid:
+            out[wid] = ((row.get("from_date") or "").strip(), (row.get("to_date") or "").strip())
+    return out
+
+
+def plan_range(cfg: dict, today: Optional[date] = None) -> Optional[Tuple[str, str]]:
+    """本次增量运行的日期范围；已是最新（起点晚于终点）时返回 None。在打开 RunStateStore 之前调用。"""
+    icfg = from_config(cfg)
+    today = today or date.today()
+    end = today - timedelta(days=1) if icfg.until == "yesterday" else today
+    floor = str(cfg.get("start_date"))
+    mark = load_watermark(icfg.watermark_path)
+    if mark is None:
+        start = floor
+        logger.info("incremental: no watermark yet, backfill from start_date=%s", start)
+    else:
+        start = max(floor, (date.fromisoformat(mark) + timedelta(days=1 - icfg.lookback_days)).isoformat())
+        # 对齐到包含回看起点的历史窗口起点，使该窗口被本次运行整体覆盖（合并时可整体替换）
+        for fr, to in _completed_windows(read_records(rs_from_cfg(cfg))).values():
+            if fr and to and fr < start <= to:
+                start = max(floor, fr)
+        logger.info("incremental: watermark=%s lookback_days=%s -> start=%s", mark, icfg.lookback_days, start)
+    if start > end.isoformat():
+        logger.info("incremental: up to date (start=%s end=%s)", start, end)
+        return None
+    return start, end.isoformat()
+
+
+def run_config(cfg: dict, start: str, end: str) -> dict:
+    """本次运行使用的配置：日期替换为增量范围，并重新导出范围内的全部窗口（不按历史完成记录跳过）。
+    用该配置打开 RunStateStore（resume_mode 取自 store 的配置）。"""
+    out: Dict[str, Any] = copy.deepcopy(cfg)
+    out["start_date"], out["end_date"] = start, end
+    out.setdefault("run_state", {})["resume_mode"] = "full"
+    return out
+
+
+def covered_until(store: RunStateStore, start: str, end: str) -> Optional[str]:
+    """从 start 起连续被已完成窗口覆盖的最后一天；start 当天未覆盖时返回 None。"""
+    covered = set()
+    for fr, to in _completed_windows(store.records()).values():
+        if fr and to and to >= start and fr <= end:
+            covered.update(d for d, _ in generate_initial_windows(max(fr, start), min(to, end), 1))
+    last: Optional[str] = None
+    for day, _ in generate_initial_windows(start, end, 1):
+        if day not in covered:
+            break
+        last = day
+    return last
+
+
+def advance_watermark(cfg: dict, store: RunStateStore, run_range: Tuple[str, str]) -> Optional[str]:
+    """运行结束后推进水位线（只前进不后退），返回新的水位线。"""
+    icfg = from_config(cfg)
+    old = load_watermark(icfg.watermark_path)
+    last = covered_until(store, run_range[0], run_range[1])
+    if last is None:
+        logger.warning("incremental: watermark not advanced, %s not completed (old=%s)", run_range[0], old)
+        return old
+    if old is not None and last <= old:
+        logger.info("incremental: watermark unchanged old=%s covered_until=%s", old, last)
+        return old
+    save_watermark(icfg.watermark_path, last, run_range)
+    logger.info("incremental: watermark %s -> %s", old, last)
+    return last
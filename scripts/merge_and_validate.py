@@ -1,62 +1,77 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional, Any, Callable, Set
 from pathlib import Path
-import pandas as pd
-import csv
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, closing, ExitStack
+from functools import partial
+import hashlib
+import json
+import logging
+import pickle
+import tempfile
+import time
 import warnings
 
+from openpyxl import load_workbook
 
-def _load_with_data(csv_path: Path, encoding: str = "utf-8-sig") -> Tuple[List[str], int]:
+from .run_state import RunStateStore, from_config as rs_from_cfg, read_records
+from .merge_writers import open_writer, output_path_for
+from .hashing import algo_of, digest_file
+from .window_gen import generate_initial_windows
+
+logger = logging.getLogger(__name__)
+
+
+def _window_days(row: Dict[str, str]) -> Set[str]:
+    fr, to = (row.get("from_date") or "").strip(), (row.get("to_date") or "").strip()
+    try:
+        return {d for d, _ in generate_initial_windows(fr, to, 1)} if fr and to else set()
+    except ValueError:
+        return set()
+
+
+def _current_with_data(rows: Iterable[Dict[str, str]]) -> List[Dict[str, str]]:
+    """按记录顺序保留当前有效的 with_data 行：日期被更晚的 with_data 行完全覆盖的旧行、
+    以及指向同一文件的旧行（同一窗口重新导出）不再参与合并，避免重跑/增量回看时重复计入。"""
+    data_rows = [r for r in rows if (r.get("status") or "").strip() == "with_data"]
+    covered: Set[str] = set()
+    seen_files: Set[str] = set()
+    keep: List[bool] = [False] * len(data_rows)
+    for i in range(len(data_rows) - 1, -1, -1):
+        row = data_rows[i]
+        days = _window_days(row)
+        fp = (row.get("file_path") or "").strip()
+        if (days and days <= covered) or (fp and fp in seen_files):
+            logger.debug("merge: superseded window_id=%s file=%s", row.get("window_id"), fp)
+            continue
+        keep[i] = True
+        covered |= days
+        if fp:
+            seen_files.add(fp)
+    return [r for r, k in zip(data_rows, keep) if k]
+
+
+def _load_with_data(rows: Iterable[Dict[str, str]]) -> Tuple[List[str], List[str], List[int], int]:
     files: List[str] = []
+    md5s: List[str] = []
+    declared: List[int] = []
     total = 0
-    if not csv_path.exists():
-        return files, total
-    with csv_path.open("r", encoding=encoding, newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if (row.get("status") or "").strip() != "with_data":
-                continue
-            fp = (row.get("file_path") or "").strip()
-            try:
-                dc = int((row.get("declared_count") or "0").strip() or 0)
-            except ValueError:
-                dc = 0
-            if fp:
-                files.append(fp)
-            total += dc
-    return files, total
-
-
-def _merge_files(files: List[str], out_path: Path) -> Path:
-    if not files:
-        return out_path
-    frames: List[pd.DataFrame] = []
-    for fp in files:
-        p = Path(fp)
-        if not p.exists():
-            continue
+    for row in _current_with_data(rows):
+        fp = (row.get("file_path") or "").strip()
         try:
-            with warnings.catch_warnings():
-                warnings.filterwarnings(
-                    "ignore",
-                    message="Workbook contains no default style, apply openpyxl's default",
-                    category=UserWarning,
-                    module="openpyxl.styles.stylesheet",
-                )
-                df = pd.read_excel(p, engine="openpyxl")
-            frames.append(df)
-        except Exception:
-            continue
-    if not frames:
-        return out_path
-    # 对齐列并纵向合并
-    all_cols = []
-    for df in frames:
-        for c in df.columns:
-            if c not in all_cols:
-                all_cols.append(c)
-    frames = [df.reindex(columns=all_cols) for df in frames]
-    merged = pd.concat(frames, ignore_index=True)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
+            dc = int((row.get("declared_count") or "0").strip() or 0)
+        except ValueError:
+            dc = 0
+        if fp:
+            files.append(fp)
+            md5s.append((row.get("file_md5") or "").strip())
+            declared.append(dc)
+        total += dc
+    return files, md5s, declared, total
+
+
+@contextmanager
+def _quiet_openpyxl() -> Iterator[None]:
     with warnings.catch_warnings():
         warnings.filterwarnings(
             "ignore",
@@ -64,17 +79,412 @@ def _merge_files(files: List[str], out_path: Path) -> Path:
             category=UserWarning,
             module="openpyxl.styles.stylesheet",
         )
-        merged.to_excel(out_path, index=False)
-    return out_path
+        yield
+
+
+def _iter_rows(path: Path) -> Iterator[Tuple[Any, ...]]:
+    """只读模式逐行读取首个工作表（与 pd.read_excel 默认一致），不把整个文件载入内存。"""
+    with _quiet_openpyxl():
+        wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        # 部分导出文件的 dimension 信息不准确，重置后按实际行读取，避免截断
+        ws.reset_dimensions()
+        for row in ws.iter_rows(values_only=True):
+            if any(v is not None and v != "" for v in row):
+                yield row
+    finally:
+        wb.close()
+
+
+def _header_names(raw: Tuple[Any, ...]) -> List[str]:
+    return [str(v) if v is not None and v != "" else f"Unnamed: {i}" for i, v in enumerate(raw)]
+
+
+# (输入文件序号, 列头, 数据行迭代器工厂)
+Part = Tuple[int, List[str], Callable[[], Iterator[Tuple[Any, ...]]]]
+
+
+def _md5_file(path: Path, algo: str = "md5") -> str:
+    # 与下载时记录的摘要使用同一算法（file_md5 带 "<算法>:" 前缀时按前缀计算）
+    return digest_file(path, algo)
+
+
+def _cache_name(key: str) -> str:
+    return key.replace(":", "_")
+
+
+def _iter_data_rows(path: Path) -> Iterator[Tuple[Any, ...]]:
+    rows = _iter_rows(path)
+    next(rows, None)
+    yield from rows
+
+
+def _meta_path(part: Path) -> Path:
+    # 中间文件旁的小清单：源文件大小/修改时间、列头与行数，判断缓存命中时不必反序列化整个中间文件
+    return part.with_suffix(".json")
+
+
+def _write_meta(part: Path, fp: str, st: Any, header: Optional[List[str]], rows: int) -> None:
+    meta = _meta_path(part)
+    tmp = meta.with_name(meta.name + ".tmp")
+    tmp.write_text(json.dumps({"source": fp, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                               "header": header, "rows": rows}, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(meta)
+
+
+def _parse_to_intermediate(fp: str, part_path: str) -> Dict[str, Any]:
+    """解析单个 xlsx 并按列 pickle 到 part_path（进程池 worker，也用于生成解析缓存），只返回元信息。
+
+    同时在旁边写入 {名称}.json 清单（source、size、mtime_ns、header、rows），供 _cached_meta 判断命中；
+    空文件只写清单（header 为 null），同样可以命中缓存，不必每次重新解析。
+    """
+    t0 = time.perf_counter()
+    result: Dict[str, Any] = {"source": fp, "header": None, "part": part_path, "rows": 0, "seconds": 0.0, "error": ""}
+    p = Path(fp)
+    try:
+        st = p.stat()
+        rows = list(_iter_rows(p))
+        if rows:
+            header = _header_names(rows[0])
+            data = rows[1:]
+            columns = [[r[i] if i < len(r) else None for r in data] for i in range(len(header))]
+            tmp = Path(part_path + ".tmp")
+            with tmp.open("wb") as f:
+                pickle.dump({"source": fp, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                             "header": header, "columns": columns}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp.replace(part_path)
+            _write_meta(Path(part_path), fp, st, header, len(data))
+            result.update(header=header, rows=len(data))
+        else:
+            _write_meta(Path(part_path), fp, st, None, 0)
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - t0
+    return result
+
+
+def cache_intermediate(fp: str, digest: str, cache_dir: str) -> Dict[str, Any]:
+    """运行中预先把单个下载文件转换为解析缓存（{摘要}.pkl），之后的合并直接命中缓存。
+
+    返回与 _parse_to_intermediate 相同的元信息，另加 cached（缓存已存在时为 True，rows 取自缓存清单）。
+    """
+    part_dir = Path(cache_dir)
+    part_dir.mkdir(parents=True, exist_ok=True)
+    p = Path(fp)
+    part = part_dir / f"{_cache_name(digest or _md5_file(p))}.pkl"
+    meta = _cached_meta(part, p)
+    if meta is not None:
+        return {"source": fp, "header": meta["header"], "part": str(part), "rows": meta["rows"],
+                "seconds": 0.0, "error": "", "cached": True}
+    return dict(_parse_to_intermediate(fp, str(part)), cached=False)
+
+
+def count_data_rows(fp: str) -> int:
+    """流式统计数据行数（不含列头）。"""
+    with closing(_iter_data_rows(Path(fp))) as rows:
+        return sum(1 for _ in rows)
+
+
+def _load_intermediate(part: str) -> Iterator[Tuple[Any, ...]]:
+    with open(part, "rb") as f:
+        data = pickle.load(f)
+    yield from zip(*data["columns"])
+
+
+def _cached_meta(part: Path, src: Path) -> Optional[Dict[str, Any]]:
+    """解析缓存命中（中间文件与清单都存在且源文件大小/修改时间未变）时返回清单（header、rows），否则返回 None。
+
+    只读取旁边的 JSON 清单，中间文件本身到写出阶段才反序列化一次；没有清单的旧缓存按未命中重新解析。
+    空文件的清单 header 为 None、没有中间文件，同样算命中。
+    """
+    try:
+        meta = json.loads(_meta_path(part).read_text(encoding="utf-8"))
+        st = src.stat()
+        if meta.get("size") != st.st_size or meta.get("mtime_ns") != st.st_mtime_ns:
+            return None
+        if meta.get("header") is None:
+            return {"header": None, "rows": 0}
+        if not part.exists():
+            return None
+        return {"header": list(meta["header"]), "rows": int(meta["rows"])}
+    except Exception:
+        return None
+
+
+
+def _parse_many(jobs: List[Tuple[str, str]], workers: int) -> Dict[str, Dict[str, Any]]:
+    """解析 (源文件, 中间文件) 列表；workers>1 时使用进程池并报告相对串行的加速比。"""
+    if not jobs:
+        return {}
+    t0 = time.perf_counter()
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_parse_to_intermediate, [j[0] for j in jobs], [j[1] for j in jobs]))
+        wall = time.perf_counter() - t0
+        serial_equiv = sum(r["seconds"] for r in results)
+        logger.info("merge: parallel parse workers=%s files=%s wall=%.2fs serial_equiv=%.2fs speedup=%.2fx",
+                    workers, len(jobs), wall, serial_equiv, serial_equiv / wall if wall > 0 else 0.0)
+    else:
+        results = [_parse_to_intermediate(fp, part) for fp, part in jobs]
+    return {r["part"]: r for r in results}
+
+
+def _collect_serial(files: List[Path], skipped: Dict[int, str]) -> List[Part]:
+    # 只读取每个文件的首行得到列头，数据行在写出阶段再逐文件流式读取
+    parts: List[Part] = []
+    for idx, p in enumerate(files):
+        try:
+            with closing(_iter_rows(p)) as rows:
+                header = next(rows, None)
+        except Exception as e:
+            logger.exception("merge: cannot read, skipped: %s", p)
+            skipped[idx] = f"read_error: {e}"
+            continue
+        if header is None:
+            skipped[idx] = "empty"
+            continue
+        parts.append((idx, _header_names(header), partial(_iter_data_rows, p)))
+    return parts
+
+
+def _collect_intermediate(files: List[Path], md5s: List[str], workers: int, part_dir: Path, use_cache: bool,
+                          skipped: Dict[int, str]) -> Tuple[List[Part], List[str], int]:
+    """经由中间文件收集各文件数据，返回 (parts, 中间文件名列表, 本次实际解析的文件数)。
+
+    use_cache=True 时 part_dir 为解析缓存目录，中间文件以源文件 md5 命名并跨次运行复用；
+    只有新增或内容变化的文件才会重新解析。
+    """
+    targets: List[Tuple[Path, Path, Optional[Dict[str, Any]]]] = []
+    jobs: List[Tuple[str, str]] = []
+    queued: Set[str] = set()
+    for idx, p in enumerate(files):
+        meta: Optional[Dict[str, Any]] = None
+        if use_cache:
+            key = md5s[idx] or _md5_file(p)
+            part = part_dir / f"{_cache_name(key)}.pkl"
+            meta = _cached_meta(part, p)
+            if meta is None and md5s[idx]:
+                # 记录的 md5 可能已过期（文件被手工替换），按实际内容重新计算
+                actual = _md5_file(p, algo_of(key))
+                if actual != key:
+                    part = part_dir / f"{_cache_name(actual)}.pkl"
+                    meta = _cached_meta(part, p)
+        else:
+            part = part_dir / f"part_{idx:06d}.pkl"
+        if meta is None and str(part) not in queued:
+            queued.add(str(part))
+            jobs.append((str(p), str(part)))
+        targets.append((p, part, meta))
+    if use_cache:
+        hits = sum(1 for t in targets if t[2] is not None)
+        logger.info("merge: parse cache hits=%s misses=%s dir=%s", hits, len(files) - hits, part_dir)
+    results = _parse_many(jobs, workers)
+
+    parts: List[Part] = []
+    names: List[str] = []
+    for idx, (p, part, meta) in enumerate(targets):
+        if meta is None:
+            r = results.get(str(part), {})
+            if r.get("error"):
+                logger.warning("merge: cannot read, skipped: %s (%s)", p, r.get("error"))
+                skipped[idx] = f"read_error: {r.get('error')}"
+                continue
+            header = r.get("header")
+        else:
+            header = meta["header"]
+        if header is None:
+            skipped[idx] = "empty"
+            # 空文件也记入合并清单：输入集合不变时整体命中，直接复用上次的合并结果
+            names.append(_meta_path(part).name)
+            continue
+        parts.append((idx, header, partial(_load_intermediate, str(part))))
+        names.append(part.name)
+    return parts, names, len(jobs)
+
+
+class _Validator:
+    """在写出的同一遍流式遍历中完成校验：
+
+    - 逐文件统计数据行数，与机器人消息的 declared_count 比对
+    - 按去重键（dedup_key 列的取值）计算 8 字节 blake2b 摘要，放入集合做哈希索引，重复记录只保留首次出现
+    """
+
+    def __init__(self, key_cols: List[str], col_pos: Dict[str, int]) -> None:
+        missing = [c for c in key_cols if c not in col_pos]
+        if key_cols and missing:
+            logger.warning("merge: dedup key columns not found %s, dedup disabled", missing)
+        self.key_cols = key_cols if key_cols and not missing else []
+        self._key_idx = [col_pos[c] for c in self.key_cols]
+        self._seen: Set[bytes] = set()
+        self.files: List[Dict[str, Any]] = []
+
+    def is_duplicate(self, row: List[Any]) -> bool:
+        if not self._key_idx:
+            return False
+        key = "\x1f".join("" if row[i] is None else str(row[i]) for i in self._key_idx)
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        if digest in self._seen:
+            return True
+        self._seen.add(digest)
+        return False
+
+    def add_file(self, source: str, declared: Optional[int], rows: int, duplicates: int) -> None:
+        ok = declared is None or declared == rows
+        if not ok:
+            logger.warning("merge: row count mismatch file=%s declared=%s rows=%s", source, declared, rows)
+        self.files.append({"file": source, "declared_count": declared, "rows": rows,
+                           "count_ok": ok, "duplicates_dropped": duplicates})
+
+
+def _write_report(path: Path, validator: _Validator, skipped: List[Dict[str, str]], outputs: List[Path], total_rows: int) -> None:
+    mismatched = [f for f in validator.files if not f["count_ok"]]
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "outputs": [str(o) for o in outputs],
+        "dedup_key": validator.key_cols,
+        "files_merged": len(validator.files),
+        "rows_read": sum(f["rows"] for f in validator.files),
+        "rows_written": total_rows,
+        "duplicates_dropped": sum(f["duplicates_dropped"] for f in validator.files),
+        "count_mismatches": len(mismatched),
+        "files_skipped": skipped,
+        "files": validator.files,
+    }
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    logger.info("merge: validation report rows_read=%s written=%s duplicates=%s mismatches=%s skipped=%s -> %s",
+                report["rows_read"], total_rows, report["duplicates_dropped"], len(mismatched), len(skipped), path)
+
+
+def _merge_files(files: List[str], out_path: Path, workers: int = 1, md5s: Optional[List[str]] = None,
+                 cache_dir: Optional[str] = None, formats: Optional[List[str]] = None,
+                 writer_options: Optional[Dict[str, Any]] = None, declared: Optional[List[int]] = None,
+                 dedup_key: Optional[List[str]] = None) -> Path:
+    """流式合并：按窗口顺序逐文件写入各输出写入器，内存占用与文件数量无关。
+
+    输出列为各文件列头按首次出现顺序的并集。write-only 写出必须先写列头，
+    因此先确定每个文件的列头，再逐文件写数据行（缺失列留空）。
+    - workers>1：用进程池并行解析 xlsx 为中间文件，再按原顺序写出
+    - cache_dir：按 file_md5 缓存每个文件的解析结果，重复合并时只解析新增/变化的文件；
+      输入与上次完全一致且输出已存在时直接跳过
+    - formats：输出格式列表（xlsx/csv/jsonl/parquet），见 merge_writers；返回第一个格式的输出路径
+    - declared / dedup_key：同一遍写出中校验行数、按键去重，并在输出旁生成 *_validation.json 报告
+    """
+    fmts = [f.lower() for f in (formats or ["xlsx"])]
+    options = dict(writer_options or {})
+    outputs = [output_path_for(out_path, f, str(options.get("partition_by") or "").lower()) for f in fmts]
+    if not files:
+        return outputs[0]
+    t0 = time.perf_counter()
+    md5_list = list(md5s) if md5s is not None else [""] * len(files)
+    declared_list: List[Optional[int]] = list(declared) if declared is not None else [None] * len(files)
+    key_cols = list(dedup_key or [])
+    report_path = out_path.with_name(f"{out_path.stem}_validation.json")
+    existing: List[Path] = []
+    existing_md5: List[str] = []
+    existing_declared: List[Optional[int]] = []
+    skipped_report: List[Dict[str, str]] = []
+    for fp, md5, dc in zip(files, md5_list, declared_list):
+        if not Path(fp).exists():
+            logger.warning("merge: file missing, skipped: %s", fp)
+            skipped_report.append({"file": fp, "reason": "missing"})
+            continue
+        existing.append(Path(fp))
+        existing_md5.append(md5)
+        existing_declared.append(dc)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    skipped: Dict[int, str] = {}
+    with ExitStack() as stack:
+        manifest_path: Optional[Path] = None
+        names: List[str] = []
+        if cache_dir:
+            part_dir = Path(cache_dir)
+            part_dir.mkdir(parents=True, exist_ok=True)
+            parts, names, parsed = _collect_intermediate(existing, existing_md5, workers, part_dir, True, skipped)
+            manifest_path = part_dir / "merge_manifest.json"
+            manifest = {"outputs": [str(o) for o in outputs], "parts": names, "dedup_key": key_cols}
+            if (parsed == 0 and all(o.exists() for o in outputs) and report_path.exists()
+                    and _read_manifest(manifest_path) == manifest):
+                logger.info("merge: inputs unchanged, reuse %s", [str(o) for o in outputs])
+                return outputs[0]
+        elif workers > 1:
+            part_dir = Path(stack.enter_context(tempfile.TemporaryDirectory(dir=str(out_path.parent))))
+            parts, _, _ = _collect_intermediate(existing, existing_md5, workers, part_dir, False, skipped)
+        else:
+            parts = _collect_serial(existing, skipped)
+        skipped_report.extend({"file": str(existing[i]), "reason": r} for i, r in sorted(skipped.items()))
+        if not parts:
+            return outputs[0]
+
+        all_cols: List[str] = []
+        col_pos: Dict[str, int] = {}
+        for _, header, _ in parts:
+            for c in header:
+                if c not in col_pos:
+                    col_pos[c] = len(all_cols)
+                    all_cols.append(c)
+
+        validator = _Validator(key_cols, col_pos)
+        writers = [open_writer(f, out_path, all_cols, options) for f in fmts]
+        total_rows = 0
+        try:
+            for idx, header, rows_factory in parts:
+                mapping = [col_pos[c] for c in header]
+                n_rows = n_dup = 0
+                for row in rows_factory():
+                    n_rows += 1
+                    out: List[Any] = [None] * len(all_cols)
+                    for i, v in enumerate(row[:len(mapping)]):
+                        out[mapping[i]] = v
+                    if validator.is_duplicate(out):
+                        n_dup += 1
+                        continue
+                    for w in writers:
+                        w.write(out)
+                    total_rows += 1
+                validator.add_file(str(existing[idx]), existing_declared[idx], n_rows, n_dup)
+        finally:
+            for w in writers:
+                w.close()
+        _write_report(report_path, validator, skipped_report, outputs, total_rows)
+        if manifest_path is not None:
+            manifest_path.write_text(json.dumps({"outputs": [str(o) for o in outputs], "parts": names, "dedup_key": key_cols},
+                                                ensure_ascii=False), encoding="utf-8")
+    logger.info("merge: files=%s rows=%s cols=%s workers=%s elapsed=%.2fs -> %s",
+                len(parts), total_rows, len(all_cols), workers, time.perf_counter() - t0, [str(o) for o in outputs])
+    return outputs[0]
+
+
+def _read_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
 
 
-def merge_run_state(cfg: dict) -> Path:
-    rs = cfg.get("run_state", {})
-    csv_path = Path(rs.get("csv_path", "./state/run_windows.csv"))
-    encoding = rs.get("encoding", "utf-8-sig")
-    files, total = _load_with_data(csv_path, encoding=encoding)
+def merge_run_state(cfg: dict, store: Optional[RunStateStore] = None) -> Path:
+    # 优先复用编排阶段已建立索引的 store，避免再次扫描 CSV
+    rows = store.records("with_data") if store is not None else read_records(rs_from_cfg(cfg))
+    files, md5s, declared, total = _load_with_data(rows)
 
     merge_cfg = cfg.get("merge", {})
     pattern = merge_cfg.get("output_path_pattern", "./output/merged/合同协同_汇总.xlsx")
     out_path = Path(pattern.replace("{TOTAL}", str(total)))
-    return _merge_files(files, out_path)
+    workers = int(merge_cfg.get("workers", 1))
+    cache_dir = merge_cfg.get("cache_dir") or None
+    formats = merge_cfg.get("formats") or ["xlsx"]
+    if isinstance(formats, str):
+        formats = [formats]
+    dedup_key = merge_cfg.get("dedup_key") or []
+    if isinstance(dedup_key, str):
+        dedup_key = [dedup_key]
+    writer_options = {
+        "partition_by": merge_cfg.get("partition_by", ""),
+        "partition_column": merge_cfg.get("partition_column", ""),
+        "parquet_compression": merge_cfg.get("parquet_compression", "zstd"),
+        "csv_encoding": merge_cfg.get("csv_encoding", "utf-8-sig"),
+    }
+    return _merge_files(files, out_path, workers=workers, md5s=md5s, cache_dir=cache_dir,
+                        formats=list(formats), writer_options=writer_options,
+                        declared=declared, dedup_key=list(dedup_key))
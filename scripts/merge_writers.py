@@ -0,0 +1,205 @@
+"""
+合并输出写入器
+- xlsx：write-only 工作簿（单表上限 1,048,576 行）
+- csv / jsonl：逐行追加写出
+- parquet：分批写出，支持压缩（需要可选依赖 pyarrow）
+- 按月分区：按指定列的日期拆分为 <输出名>/month=YYYY-MM/part.<ext>
+"""
+from typing import Any, Dict, List, Optional, Sequence
+from pathlib import Path
+from datetime import date, datetime
+import csv
+import json
+import logging
+import re
+import warnings
+
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
+
+XLSX_MAX_ROWS = 1_048_576
+FORMATS = ("xlsx", "csv", "jsonl", "parquet")
+
+
+def _to_text(v: Any) -> Optional[str]:
+    if v is None:
+        return None
+    if isinstance(v, (datetime, date)):
+        return v.isoformat(sep=" ") if isinstance(v, datetime) else v.isoformat()
+    return str(v)
+
+
+class RowWriter:
+    def __init__(self, path: Path, columns: List[str]) -> None:
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, row: Sequence[Any]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+
+class XlsxWriter(RowWriter):
+    def __init__(self, path: Path, columns: List[str]) -> None:
+        super().__init__(path, columns)
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet()
+        self._ws.append(columns)
+
+    def write(self, row: Sequence[Any]) -> None:
+        self._ws.append(list(row))
+        self.rows += 1
+
+    def close(self) -> None:
+        if self.rows + 1 > XLSX_MAX_ROWS:
+            logger.error("merge_writers: xlsx rows=%s exceed the sheet limit %s, use csv/parquet or partition_by=month: %s",
+                         self.rows, XLSX_MAX_ROWS, self.path)
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore",
+                message="Workbook contains no default style, apply openpyxl's default",
+                category=UserWarning,
+                module="openpyxl.styles.stylesheet",
+            )
+            self._wb.save(self.path)
+
+
+class CsvWriter(RowWriter):
+    def __init__(self, path: Path, columns: List[str], encoding: str = "utf-8-sig") -> None:
+        super().__init__(path, columns)
+        self._fh = path.open("w", encoding=encoding, newline="")
+        self._writer = csv.writer(self._fh)
+        self._writer.writerow(columns)
+
+    def write(self, row: Sequence[Any]) -> None:
+        self._writer.writerow(["" if v is None else _to_text(v) for v in row])
+        self.rows += 1
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class JsonlWriter(RowWriter):
+    def __init__(self, path: Path, columns: List[str]) -> None:
+        super().__init__(path, columns)
+        self._fh = path.open("w", encoding="utf-8", newline="\n")
+
+    def write(self, row: Sequence[Any]) -> None:
+        rec = {c: _to_text(v) if isinstance(v, (datetime, date)) else v for c, v in zip(self.columns, row)}
+        self._fh.write(json.dumps(rec, ensure_ascii=False, default=str))
+        self._fh.write("\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class ParquetWriter(RowWriter):
+    """分批写 Parquet。导出文件的单元格以文本为主且各文件类型不一定一致，统一按字符串列写出，由下游按需转换。"""
+
+    def __init__(self, path: Path, columns: List[str], compression: str = "zstd", batch_rows: int = 20_000) -> None:
+        super().__init__(path, columns)
+        try:
+            import pyarrow as pa  # type: ignore
+            import pyarrow.parquet as pq  # type: ignore
+        except ImportError as e:
+            raise RuntimeError("输出 parquet 需要依赖 pyarrow，请先运行: pip install pyarrow") from e
+        self._pa = pa
+        self._schema = pa.schema([(c, pa.string()) for c in columns])
+        self._writer = pq.ParquetWriter(str(path), self._schema, compression=compression)
+        self._batch: List[List[Optional[str]]] = [[] for _ in columns]
+        self._batch_rows = max(1, batch_rows)
+        self._pending = 0
+
+    def write(self, row: Sequence[Any]) -> None:
+        for i, col in enumerate(self._batch):
+            col.append(_to_text(row[i]) if i < len(row) else None)
+        self._pending += 1
+        self.rows += 1
+        if self._pending >= self._batch_rows:
+            self._flush_batch()
+
+    def _flush_batch(self) -> None:
+        if not self._pending:
+            return
+        arrays = [self._pa.array(col, type=self._pa.string()) for col in self._batch]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+        self._batch = [[] for _ in self.columns]
+        self._pending = 0
+
+    def close(self) -> None:
+        self._flush_batch()
+        self._writer.close()
+
+
+def _month_key(v: Any) -> str:
+    if isinstance(v, (datetime, date)):
+        return v.strftime("%Y-%m")
+    m = re.search(r"(\d{4})\s*[-/.年]\s*(\d{1,2})", str(v or ""))
+    if m:
+        return f"{int(m.group(1)):04d}-{int(m.group(2)):02d}"
+    return "unknown"
+
+
+class MonthPartitionedWriter(RowWriter):
+    """按 partition_column 的年月把行分发到 <base_dir>/month=YYYY-MM/part.<ext>，每个分区一个底层写入器。"""
+
+    def __init__(self, base_dir: Path, columns: List[str], fmt: str, partition_column: str, options: Dict[str, Any]) -> None:
+        self.path = base_dir
+        self.columns = columns
+        self.rows = 0
+        self._fmt = fmt
+        self._options = options
+        self._col_idx = columns.index(partition_column) if partition_column in columns else -1
+        if self._col_idx < 0:
+            logger.warning("merge_writers: partition column '%s' not found, all rows go to month=unknown", partition_column)
+        self._writers: Dict[str, RowWriter] = {}
+
+    def write(self, row: Sequence[Any]) -> None:
+        key = _month_key(row[self._col_idx]) if 0 <= self._col_idx < len(row) else "unknown"
+        w = self._writers.get(key)
+        if w is None:
+            w = _open_single(self._fmt, self.path / f"month={key}" / f"part.{self._fmt}", self.columns, self._options)
+            self._writers[key] = w
+        w.write(row)
+        self.rows += 1
+
+    def close(self) -> None:
+        for w in self._writers.values():
+            w.close()
+        logger.debug("merge_writers: partitions=%s base=%s", sorted(self._writers), self.path)
+
+
+def _open_single(fmt: str, path: Path, columns: List[str], options: Dict[str, Any]) -> RowWriter:
+    if fmt == "xlsx":
+        return XlsxWriter(path, columns)
+    if fmt == "csv":
+        return CsvWriter(path, columns, encoding=options.get("csv_encoding", "utf-8-sig"))
+    if fmt == "jsonl":
+        return JsonlWriter(path, columns)
+    if fmt == "parquet":
+        return ParquetWriter(path, columns, compression=options.get("parquet_compression", "zstd"))
+    raise ValueError(f"不支持的输出格式: {fmt}（可选: {', '.join(FORMATS)}）")
+
+
+def output_path_for(base: Path, fmt: str, partition_by: str = "") -> Path:
+    """由 output_path_pattern 得到各格式的输出路径；按月分区时为同名目录。"""
+    if partition_by == "month":
+        return base.with_suffix("")
+    return base.with_suffix(f".{fmt}")
+
+
+def open_writer(fmt: str, base: Path, columns: List[str], options: Dict[str, Any]) -> RowWriter:
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的输出格式: {fmt}（可选: {', '.join(FORMATS)}）")
+    partition_by = str(options.get("partition_by") or "").lower()
+    path = output_path_for(base, fmt, partition_by)
+    if partition_by == "month":
+        return MonthPartitionedWriter(path, columns, fmt, str(options.get("partition_column") or ""), options)
+    return _open_single(fmt, path, columns, options)
@@ -0,0 +1,164 @@
+"""
+分阶段耗时统计与指标导出
+- PhaseTimer：单个窗口各阶段耗时，写入运行状态 CSV 的 <阶段>_ms 列
+  - chat：会话健康检查与消息基线快照（逐窗口模式）
+  - export：导出请求（含限速等待与重试退避）
+  - wait：提交成功到机器人消息出现
+  - download：下载落盘（摘要在写入时同步计算，包含在内）
+  - rename：按标准名重命名（后台处理池中执行）
+  - post：下载后的其余后台处理（摘要补算、行数核对、中间文件转换），不占用主循环
+- RunMetrics：汇总整个运行的阶段耗时直方图、窗口状态计数与限速器快照，
+  运行结束时写出 Prometheus 文本（node_exporter textfile collector 可直接采集）和/或 JSON
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("chat", "export", "wait", "download", "rename", "post")
+PHASE_COLUMNS = [f"{p}_ms" for p in PHASES]
+BUCKETS_SECONDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+METRIC_PREFIX = "feishu_export"
+
+
+class PhaseTimer:
+    """记录单个窗口各阶段耗时（秒）；同一阶段多次计时累加。"""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase: str, seconds: Optional[float]) -> None:
+        if seconds is None:
+            return
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + max(0.0, float(seconds))
+
+    def columns(self) -> Dict[str, int]:
+        return {f"{p}_ms": int(round(s * 1000)) for p, s in self.seconds.items() if p in PHASES}
+
+
+def _quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _fmt(value: float) -> str:
+    return repr(round(float(value), 6))
+
+
+class RunMetrics:
+    """一次运行的指标汇总：observe_row 接收写入运行状态的每一行，write 在运行结束时导出。"""
+
+    def __init__(self, cfg: dict) -> None:
+        mcfg = cfg.get("metrics", {})
+        self.textfile_path = str(mcfg.get("textfile_path", "") or "")
+        self.json_path = str(mcfg.get("json_path", "") or "")
+        self.started = time.monotonic()
+        self.started_at = datetime.now()
+        self.windows: Dict[str, int] = {}
+        self.phase_values: Dict[str, List[float]] = {p: [] for p in PHASES}
+        self.window_seconds: List[float] = []
+
+    def observe_row(self, row: Dict[str, Any]) -> None:
+        status = str(row.get("status") or "")
+        self.windows[status] = self.windows.get(status, 0) + 1
+        for phase in PHASES:
+            ms = row.get(f"{phase}_ms")
+            if ms not in (None, ""):
+                self.phase_values[phase].append(int(ms) / 1000.0)
+        if row.get("duration_ms") not in (None, ""):
+            self.window_seconds.append(int(row["duration_ms"]) / 1000.0)
+
+    def summary(self, rate_limit: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        phases: Dict[str, Dict[str, Any]] = {}
+        for phase, values in self.phase_values.items():
+            if not values:
+                continue
+            phases[phase] = {
+                "count": len(values),
+                "sum_seconds": round(sum(values), 3),
+                "mean_seconds": round(sum(values) / len(values), 3),
+                "p50_seconds": round(_quantile(values, 0.5), 3),
+                "p95_seconds": round(_quantile(values, 0.95), 3),
+                "max_seconds": round(max(values), 3),
+            }
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "run_seconds": round(time.monotonic() - self.started, 3),
+            "windows": dict(self.windows),
+            "window_seconds_sum": round(sum(self.window_seconds), 3),
+            "phases": phases,
+            "rate_limit": dict(rate_limit or {}),
+        }
+
+    def _prometheus(self, summary: Dict[str, Any]) -> str:
+        p = METRIC_PREFIX
+        lines: List[str] = [
+            f"# HELP {p}_phase_seconds Time spent per window in each phase.",
+            f"# TYPE {p}_phase_seconds histogram",
+        ]
+        for phase, values in self.phase_values.items():
+            if not values:
+                continue
+            for le in BUCKETS_SECONDS:
+                lines.append(f'{p}_phase_seconds_bucket{{phase="{phase}",le="{le}"}} {sum(1 for v in values if v <= le)}')
+            lines.append(f'{p}_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {len(values)}')
+            lines.append(f'{p}_phase_seconds_sum{{phase="{phase}"}} {_fmt(sum(values))}')
+            lines.append(f'{p}_phase_seconds_count{{phase="{phase}"}} {len(values)}')
+        lines += [f"# HELP {p}_windows Windows recorded in this run by status.", f"# TYPE {p}_windows gauge"]
+        for status, n in sorted(self.windows.items()):
+            lines.append(f'{p}_windows{{status="{status}"}} {n}')
+        lines += [
+            f"# HELP {p}_run_seconds Wall-clock duration of the run.",
+            f"# TYPE {p}_run_seconds gauge",
+            f"{p}_run_seconds {_fmt(summary['run_seconds'])}",
+            f"# HELP {p}_last_run_timestamp_seconds Unix time when the metrics were written.",
+            f"# TYPE {p}_last_run_timestamp_seconds gauge",
+            f"{p}_last_run_timestamp_seconds {_fmt(time.time())}",
+        ]
+        rl = summary.get("rate_limit") or {}
+        for key, help_text in (("rate_per_sec", "Export rate limiter rate at the end of the run."),
+                               ("acquired", "Export requests that passed the rate limiter."),
+                               ("throttled", "Throttle responses (429/5xx) seen by the rate limiter."),
+                               ("waited_seconds", "Total time export requests waited for the rate limiter.")):
+            if key in rl:
+                lines += [f"# HELP {p}_rate_limit_{key} {help_text}", f"# TYPE {p}_rate_limit_{key} gauge",
+                          f"{p}_rate_limit_{key} {_fmt(rl[key])}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, rate_limit: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        summary = self.summary(rate_limit)
+        logger.info("metrics: run_seconds=%s windows=%s phase_sum_seconds=%s", summary["run_seconds"], summary["windows"],
+                    {k: v["sum_seconds"] for k, v in summary["phases"].items()})
+        if self.json_path:
+            _atomic_write(self.json_path, json.dumps(summary, ensure_ascii=False, indent=2))
+            logger.info("metrics: json -> %s", self.json_path)
+        if self.textfile_path:
+            _atomic_write(self.textfile_path, self._prometheus(summary))
+            logger.info("metrics: textfile -> %s", self.textfile_path)
+        return summary
+
+
+def _atomic_write(path: str, text: str) -> None:
+    # 先写临时文件再改名，采集方不会读到写了一半的文件
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(p.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, p)
@@ -0,0 +1,323 @@
+"""
+本地飞书替身（用于联调与基准测试，不依赖真实飞书、扫码与机器人）
+- POST /clm/api/cooperation/exportCooperationRecords：模拟导出接口，可配置延迟、限流（429 + Retry-After）与随机错误
+- GET  /next/messenger：模拟网页版会话，机器人消息“导出 A 至 B 协商数据（共计：N）”+“下载文件”链接
+- GET  /api/messages?since=K：会话消息列表（JSON，供页面与无浏览器模式使用）
+- GET  /files/<id>.xlsx：按窗口生成的导出文件（条数 = min(区间总条数, max_count)，记录 ID 按日期确定，可用于去重校验）
+- GET  /api/stats：调用统计
+每日条数由 daily_min/daily_max 与随机种子确定，spikes 可为个别日期指定条数（模拟数据倾斜）。
+
+独立运行：python -m scripts.mock_feishu --port 8787
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, quote, urlparse
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import warnings
+
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
+
+EXPORT_PATH = "/clm/api/cooperation/exportCooperationRecords"
+MESSENGER_PATH = "/next/messenger"
+PROBE_PATH = "/clm/api/cooperation/searchCooperationRecords"
+BOT_NAME = "飞书合同"
+HEADER = ["协同记录ID", "创建时间", "合同名称", "金额"]
+
+
+@dataclass
+class MockConfig:
+    daily_min: int = 0
+    daily_max: int = 200
+    spikes: Dict[str, int] = field(default_factory=dict)
+    seed: int = 7
+    max_count: int = 1000
+    latency_ms: int = 50
+    message_delay_ms: int = 300
+    throttle_rps: float = 0.0      # 0 表示不限流
+    error_rate: float = 0.0
+    dateless_messages: bool = False  # True 时消息与真实机器人一致，只有“协商数据（共计：N）”，不含日期区间
+
+
+class MockFeishu:
+    """替身服务的状态：每日条数、已发出的消息、生成的文件与统计。"""
+
+    def __init__(self, cfg: MockConfig) -> None:
+        self.cfg = cfg
+        self._lock = threading.Lock()
+        self._rng = random.Random(cfg.seed)
+        self._counts: Dict[str, int] = {}
+        self.messages: List[Dict[str, Any]] = []
+        self._files: Dict[int, Tuple[str, str, int]] = {}
+        self._file_cache: Dict[int, bytes] = {}
+        self._tokens = max(1.0, cfg.throttle_rps)
+        self._last = time.monotonic()
+        self.stats: Dict[str, int] = {"export_calls": 0, "throttled": 0, "errors": 0, "messages": 0, "files_served": 0,
+                                      "probe_calls": 0}
+
+    def day_count(self, day: str) -> int:
+        if day in self.cfg.spikes:
+            return int(self.cfg.spikes[day])
+        with self._lock:
+            if day not in self._counts:
+                self._counts[day] = random.Random(f"{self.cfg.seed}:{day}").randint(self.cfg.daily_min, self.cfg.daily_max)
+            return self._counts[day]
+
+    def range_total(self, fr: str, to: str) -> int:
+        d, end = date.fromisoformat(fr), date.fromisoformat(to)
+        total = 0
+        while d <= end:
+            total += self.day_count(d.isoformat())
+            d += timedelta(days=1)
+        return total
+
+    def _throttled(self) -> bool:
+        if self.cfg.throttle_rps <= 0:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(max(1.0, self.cfg.throttle_rps), self._tokens + (now - self._last) * self.cfg.throttle_rps)
+            self._last = now
+            if self._tokens < 1.0:
+                self.stats["throttled"] += 1
+                return True
+            self._tokens -= 1.0
+            return False
+
+    def export(self, fr: str, to: str) -> Tuple[int, Dict[str, Any]]:
+        """处理一次导出请求，返回 (HTTP 状态码, 响应体)；有数据时延迟 message_delay_ms 后发出机器人消息。"""
+        with self._lock:
+            self.stats["export_calls"] += 1
+        if self._throttled():
+            return 429, {"code": 429, "msg": "too many requests"}
+        time.sleep(self.cfg.latency_ms / 1000.0)
+        if self.cfg.error_rate and self._rng.random() < self.cfg.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            return 500, {"code": 500, "msg": "internal error"}
+        total = self.range_total(fr, to)
+        if total > 0:
+            declared = min(total, self.cfg.max_count)
+            timer = threading.Timer(self.cfg.message_delay_ms / 1000.0, self._post_message, args=(fr, to, declared))
+            timer.daemon = True
+            timer.start()
+        return 200, {"code": 0, "msg": "success"}
+
+    def search(self, fr: str, to: str) -> Tuple[int, Dict[str, Any]]:
+        """列表/搜索接口：只返回总条数（不受导出上限截断），用于导出前的条数探测。"""
+        with self._lock:
+            self.stats["probe_calls"] += 1
+        if self._throttled():
+            return 429, {"code": 429, "msg": "too many requests"}
+        time.sleep(self.cfg.latency_ms / 1000.0)
+        return 200, {"code": 0, "msg": "success", "data": {"total": self.range_total(fr, to), "list": []}}
+
+    def _post_message(self, fr: str, to: str, declared: int) -> None:
+        with self._lock:
+            idx = len(self.messages)
+            self._files[idx] = (fr, to, declared)
+            self.messages.append({
+                "idx": idx,
+                "text": (f"协商数据（共计：{declared}）" if self.cfg.dateless_messages
+                         else f"导出 {fr} 至 {to} 协商数据（共计：{declared}）"),
+                "url": f"/files/{idx}.xlsx",
+            })
+            self.stats["messages"] += 1
+
+    def file_bytes(self, idx: int) -> Optional[bytes]:
+        with self._lock:
+            if idx in self._file_cache:
+                return self._file_cache[idx]
+            info = self._files.get(idx)
+        if info is None:
+            return None
+        fr, to, declared = info
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(HEADER)
+        d, end, n = date.fromisoformat(fr), date.fromisoformat(to), 0
+        while d <= end and n < declared:
+            day = d.isoformat()
+            for j in range(self.day_count(day)):
+                if n >= declared:
+                    break
+                ws.append([f"R{day.replace('-', '')}{j:05d}", f"{day} 10:00:00", f"合同{j}", j * 10])
+                n += 1
+            d += timedelta(days=1)
+        buf = BytesIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            wb.save(buf)
+        data = buf.getvalue()
+        with self._lock:
+            self._file_cache[idx] = data
+            self.stats["files_served"] += 1
+        return data
+
+
+_MESSENGER_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Mock Messenger</title></head>
+<body>
+<nav><a role="link" href="#chat" id="bot">%(bot)s</a></nav>
+<main id="pane" style="display:none">
+  <h3 id="title">%(bot)s</h3>
+  <div id="chat"></div>
+  <div contenteditable="true" id="editor" style="border:1px solid #ccc;min-height:2em"></div>
+</main>
+<script>
+let since = 0;
+document.getElementById('bot').addEventListener('click', (e) => { e.preventDefault(); e.currentTarget.setAttribute('aria-selected', 'true'); document.getElementById('pane').style.display = 'block'; });
+async function poll() {
+  try {
+    const r = await fetch('/api/messages?since=' + since);
+    for (const m of await r.json()) {
+      const d = document.createElement('div');
+      d.className = 'msg';
+      d.innerHTML = '<div class="text"></div><a download>下载文件</a>';
+      d.querySelector('.text').textContent = m.text;
+      d.querySelector('a').setAttribute('href', m.url);
+      document.getElementById('chat').appendChild(d);
+      since = m.idx + 1;
+    }
+  } catch (e) {}
+  setTimeout(poll, 200);
+}
+poll();
+</script>
+</body></html>
+"""
+
+
+def _make_handler(mock: MockFeishu):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt: str, *args: Any) -> None:
+            logger.debug("mock_feishu: " + fmt, *args)
+
+        def _send(self, status: int, body: bytes, ctype: str, extra: Optional[Dict[str, str]] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status: int, obj: Any, extra: Optional[Dict[str, str]] = None) -> None:
+            self._send(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8", extra)
+
+        def do_POST(self) -> None:  # noqa: N802
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            path = urlparse(self.path).path
+            if path not in (EXPORT_PATH, PROBE_PATH):
+                self._json(404, {"code": 404})
+                return
+            try:
+                fr, to = json.loads(raw or b"{}")["searchCooperationByCreateTime"]
+                date.fromisoformat(fr), date.fromisoformat(to)
+            except Exception:
+                self._json(400, {"code": 400, "msg": "bad body"})
+                return
+            status, body = mock.export(fr, to) if path == EXPORT_PATH else mock.search(fr, to)
+            self._json(status, body, {"Retry-After": "1"} if status == 429 else None)
+
+        def do_GET(self) -> None:  # noqa: N802
+            url = urlparse(self.path)
+            if url.path.startswith(MESSENGER_PATH):
+                html = _MESSENGER_HTML % {"bot": BOT_NAME}
+                self._send(200, html.encode("utf-8"), "text/html; charset=utf-8")
+            elif url.path == "/api/messages":
+                since = int((parse_qs(url.query).get("since") or ["0"])[0])
+                self._json(200, mock.messages[since:])
+            elif url.path == "/api/stats":
+                self._json(200, mock.stats)
+            elif url.path.startswith("/files/") and url.path.endswith(".xlsx"):
+                try:
+                    idx = int(url.path[len("/files/"):-len(".xlsx")])
+                except ValueError:
+                    idx = -1
+                data = mock.file_bytes(idx)
+                if data is None:
+                    self._json(404, {"code": 404})
+                    return
+                # 与真实导出一致：文件名只带导出当天日期，同一天导出的文件同名
+                name = f"协商操作记录-{date.today().strftime('%Y%m%d')}.xlsx"
+                self._send(200, data, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}"})
+            else:
+                self._json(404, {"code": 404})
+
+    return Handler
+
+
+class MockServer:
+    """在后台线程中运行替身服务；base_url 形如 http://127.0.0.1:<port>。"""
+
+    def __init__(self, cfg: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.mock = MockFeishu(cfg or MockConfig())
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self.mock))
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-feishu", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._thread.start()
+        logger.info("mock_feishu: listening on %s", self.base_url)
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地飞书替身服务（导出接口 + 机器人会话页面）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--daily-min", type=int, default=0)
+    parser.add_argument("--daily-max", type=int, default=200)
+    parser.add_argument("--spike", action="append", default=[], help="指定某日条数，格式 YYYY-MM-DD=N，可重复")
+    parser.add_argument("--seed", type=int, default=7, help="每日条数的随机种子")
+    parser.add_argument("--latency-ms", type=int, default=50)
+    parser.add_argument("--message-delay-ms", type=int, default=300)
+    parser.add_argument("--throttle-rps", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dateless", action="store_true", help="消息不含日期区间（与真实机器人文案一致）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    cfg = MockConfig(daily_min=args.daily_min, daily_max=args.daily_max,
+                     spikes={k: int(v) for k, v in (s.split("=", 1) for s in args.spike)}, seed=args.seed,
+                     latency_ms=args.latency_ms, message_delay_ms=args.message_delay_ms,
+                     throttle_rps=args.throttle_rps, error_rate=args.error_rate, dateless_messages=args.dateless)
+    server = MockServer(cfg, args.host, args.port).start()
+    logger.info("mock_feishu: messenger page %s%s, export endpoint %s%s", server.base_url, MESSENGER_PATH, server.base_url, EXPORT_PATH)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 from __future__ import annotations
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, Deque, Set, Union, Iterable, Iterator
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
-from datetime import datetime
-import hashlib
+from datetime import datetime, timedelta
 import logging
+import time
 
-from .run_state import RunStateConfig, from_config as rs_from_cfg, ensure_csv_exists, read_completed_window_ids, append_record
-from .window_gen import generate_initial_windows
-from .http_export import submit_export
-from .web_download import BrowserSession
+from .run_state import RunStateStore, open_store
+from .window_gen import generate_initial_windows, bisect_window
+from .http_export import ExportClient, AsyncExportClient, open_export_client
+from .web_download import BrowserSession, _parse_declared_count, _parse_date_range
+from .hashing import DownloadedFile
+from .planner import DensityPlanner, from_config as planner_from_cfg
+from .metrics import PhaseTimer, RunMetrics
+from .work_queue import WorkQueue, open_queue
+from .retry_schedule import RetryScheduler, from_config as retry_from_cfg
+from .probe import DensityMap, probe_density
+from .postprocess import PostProcessor, open_postprocessor, standard_path
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +25,16 @@ def _window_id(fr: str, to: str) -> str:
     return f"{fr.replace('-', '')}-{to.replace('-', '')}"
 
 
+def _parse_window_id(wid: str) -> Optional[Tuple[str, str]]:
+    try:
+        a, b = wid.split("-")
+    except ValueError:
+        return None
+    if len(a) != 8 or len(b) != 8:
+        return None
+    return (f"{a[:4]}-{a[4:6]}-{a[6:8]}", f"{b[:4]}-{b[4:6]}-{b[6:8]}")
+
+
 def _window_days(fr: str, to: str) -> int:
     fmt = "%Y-%m-%d"
     d1 = datetime.strptime(fr, fmt)
@@ -23,34 +42,29 @@ def _window_days(fr: str, to: str) -> int:
     return (d2 - d1).days + 1
 
 
-def _md5_file(path: str) -> str:
-    h = hashlib.md5()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
 def _record(
     fr: str,
     to: str,
     status: str,
     declared_count: int,
     split_level: int,
-    retries: int,
+    retries: int = 0,
     file_path: str = "",
     file_md5: str = "",
     skip_reason: str = "",
     exception: str = "",
     start_time: Optional[datetime] = None,
     end_time: Optional[datetime] = None,
+    parent_id: str = "",
+    children: Optional[List[Tuple[str, str]]] = None,
+    timings: Optional[PhaseTimer] = None,
 ) -> Dict[str, Any]:
     start_iso = start_time.isoformat() if start_time else ""
     end_iso = end_time.isoformat() if end_time else ""
     duration_ms = 0
     if start_time and end_time:
         duration_ms = int((end_time - start_time).total_seconds() * 1000)
-    return {
+    row: Dict[str, Any] = {
         "window_id": _window_id(fr, to),
         "from_date": fr,
         "to_date": to,
@@ -58,6 +72,8 @@ def _record(
         "status": status,
         "declared_count": declared_count,
         "split_level": split_level,
+        "parent_id": parent_id,
+        "children": ";".join(_window_id(a, b) for a, b in (children or [])),
         "retries": retries,
         "skip_reason": skip_reason,
         "exception": exception,
@@ -67,116 +83,140 @@ def _record(
         "end_time": end_iso,
         "duration_ms": duration_ms,
     }
+    if timings is not None:
+        # 分阶段耗时列（chat_ms/export_ms/wait_ms/download_ms/rename_ms/post_ms），未经历的阶段留空
+        row.update(timings.columns())
+    return row
 
 
-def _rename_to_standard(download_dir: str, fr: str, to: str, count: int, saved_path: str) -> str:
-    # 统一命名：合同协同_YYYYMMDD-YYYYMMDD_共{COUNT}条.xlsx
-    base = f"合同协同_{fr.replace('-', '')}-{to.replace('-', '')}_共{count}条.xlsx"
-    dest = str(Path(download_dir) / base)
-    try:
-        if Path(saved_path).resolve() != Path(dest).resolve():
-            logger.debug("rename: %s -> %s", saved_path, dest)
-            Path(saved_path).rename(dest)
-            return dest
-    except Exception:
-        # 保留原名
-        return saved_path
-    return dest
+@dataclass
+class _RunContext:
+    """一次编排运行中共享的对象：配置、状态存储、浏览器会话、导出客户端与（可选）密度规划器。"""
+    cfg: dict
+    seq: List[int]
+    store: RunStateStore
+    session: BrowserSession
+    client: Union[ExportClient, AsyncExportClient]
+    planner: Optional[DensityPlanner] = None
+    metrics: Optional[RunMetrics] = None
+    queue: Optional[WorkQueue] = None
+    retries: Optional[RetryScheduler] = None
+    post: Optional[PostProcessor] = None
 
 
-def _process_leaf_window(cfg: dict, fr: str, to: str, split_level: int, rs_cfg: RunStateConfig, session: BrowserSession) -> None:
-    # 导出并下载
-    start_ts = datetime.now()
-    logger.debug("leaf_window: start fr=%s to=%s level=%s", fr, to, split_level)
-    try:
-        session.ensure_chat_open()
-    except Exception:
-        pass
-    try:
-        pre_count, pre_sig = session.snapshot_state()
-    except Exception:
-        pre_count, pre_sig = 0, ""
-    export_result = submit_export(cfg, fr, to)
-    if not export_result.get("ok"):
-        # 失败写入记录
-        logger.warning("leaf_window: export failed fr=%s to=%s err=%s", fr, to, export_result.get("error") or export_result.get("status_code"))
-        append_record(rs_cfg, _record(fr, to, "failed", 0, split_level, retries=int(cfg.get("retry", {}).get("max_attempts", 3)),
-                                       exception=str(export_result.get("error") or export_result.get("status_code")),
-                                       start_time=start_ts, end_time=datetime.now()))
-        return
+def _append(ctx: _RunContext, row: Dict[str, Any], final: bool = True) -> None:
+    """写入运行状态并计入本次运行的指标；启用工作队列时同步更新队列（split 的子窗口进入队列等待领取）。
 
-    dl = session.wait_and_download_new(pre_count, pre_sig)
-    end_ts = datetime.now()
-    if dl is None:
-        # 无消息
-        logger.info("leaf_window: no_data fr=%s to=%s", fr, to)
-        append_record(rs_cfg, _record(fr, to, "no_data", 0, split_level, retries=0, start_time=start_ts, end_time=end_ts))
-        return
+    retries 列按实际情况填写：该窗口此前已记录的尝试次数（含本次运行内的重试与之前的运行）。
+    final=False 表示不更新工作队列：该窗口已安排运行内重试（租约仍由本节点持有），
+    或该窗口根本不在队列中（探测为空、在写入队列前就被跳过的窗口）。
+    """
+    row["retries"] = ctx.store.attempts(str(row.get("window_id") or ""))
+    ctx.store.append(row)
+    if ctx.metrics is not None:
+        ctx.metrics.observe_row(row)
+    if ctx.queue is not None and final:
+        children: List[Tuple[str, str, str]] = []
+        for cid in (row.get("children") or "").split(";"):
+            rng = _parse_window_id(cid.strip()) if cid.strip() else None
+            if rng is not None:
+                children.append((cid.strip(), rng[0], rng[1]))
+        try:
+            ctx.queue.complete(row, children)
+        except Exception:
+            logger.exception("queue: update failed window_id=%s", row.get("window_id"))
 
-    saved_path, declared = dl
-    logger.debug("leaf_window: declared=%s path=%s", declared, saved_path)
-    # 阈值判断
-    max_count = int(cfg.get("max_count_per_file", 1000))
-    if declared == max_count and _window_days(fr, to) == 1:
-        logger.info("leaf_window: over_limit_1d fr=%s to=%s declared=%s", fr, to, declared)
-        append_record(rs_cfg, _record(fr, to, "manual", declared, split_level, retries=0,
-                                       exception="over_limit_1d", file_path=saved_path,
-                                       file_md5=_md5_file(saved_path) if Path(saved_path).exists() else "",
-                                       start_time=start_ts, end_time=end_ts))
-        return
 
-    if declared < max_count:
-        # 重命名并记录 with_data
-        download_dir = cfg.get("download", {}).get("download_dir", "./output/raw")
-        std_path = _rename_to_standard(download_dir, fr, to, declared, saved_path)
-        logger.info("leaf_window: with_data fr=%s to=%s declared=%s saved=%s", fr, to, declared, std_path)
-        append_record(rs_cfg, _record(fr, to, "with_data", declared, split_level, retries=0,
-                                       file_path=std_path,
-                                       file_md5=_md5_file(std_path) if Path(std_path).exists() else "",
-                                       start_time=start_ts, end_time=end_ts))
-        return
+def _fail_or_retry(ctx: _RunContext, window: Tuple[str, str, int, str], reason: str, row: Dict[str, Any]) -> bool:
+    """记录一次 failed / 超时 no_data 的结果；仍有重试次数时安排运行内重试并返回 True。
 
-    # declared == max_count 且 window_days>1 的情况在上层处理（触发细分），此处不记录父窗口
-    return
+    已安排重试的记录状态写为 retry_pending（原因写入 exception 列），不属于已完成状态：
+    进程在重试前退出时，续跑仍会重新执行该窗口；重试次数用尽后才写入 failed / no_data。
+    """
+    retry = ctx.retries is not None and ctx.retries.schedule(window, reason)
+    if retry:
+        row["status"] = "retry_pending"
+        row["exception"] = f"{reason}: {row['exception']}" if row.get("exception") else reason
+    _append(ctx, row, final=not retry)
+    return retry
 
 
-def _split_and_process(cfg: dict, fr: str, to: str, seq: List[int], level: int, rs_cfg: RunStateConfig, session: BrowserSession) -> None:
-    days = seq[level]
-    max_count = int(cfg.get("max_count_per_file", 1000))
+def _export_error(exp: Dict[str, Any]) -> str:
+    err = str(exp.get("error") or exp.get("status_code"))
+    return f"{err} (attempts={exp['attempts']})" if exp.get("attempts") else err
+
+
+def _split_and_process(ctx: _RunContext, fr: str, to: str, level: int, parent_id: str = "") -> None:
+    session, planner = ctx.session, ctx.planner
+    days = _window_days(fr, to)
 
     # 先执行一次以判断是否需要细分
     start_ts = datetime.now()
+    timer = PhaseTimer()
     logger.debug("split_process: start fr=%s to=%s level=%s days=%s", fr, to, level, days)
-    try:
-        session.ensure_chat_open()
-    except Exception:
-        pass
-    try:
-        pre_count, pre_sig = session.snapshot_state()
-    except Exception:
-        pre_count, pre_sig = 0, ""
-    exp = submit_export(cfg, fr, to)
+    with timer.span("chat"):
+        try:
+            session.ensure_chat_open()
+        except Exception:
+            pass
+        try:
+            pre_count, pre_sig = session.snapshot_state()
+        except Exception:
+            pre_count, pre_sig = 0, ""
+    with timer.span("export"):
+        exp = ctx.client.submit(fr, to)
     if not exp.get("ok"):
         logger.warning("split_process: export failed fr=%s to=%s err=%s", fr, to, exp.get("error") or exp.get("status_code"))
-        append_record(rs_cfg, _record(fr, to, "failed", 0, level, retries=int(cfg.get("retry", {}).get("max_attempts", 3)),
-                                       exception=str(exp.get("error") or exp.get("status_code")),
-                                       start_time=start_ts, end_time=datetime.now()))
+        _fail_or_retry(ctx, (fr, to, level, parent_id), "failed",
+                       _record(fr, to, "failed", 0, level, exception=_export_error(exp),
+                               start_time=start_ts, end_time=datetime.now(), parent_id=parent_id, timings=timer))
         return
 
     dl = session.wait_and_download_new(pre_count, pre_sig)
+    for phase, seconds in session.last_timings.items():
+        timer.add(phase, seconds)
     end_ts = datetime.now()
     if dl is None:
         logger.info("split_process: no_data fr=%s to=%s", fr, to)
-        append_record(rs_cfg, _record(fr, to, "no_data", 0, level, retries=0, start_time=start_ts, end_time=end_ts))
+        retried = _fail_or_retry(ctx, (fr, to, level, parent_id), "no_data",
+                                 _record(fr, to, "no_data", 0, level, start_time=start_ts, end_time=end_ts,
+                                         parent_id=parent_id, timings=timer))
+        if planner is not None and not retried:
+            planner.observe(fr, to, 0)
         return
 
-    saved_path, declared = dl
-    logger.debug("split_process: declared=%s path=%s", declared, saved_path)
+    saved, declared = dl
+    logger.debug("split_process: declared=%s path=%s size=%s", declared, saved.path, saved.size)
+    sub_windows = _handle_download(ctx, fr, to, level, saved, declared, start_ts, end_ts, parent_id, timer)
+    if ctx.queue is not None:
+        # 子窗口已进入工作队列，由任意节点领取
+        return
+    for sub_fr, sub_to in sub_windows:
+        _split_and_process(ctx, sub_fr, sub_to, level + 1, _window_id(fr, to))
+
+
+def _handle_download(ctx: _RunContext, fr: str, to: str, level: int, saved: DownloadedFile, declared: int,
+                     start_ts: datetime, end_ts: datetime, parent_id: str = "",
+                     timer: Optional[PhaseTimer] = None) -> List[Tuple[str, str]]:
+    """处理已下载窗口的结果：记录 with_data/manual，或记录 split 并返回需要继续细分的子窗口列表。
+
+    saved 的摘要在下载落盘时已算好，这里不再重新读取文件。timer 为该窗口此前各阶段的耗时，重命名耗时记入 rename。
+
+    子窗口的划分方式由 planner.strategy 决定：adaptive 按预估密度重新规划（ctx.planner 非空），
+    bisect 按日期二分，其余按 split_days_sequence 逐级拆分。
+    """
+    cfg, planner = ctx.cfg, ctx.planner
+    timer = timer or PhaseTimer()
+    saved_path = saved.path
+    days = _window_days(fr, to)
+    max_count = int(cfg.get("max_count_per_file", 1000))
+    if planner is not None:
+        planner.observe(fr, to, declared)
 
     if declared == max_count and days > 1:
         # 细分为下一个级别
         next_level = level + 1
-        next_days = seq[next_level]
+        next_days = ctx.seq[next_level] if next_level < len(ctx.seq) else 1
         logger.info("split_process: need split -> next_level=%s next_days=%s fr=%s to=%s", next_level, next_days, fr, to)
         # 父窗口已下载的文件不保留，避免混淆
         try:
@@ -184,56 +224,473 @@ def _split_and_process(cfg: dict, fr: str, to: str, seq: List[int], level: int,
                 Path(saved_path).unlink(missing_ok=True)  # type: ignore[arg-type]
         except Exception:
             pass
-        sub_windows = generate_initial_windows(fr, to, next_days)
+        strategy = str(cfg.get("planner", {}).get("strategy", "sequence")).lower()
+        if planner is not None:
+            sub_windows = planner.plan(fr, to, max_days=days - 1)
+        elif strategy == "bisect":
+            sub_windows = bisect_window(fr, to)
+        else:
+            sub_windows = generate_initial_windows(fr, to, next_days)
         logger.debug("split_process: sub_windows=%s", sub_windows)
-        for sub_fr, sub_to in sub_windows:
-            _split_and_process(cfg, sub_fr, sub_to, seq, next_level, rs_cfg, session)
-        return
+        # 记录拆分节点（split 不属于已完成态），子窗口行通过 parent_id 指向本窗口，构成拆分树
+        _append(ctx, _record(fr, to, "split", declared, level,
+                             start_time=start_ts, end_time=end_ts, parent_id=parent_id, children=sub_windows,
+                             timings=timer))
+        return sub_windows
 
+    item = {"window": (fr, to, level, parent_id), "declared": declared, "start_ts": start_ts, "end_ts": end_ts,
+            "timer": timer, "status": "with_data", "exception": ""}
+    dest = ""
     if declared == max_count and days == 1:
-        # 1天仍超限 → manual
+        # 1天仍超限 → manual（保留原文件名）
         logger.info("split_process: over_limit_1d fr=%s to=%s declared=%s", fr, to, declared)
-        append_record(rs_cfg, _record(fr, to, "manual", declared, level, retries=0,
-                                       exception="over_limit_1d", file_path=saved_path,
-                                       file_md5=_md5_file(saved_path) if Path(saved_path).exists() else "",
-                                       start_time=start_ts, end_time=end_ts))
+        item.update(status="manual", exception="over_limit_1d")
+    else:
+        # declared < max_count → with_data，按标准名重命名
+        dest = standard_path(cfg.get("download", {}).get("download_dir", "./output/raw"), fr, to, declared)
+    _submit_post(ctx, saved, dest, item)
+    return []
+
+
+def _submit_post(ctx: _RunContext, saved: DownloadedFile, dest: str, item: Dict[str, Any]) -> None:
+    """摘要补算、重命名、行数核对与中间文件转换交给后处理池；结果由 _drain_post 收取后写入运行状态。"""
+    post = ctx.post
+    assert post is not None
+    post.submit(saved.path, saved.digest, dest, item)
+    if not post.background:
+        # postprocess.workers=0：在主线程内处理完立即记录
+        _drain_post(ctx)
+
+
+def _drain_post(ctx: _RunContext, block: bool = False) -> None:
+    """收取已完成的后处理结果并记录 with_data/manual；block=True 时等待全部完成。"""
+    if ctx.post is None:
         return
+    for res, item in ctx.post.collect(block):
+        _finish_post(ctx, res, item)
 
-    # declared < max_count → with_data
-    download_dir = cfg.get("download", {}).get("download_dir", "./output/raw")
-    std_path = _rename_to_standard(download_dir, fr, to, declared, saved_path)
-    logger.info("split_process: with_data fr=%s to=%s declared=%s saved=%s", fr, to, declared, std_path)
-    append_record(rs_cfg, _record(fr, to, "with_data", declared, level, retries=0,
-                                   file_path=std_path,
-                                   file_md5=_md5_file(std_path) if Path(std_path).exists() else "",
-                                   start_time=start_ts, end_time=end_ts))
 
+def _finish_post(ctx: _RunContext, res: Dict[str, Any], item: Dict[str, Any]) -> None:
+    window: Tuple[str, str, int, str] = item["window"]
+    fr, to, level, parent_id = window
+    declared, status, timer = item["declared"], item["status"], item["timer"]
+    if status == "with_data":
+        timer.add("rename", res.get("rename_seconds"))
+    timer.add("post", res.get("post_seconds"))
+    problem = str(res.get("error") or "")
+    if problem:
+        problem = f"postprocess_error: {problem}"
+    elif ctx.post is not None and ctx.post.cfg.verify_rows and res.get("rows") is not None and res["rows"] != declared:
+        problem = f"row_count_mismatch: rows={res['rows']} declared={declared}"
+    if problem:
+        logger.warning("postprocess: %s fr=%s to=%s path=%s", problem, fr, to, res.get("path"))
+        if ctx.post is not None and ctx.post.cfg.on_mismatch == "fail":
+            _fail_or_retry(ctx, window, "failed",
+                           _record(fr, to, "failed", declared, level, exception=problem,
+                                   file_path=res.get("path") or "", file_md5=res.get("digest") or "",
+                                   start_time=item["start_ts"], end_time=item["end_ts"], parent_id=parent_id,
+                                   timings=timer))
+            return
+    if status == "with_data":
+        logger.info("split_process: with_data fr=%s to=%s declared=%s saved=%s", fr, to, declared, res.get("path"))
+    _append(ctx, _record(fr, to, status, declared, level,
+                         exception=";".join(x for x in (item["exception"], problem) if x),
+                         file_path=res.get("path") or "", file_md5=res.get("digest") or "",
+                         start_time=item["start_ts"], end_time=item["end_ts"], parent_id=parent_id, timings=timer))
 
-def run(cfg: dict) -> None:
-    # 准备 run_state
-    rs_cfg = rs_from_cfg(cfg)
-    ensure_csv_exists(rs_cfg)
 
-    # 断点续跑：跳过已完成窗口
-    completed = read_completed_window_ids(rs_cfg, rs_cfg.completed_statuses or ["with_data", "no_data", "manual"])
+def _pipeline_depth(cfg: dict) -> int:
+    """同时在途的窗口数。机器人消息不带日期区间时（真实文案只有“协商数据（共计：N）”），
+    消息无法对应到窗口：空窗口不发消息，按提交顺序匹配会把后一个窗口的文件记到前一个窗口，因此退回逐窗口串行。
+
+    http.backend=async 的意义只在于并发提交多个在途窗口，消息不带日期区间时无法使用，直接报错而不是静默退回串行。"""
+    pcfg = cfg.get("pipeline", {})
+    depth = max(1, int(pcfg.get("in_flight", 1)))
+    if depth > 1 and not bool(pcfg.get("message_has_range", False)):
+        if str(cfg.get("http", {}).get("backend", "sync")).lower() == "async":
+            raise ValueError("http.backend=async 且 pipeline.in_flight>1 需要机器人消息带日期区间"
+                             "（pipeline.message_has_range=true）；消息不带日期时请改用 backend: sync 或 in_flight: 1")
+        logger.warning("pipeline: in_flight=%s ignored, bot messages carry no date range "
+                       "(pipeline.message_has_range=false); running one window at a time", depth)
+        return 1
+    return depth
+
+
+def _match_in_flight(in_flight: List[Dict[str, Any]], text: str) -> Optional[Dict[str, Any]]:
+    """按消息文案中的日期区间匹配在途窗口；文案中无日期时只有一个在途窗口才能确定归属，否则返回 None。"""
+    if not in_flight:
+        return None
+    rng = _parse_date_range(text)
+    if rng is not None:
+        for item in in_flight:
+            if (item["fr"], item["to"]) == rng:
+                return item
+        logger.warning("pipeline: message range %s matches no in-flight window", rng)
+        return None
+    return in_flight[0] if len(in_flight) == 1 else None
+
 
+def _discard_late_messages(session: BrowserSession, seen: int, until: float, poll_interval: float) -> int:
+    """丢弃 until（monotonic）之前到达的消息，返回新的已读位置；用于放弃一批无法对应的在途窗口后清空其迟到消息。"""
+    while True:
+        left = until - time.monotonic()
+        if left <= 0:
+            return seen
+        try:
+            for idx, _ in session.poll_new_messages(seen, wait_seconds=min(poll_interval, left)):
+                seen = max(seen, idx + 1)
+        except Exception:
+            logger.exception("pipeline: poll messages failed")
+            time.sleep(min(poll_interval, left))
+
+
+def _run_pipelined(ctx: _RunContext, windows: Iterable[Tuple[str, str, int, str]], depth: int) -> None:
+    """流水线模式：最多保持 depth 个窗口同时在途，机器人消息到达即下载，细分出的子窗口插队优先处理。
+
+    windows 可以是惰性的（自适应规划逐个产生），只在需要补满在途窗口时才取下一个。
+    """
+    cfg, session, planner = ctx.cfg, ctx.session, ctx.planner
+    pcfg = cfg.get("pipeline", {})
+    poll_interval = float(pcfg.get("poll_interval_seconds", 0.8))
+    max_wait = session.max_wait_seconds
+    source = iter(windows)
+    pending: Deque[Tuple[str, str, int, str]] = deque()
+    in_flight: List[Dict[str, Any]] = []
+
+    def _pull() -> bool:
+        nxt = next(source, None)
+        if nxt is not None:
+            pending.append(nxt)
+        return nxt is not None
+
+    try:
+        session.ensure_chat_open()
+    except Exception:
+        pass
+    try:
+        seen, _ = session.snapshot_state()
+    except Exception:
+        seen = 0
+    logger.info("pipeline: start depth=%s baseline_buttons=%s", depth, seen)
+
+    retries, post = ctx.retries, ctx.post
+    while (pending or in_flight or (retries is not None and len(retries)) or (post is not None and len(post))
+           or _pull()):
+        if not pending:
+            # 惰性来源的下一个窗口（已取到则无操作），避免在仍有窗口可提交时误判为只剩重试/后台处理
+            _pull()
+        # 收取后台处理完成的窗口；没有待提交/在途窗口时等待其全部完成（核对失败的窗口可能安排重试）
+        _drain_post(ctx, block=not pending and not in_flight)
+        # 到期的重试窗口与子窗口一样优先于尚未提交的窗口
+        if retries is not None:
+            pending.extendleft(reversed(retries.pop_due()))
+            if not pending and not in_flight:
+                # 只剩等待中的重试：等到下一个到期
+                retries.wait_next()
+                continue
+        # 补满在途窗口：一批提交（http.backend=async 时并发提交）
+        batch: List[Tuple[str, str, int, str]] = []
+        while len(in_flight) + len(batch) < depth and (pending or _pull()):
+            batch.append(pending.popleft())
+        start_ts = datetime.now()
+        results = ctx.client.submit_many([(fr, to) for fr, to, _, _ in batch]) if batch else []
+        for (fr, to, level, parent_id), exp in zip(batch, results):
+            timer = PhaseTimer()
+            timer.add("export", exp.get("elapsed_seconds"))
+            if not exp.get("ok"):
+                logger.warning("pipeline: export failed fr=%s to=%s err=%s", fr, to, exp.get("error") or exp.get("status_code"))
+                _fail_or_retry(ctx, (fr, to, level, parent_id), "failed",
+                               _record(fr, to, "failed", 0, level, exception=_export_error(exp),
+                                       start_time=start_ts, end_time=datetime.now(), parent_id=parent_id, timings=timer))
+                continue
+            logger.debug("pipeline: submitted fr=%s to=%s level=%s in_flight=%s", fr, to, level, len(in_flight) + 1)
+            in_flight.append({"fr": fr, "to": to, "level": level, "parent_id": parent_id,
+                              "start_ts": start_ts, "submit_mono": time.monotonic(), "timer": timer})
+
+        # 收取新消息并按窗口匹配下载
+        try:
+            # 有在途窗口时在会话内等待新消息（最多 poll_interval 秒），消息到达即返回
+            messages = session.poll_new_messages(seen, wait_seconds=poll_interval if in_flight else 0.0)
+        except Exception:
+            logger.exception("pipeline: poll messages failed")
+            messages = []
+        arrived = time.monotonic()
+        matched: List[Tuple[int, str, Dict[str, Any]]] = []
+        ambiguous = False
+        for idx, text in messages:
+            seen = max(seen, idx + 1)
+            if len(in_flight) > 1 and _parse_date_range(text) is None:
+                ambiguous = True
+                continue
+            item = _match_in_flight(in_flight, text)
+            if item is None:
+                continue
+            in_flight.remove(item)
+            item["timer"].add("wait", arrived - item["submit_mono"])
+            matched.append((idx, text, item))
+        if ambiguous and in_flight:
+            # 消息不带日期区间，无法确定属于哪个在途窗口：放弃这些窗口的本次导出，
+            # 丢弃它们迟到的消息后按逐窗口串行重新导出
+            logger.error("pipeline: message without date range while %s windows in flight; "
+                         "falling back to in_flight=1 and re-exporting them", len(in_flight))
+            depth = 1
+            seen = _discard_late_messages(session, seen, max(it["submit_mono"] for it in in_flight) + max_wait,
+                                          poll_interval)
+            pending.extendleft(reversed([(it["fr"], it["to"], it["level"], it["parent_id"]) for it in in_flight]))
+            in_flight = []
+        # 同一批到达的消息一起下载（download.mode=direct 时并行），批次耗时记为其中每个窗口的 download
+        dl_start = time.monotonic()
+        saved_files = session.download_many([idx for idx, _, _ in matched]) if matched else []
+        dl_seconds = time.monotonic() - dl_start
+        split_children: List[Tuple[str, str, int, str]] = []
+        for (idx, text, item), saved in zip(matched, saved_files):
+            fr, to, level, parent_id = item["fr"], item["to"], item["level"], item["parent_id"]
+            timer = item["timer"]
+            timer.add("download", dl_seconds)
+            end_ts = datetime.now()
+            if saved is None:
+                logger.warning("pipeline: download failed fr=%s to=%s", fr, to)
+                _fail_or_retry(ctx, (fr, to, level, parent_id), "failed",
+                               _record(fr, to, "failed", 0, level, exception="download_failed",
+                                       start_time=item["start_ts"], end_time=end_ts, parent_id=parent_id, timings=timer))
+                continue
+            declared = int(_parse_declared_count(text) or 0)
+            logger.debug("pipeline: declared=%s path=%s fr=%s to=%s", declared, saved.path, fr, to)
+            for sub_fr, sub_to in _handle_download(ctx, fr, to, level, saved, declared, item["start_ts"], end_ts,
+                                                   parent_id, timer):
+                split_children.append((sub_fr, sub_to, level + 1, _window_id(fr, to)))
+        # 子窗口优先于尚未提交的窗口，保持整体推进顺序（启用工作队列时子窗口已进入队列，由任意节点领取）
+        if ctx.queue is None:
+            pending.extendleft(reversed(split_children))
+
+        # 超时未收到消息的在途窗口视为 no_data
+        now = time.monotonic()
+        for item in [it for it in in_flight if now - it["submit_mono"] >= max_wait]:
+            in_flight.remove(item)
+            logger.info("pipeline: no_data fr=%s to=%s", item["fr"], item["to"])
+            item["timer"].add("wait", now - item["submit_mono"])
+            retried = _fail_or_retry(ctx, (item["fr"], item["to"], item["level"], item["parent_id"]), "no_data",
+                                     _record(item["fr"], item["to"], "no_data", 0, item["level"],
+                                             start_time=item["start_ts"], end_time=datetime.now(),
+                                             parent_id=item["parent_id"], timings=item["timer"]))
+            if planner is not None and not retried:
+                planner.observe(item["fr"], item["to"], 0)
+
+
+def _skip_probed_empty(ctx: _RunContext, fr: str, to: str, density: DensityMap) -> bool:
+    """探测结果为 0 条的窗口不再导出，直接记为 no_data（skip_reason=probe_empty），返回是否已跳过。
+
+    只有每天都由 count_field 明确命中 0 条才跳过；按常见字段名猜到的 0 可能是别的计数，仍照常导出。
+    队列模式下被跳过的窗口不写入队列，也不经由租约校验的 queue.complete 更新（本节点从未领取过）。
+    """
+    if not density.empty(fr, to):
+        return False
+    logger.info("run: skip empty window by probe fr=%s to=%s", fr, to)
+    now = datetime.now()
+    _append(ctx, _record(fr, to, "no_data", 0, 0, skip_reason="probe_empty", start_time=now, end_time=now), final=False)
+    return True
+
+
+def _iter_planned(ctx: _RunContext, ranges: List[Tuple[str, str]],
+                  density: Optional[DensityMap] = None) -> Iterator[Tuple[str, str, int, str]]:
+    """自适应规划：每次只规划剩余区间的下一个窗口，之前窗口的结果（planner.observe）会影响之后窗口的大小。
+
+    density 非空时跳过探测为 0 条的窗口。
+    """
+    planner = ctx.planner
+    assert planner is not None
+    for fr, to in ranges:
+        cursor = fr
+        while cursor <= to:
+            a, b = planner.next_window(cursor, to)
+            cursor = (datetime.strptime(b, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            if density is not None and _skip_probed_empty(ctx, a, b, density):
+                continue
+            yield (a, b, 0, "")
+
+
+def _run_sequential(ctx: _RunContext, windows: Iterable[Tuple[str, str, int, str]]) -> None:
+    """逐窗口处理；每处理完一个窗口先收取后台处理结果并执行已到期的重试，最后等待后台处理与剩余重试全部完成。"""
+    retries = ctx.retries
+    for fr, to, level, parent_id in windows:
+        _split_and_process(ctx, fr, to, level, parent_id)
+        _drain_post(ctx)
+        if retries is not None:
+            for window in retries.pop_due():
+                _split_and_process(ctx, *window)
+    while True:
+        _drain_post(ctx, block=True)
+        if retries is None or not len(retries):
+            break
+        retries.wait_next()
+        for window in retries.pop_due():
+            _split_and_process(ctx, *window)
+
+
+def _run_queued(ctx: _RunContext, depth: int) -> None:
+    """工作队列模式：反复领取一批窗口并按流水线/逐窗口处理，直到队列中没有待处理或他人持有的窗口。"""
+    queue = ctx.queue
+    assert queue is not None
+    batch_size = max(1, queue.cfg.batch or depth)
+    match_by_range = bool(ctx.cfg.get("pipeline", {}).get("message_has_range", False))
+    queue.start_heartbeat()
+    while True:
+        windows = queue.lease(batch_size)
+        if not windows:
+            left = queue.outstanding()
+            if left == 0:
+                break
+            # 其它节点持有的窗口可能拆分出新的子窗口，或因节点崩溃租约到期后可重新领取
+            logger.info("queue: waiting, %s windows held by other workers", left)
+            time.sleep(queue.cfg.idle_poll_seconds)
+            continue
+        logger.info("queue: leased windows=%s", [(fr, to) for fr, to, _, _ in windows])
+        if depth > 1 or match_by_range:
+            # 消息带日期区间时即使逐窗口也按区间匹配，不把会话中其它导出的消息当作本窗口的结果
+            _run_pipelined(ctx, windows, depth)
+        else:
+            _run_sequential(ctx, windows)
+    logger.info("queue: finished worker=%s counts=%s lost_leases=%s", queue.worker_id, queue.counts(), queue.lost_leases)
+
+
+def _uncovered_ranges(start_date: str, end_date: str, completed_ids: Set[str]) -> List[Tuple[str, str]]:
+    """返回 [start_date, end_date] 内未被任何已完成窗口覆盖的连续日期区间。"""
+    covered: Set[str] = set()
+    for wid in completed_ids:
+        rng = _parse_window_id(wid)
+        if rng is None:
+            continue
+        fr, to = rng
+        covered.update(day for day, _ in generate_initial_windows(fr, to, 1))
+    ranges: List[Tuple[str, str]] = []
+    run_start: Optional[str] = None
+    prev: Optional[str] = None
+    for day, _ in generate_initial_windows(start_date, end_date, 1):
+        if day in covered:
+            if run_start is not None:
+                ranges.append((run_start, prev or run_start))
+                run_start = None
+        elif run_start is None:
+            run_start = day
+        prev = day
+    if run_start is not None:
+        ranges.append((run_start, prev or run_start))
+    return ranges
+
+
+def _expand_resume(fr: str, to: str, level: int, parent_id: str, store: RunStateStore,
+                   out: List[Tuple[str, str, int, str]]) -> None:
+    """沿拆分树展开待执行窗口：已完成的跳过；已拆分的不再导出父窗口，只递归其未完成的子窗口。"""
+    wid = _window_id(fr, to)
+    if store.is_completed(wid):
+        logger.debug("resume: skip completed window_id=%s level=%s", wid, level)
+        return
+    child_ids = store.split_children(wid)
+    children = [rng for rng in (_parse_window_id(c) for c in child_ids) if rng is not None]
+    if children:
+        logger.debug("resume: window_id=%s already split -> children=%s", wid, child_ids)
+        for sub_fr, sub_to in children:
+            _expand_resume(sub_fr, sub_to, level + 1, wid, store, out)
+        return
+    out.append((fr, to, level, parent_id))
+
+
+def run(cfg: dict, store: Optional[RunStateStore] = None, session: Optional[BrowserSession] = None) -> None:
+    # 准备 run_state（启动时读取一次并建立索引）；session 可由调用方提供（如基准测试的会话替身），此时由调用方负责关闭
+    own_store = store is None
+    if store is None:
+        store = open_store(cfg)
+    try:
+        _run(cfg, store, session)
+    finally:
+        if own_store:
+            store.close()
+        else:
+            store.flush()
+
+
+def _run(cfg: dict, store: RunStateStore, session: Optional[BrowserSession] = None) -> None:
     # 初始窗口
     seq: List[int] = list(cfg.get("split_days_sequence", [7, 3, 1]))
     initial_days = int(seq[0]) if seq else 7
-    initial_windows = generate_initial_windows(cfg.get("start_date"), cfg.get("end_date"), initial_days)
-    logger.info("run: initial_windows=%s", initial_windows)
+    # 断点续跑：跳过已完成窗口
+    resume = (store.cfg.resume_mode or "resume") == "resume"
+    strategy = str(cfg.get("planner", {}).get("strategy", "sequence")).lower()
+    planner: Optional[DensityPlanner] = None
+    probe_cfg = cfg.get("probe", {})
+    density: Optional[DensityMap] = None
+    # 待执行窗口：(from, to, split_level, parent_id)
+    todo: List[Tuple[str, str, int, str]] = []
+    ranges: List[Tuple[str, str]] = []
+    if strategy == "adaptive" or bool(probe_cfg.get("enabled", False)):
+        # 自适应：按历史密度规划窗口；续跑时以“已完成窗口覆盖的日期”为准跳过
+        planner = planner_from_cfg(cfg)
+        planner.load_records(store.records())
+        if bool(probe_cfg.get("enabled", False)):
+            # 先探测每日条数（只取总数），按已知密度规划，导出窗口的条数已知低于上限
+            density = probe_density(cfg, cfg.get("start_date"), cfg.get("end_date"))
+            planner.load_probe({d: float(e["count"]) for d, e in density.days.items()},
+                               float(probe_cfg.get("target_ratio", 0.95)))
+        # 窗口在执行时逐个规划（见 _iter_planned），这里只确定未覆盖的日期区间
+        ranges = _uncovered_ranges(cfg.get("start_date"), cfg.get("end_date"), store.completed_ids() if resume else set())
+        logger.info("run: adaptive uncovered_ranges=%s probe=%s", ranges, density is not None)
+    else:
+        initial_windows = generate_initial_windows(cfg.get("start_date"), cfg.get("end_date"), initial_days)
+        logger.info("run: initial_windows=%s", initial_windows)
+        for fr, to in initial_windows:
+            if resume:
+                _expand_resume(fr, to, 0, "", store, todo)
+            else:
+                todo.append((fr, to, 0, ""))
+        logger.info("run: pending windows=%s", [(fr, to) for fr, to, _, _ in todo])
 
-    session = BrowserSession(cfg)
+    depth = _pipeline_depth(cfg)
+    # queue.backend=sqlite：多个节点共享一个工作队列，按租约领取窗口
+    queue = open_queue(cfg)
+    own_session = session is None
+    if session is None:
+        session = BrowserSession(cfg)
+    # 整个运行复用一个带连接池的导出客户端（http.backend 选择同步/异步实现）
+    client = open_export_client(cfg)
+    metrics = RunMetrics(cfg)
+    # 下载后的摘要/重命名/行数核对/中间文件转换在后台处理池中进行（postprocess.workers）
+    post = open_postprocessor(cfg)
+    # 失败/超时窗口在本次运行内按指数延迟重试（retry.window_retries / retry.no_data_retries）
+    ctx = _RunContext(cfg=cfg, seq=seq, store=store, session=session, client=client, planner=planner,
+                      metrics=metrics, queue=queue, retries=retry_from_cfg(cfg), post=post)
+    skip_density = density if density is not None and bool(probe_cfg.get("skip_empty", True)) else None
     try:
-        # 逐窗口处理
-        for fr, to in initial_windows:
-            wid = _window_id(fr, to)
-            if wid in completed and (rs_cfg.resume_mode or "resume") == "resume":
-                logger.debug("run: skip completed window_id=%s fr=%s to=%s", wid, fr, to)
-                continue
-            _split_and_process(cfg, fr, to, seq, 0, rs_cfg, session)
+        windows: Iterable[Tuple[str, str, int, str]] = todo
+        if planner is not None:
+            windows = _iter_planned(ctx, ranges, skip_density)
+        if queue is not None:
+            # 队列需要一次写入全部初始窗口，自适应规划在此按当前密度一次展开；探测为空的窗口已在展开时记为 no_data，不写入队列
+            todo = list(windows)
+            queue.seed([(_window_id(fr, to), fr, to, level, parent_id) for fr, to, level, parent_id in todo],
+                       run_range=f"{cfg.get('start_date')}..{cfg.get('end_date')}")
+            _run_queued(ctx, depth)
+        elif depth > 1:
+            _run_pipelined(ctx, windows, depth)
+        else:
+            # 逐窗口处理
+            _run_sequential(ctx, windows)
     finally:
+        # 运行异常中断时，后台已完成（或仍在处理）的窗口也要先记入运行状态，否则续跑会重新导出这些窗口
         try:
-            session.close()
+            _drain_post(ctx, block=True)
         except Exception:
-            pass
+            logger.exception("run: drain postprocess results failed")
+        post.close()
+        if queue is not None:
+            queue.close()
+        client.close()
+        # 分阶段耗时汇总与限速器快照：写出 metrics.json_path / metrics.textfile_path
+        try:
+            metrics.write(client.stats())
+        except Exception:
+            logger.exception("run: write metrics failed")
+        if own_session:
+            try:
+                session.close()
+            except Exception:
+                pass
@@ -0,0 +1,129 @@
+"""
+自适应窗口规划（density-predictive）
+- 依据 run_windows.csv（RunStateStore）中已完成窗口的“共计”估算每日记录密度
+- 未知日期取邻近已知日期的平均密度
+- 贪心选择窗口天数，使预估条数恰好低于 max_count_per_file * target_ratio
+- 命中上限的窗口记为密度下界，重新规划时自然缩小窗口
+- 启用条数探测（scripts/probe.py）时，以探测得到的每日条数为准
+"""
+from typing import Dict, List, Tuple, Optional, Iterable
+from datetime import timedelta
+import logging
+
+from .window_gen import _parse, _fmt
+
+logger = logging.getLogger(__name__)
+
+
+def _days_between(fr: str, to: str) -> List[str]:
+    start, end = _parse(fr), _parse(to)
+    return [_fmt(start + timedelta(days=i)) for i in range((end - start).days + 1)]
+
+
+class DensityPlanner:
+    def __init__(self, max_count: int, max_days: int, target_ratio: float = 0.8, neighbor_days: int = 14) -> None:
+        self.max_count = max_count
+        self.max_days = max(1, max_days)
+        self.target = max(1.0, max_count * target_ratio)
+        self.neighbor_days = max(0, neighbor_days)
+        # exact: 由未触顶窗口得到的日均条数；lower: 由触顶窗口得到的日均条数下界
+        self.exact: Dict[str, float] = {}
+        self.lower: Dict[str, float] = {}
+
+    def observe(self, fr: str, to: str, declared: int) -> None:
+        days = _days_between(fr, to)
+        per_day = declared / len(days)
+        if declared >= self.max_count:
+            for d in days:
+                if d not in self.exact:
+                    self.lower[d] = max(self.lower.get(d, 0.0), per_day)
+        else:
+            for d in days:
+                self.exact[d] = per_day
+                self.lower.pop(d, None)
+
+    def load_records(self, rows: Iterable[Dict[str, str]]) -> None:
+        """从历史状态行中学习密度：with_data/no_data 为精确值，split/manual（触顶）为下界。"""
+        loaded = 0
+        for row in rows:
+            status = (row.get("status") or "").strip()
+            fr = (row.get("from_date") or "").strip()
+            to = (row.get("to_date") or "").strip()
+            if not fr or not to or status not in ("with_data", "no_data", "manual", "split"):
+                continue
+            try:
+                declared = int((row.get("declared_count") or "0").strip() or 0)
+            except ValueError:
+                continue
+            self.observe(fr, to, declared)
+            loaded += 1
+        logger.debug("planner: loaded %s rows, exact_days=%s lower_days=%s", loaded, len(self.exact), len(self.lower))
+
+    def load_probe(self, counts: Dict[str, float], target_ratio: Optional[float] = None) -> None:
+        """导入条数探测得到的每日条数（不受导出上限截断，视为精确值，覆盖历史估计）。
+
+        target_ratio 给出时改用该比例作为单窗口目标：密度已知，不必像按历史估算那样留较大余量。
+        """
+        for day, count in counts.items():
+            self.exact[day] = float(count)
+            self.lower.pop(day, None)
+        if target_ratio:
+            self.target = max(1.0, self.max_count * target_ratio)
+        logger.debug("planner: loaded probe days=%s target=%s", len(counts), self.target)
+
+    def estimate(self, day: str) -> float:
+        if day in self.exact:
+            return self.exact[day]
+        known: List[float] = []
+        if self.neighbor_days:
+            base = _parse(day)
+            for off in range(1, self.neighbor_days + 1):
+                for d in (_fmt(base - timedelta(days=off)), _fmt(base + timedelta(days=off))):
+                    if d in self.exact:
+                        known.append(self.exact[d])
+        guess = sum(known) / len(known) if known else self.target / self.max_days
+        return max(guess, self.lower.get(day, 0.0))
+
+    def _grow(self, days: List[str], i: int, cap_days: int) -> int:
+        """从 days[i] 起向后扩展，返回预估条数不超过目标值的最后一天下标（至少包含 days[i]）。"""
+        total = self.estimate(days[i])
+        j = i
+        while j + 1 < len(days) and j + 1 - i < cap_days:
+            nxt = total + self.estimate(days[j + 1])
+            if nxt > self.target + 1e-6:
+                break
+            total = nxt
+            j += 1
+        return j
+
+    def plan(self, fr: str, to: str, max_days: Optional[int] = None) -> List[Tuple[str, str]]:
+        """把 [fr, to] 贪心切分为预估条数不超过目标值的连续窗口（每个窗口至少 1 天）。"""
+        cap_days = max(1, min(self.max_days, max_days or self.max_days))
+        windows: List[Tuple[str, str]] = []
+        days = _days_between(fr, to)
+        i = 0
+        while i < len(days):
+            j = self._grow(days, i, cap_days)
+            windows.append((days[i], days[j]))
+            i = j + 1
+        logger.debug("planner: plan fr=%s to=%s cap_days=%s -> %s", fr, to, cap_days, windows)
+        return windows
+
+    def next_window(self, fr: str, to: str) -> Tuple[str, str]:
+        """只规划 [fr, to] 的第一个窗口；其余部分等该窗口的结果被 observe 之后再规划。"""
+        end = min(_parse(to), _parse(fr) + timedelta(days=max(1, self.max_days) - 1))
+        days = _days_between(fr, _fmt(end))
+        j = self._grow(days, 0, max(1, self.max_days))
+        logger.debug("planner: next_window fr=%s to=%s -> %s..%s", fr, to, days[0], days[j])
+        return days[0], days[j]
+
+
+def from_config(root_cfg: dict) -> DensityPlanner:
+    pcfg = root_cfg.get("planner", {})
+    seq = list(root_cfg.get("split_days_sequence", [7, 3, 1]))
+    return DensityPlanner(
+        max_count=int(root_cfg.get("max_count_per_file", 1000)),
+        max_days=int(pcfg.get("max_days", seq[0] if seq else 7)),
+        target_ratio=float(pcfg.get("target_ratio", 0.8)),
+        neighbor_days=int(pcfg.get("neighbor_days", 14)),
+    )
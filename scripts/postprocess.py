@@ -0,0 +1,166 @@
+"""
+下载后的后台处理（postprocess.workers>0）
+- 摘要补算、按标准名重命名、行数核对、转换为合并用的按列中间文件，交给后台工作池处理；
+  主循环下载完即继续提交/等待下一个窗口，每个窗口的主循环耗时只剩 导出 + 等待 + 点击下载
+- 处理结果由主循环收取后再写入运行状态：写 CSV、更新指标与工作队列仍在主线程，与之前一致
+- 行数核对：数据行数与机器人消息的“共计”不一致（或文件无法读取）时按 on_mismatch 处理：
+  warn=照常记录并把差异写入 exception 列，fail=记为 failed 并按运行内重试
+- 中间文件写入 merge.cache_dir（以摘要命名），运行结束后的合并直接命中解析缓存，不再重新解析
+- workers=0 时在主线程内按同样的步骤处理
+"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import time
+
+from .hashing import digest_file
+from .merge_and_validate import cache_intermediate, count_data_rows
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PostProcessConfig:
+    workers: int = 2
+    executor: str = "thread"
+    verify_rows: bool = True
+    on_mismatch: str = "warn"
+    convert: bool = True
+    cache_dir: str = ""
+    digest_algo: str = "md5"
+
+
+def from_config(root_cfg: dict) -> PostProcessConfig:
+    pcfg = root_cfg.get("postprocess", {})
+    executor = str(pcfg.get("executor", "thread")).lower()
+    if executor not in ("thread", "process"):
+        raise ValueError(f"不支持的 postprocess.executor: {executor}（可选: thread, process）")
+    on_mismatch = str(pcfg.get("on_mismatch", "warn")).lower()
+    if on_mismatch not in ("warn", "fail"):
+        raise ValueError(f"不支持的 postprocess.on_mismatch: {on_mismatch}（可选: warn, fail）")
+    return PostProcessConfig(
+        workers=max(0, int(pcfg.get("workers", 2))),
+        executor=executor,
+        verify_rows=bool(pcfg.get("verify_rows", True)),
+        on_mismatch=on_mismatch,
+        convert=bool(pcfg.get("convert", True)),
+        cache_dir=str(root_cfg.get("merge", {}).get("cache_dir", "./state/parse_cache") or ""),
+        digest_algo=str(root_cfg.get("download", {}).get("digest_algo", "md5")).lower(),
+    )
+
+
+def standard_path(download_dir: str, fr: str, to: str, count: int) -> str:
+    # 统一命名：合同协同_YYYYMMDD-YYYYMMDD_共{COUNT}条.xlsx
+    base = f"合同协同_{fr.replace('-', '')}-{to.replace('-', '')}_共{count}条.xlsx"
+    return str(Path(download_dir) / base)
+
+
+def rename_file(saved_path: str, dest: str) -> str:
+    """重命名为 dest；失败时保留原名并返回原路径。"""
+    try:
+        if Path(saved_path).resolve() != Path(dest).resolve():
+            logger.debug("rename: %s -> %s", saved_path, dest)
+            Path(saved_path).rename(dest)
+            return dest
+    except Exception:
+        # 保留原名
+        return saved_path
+    return dest
+
+
+def process_download(job: Dict[str, Any]) -> Dict[str, Any]:
+    """单个已下载文件的后处理，只依赖参数（可在线程或子进程中执行）。
+
+    job: path, digest（为空时补算）, algo, dest（为空时不重命名）, verify, cache_dir（为空时不转换）
+    返回: path（重命名后）, digest, rows（未核对时为 None）, error, rename_seconds, post_seconds
+    """
+    t0 = time.perf_counter()
+    out: Dict[str, Any] = {"path": job["path"], "digest": job.get("digest") or "", "rows": None, "error": "",
+                           "rename_seconds": 0.0, "post_seconds": 0.0}
+    try:
+        if not out["digest"]:
+            out["digest"] = digest_file(out["path"], job.get("algo") or "md5")
+        if job.get("dest"):
+            r0 = time.perf_counter()
+            out["path"] = rename_file(out["path"], job["dest"])
+            out["rename_seconds"] = time.perf_counter() - r0
+        if job.get("cache_dir"):
+            # 转换即完整解析一遍，行数直接取自转换结果
+            res = cache_intermediate(out["path"], out["digest"], job["cache_dir"])
+            out["error"] = res.get("error") or ""
+            out["rows"] = None if out["error"] else int(res.get("rows") or 0)
+        elif job.get("verify"):
+            out["rows"] = count_data_rows(out["path"])
+    except Exception as e:
+        out["error"] = str(e)
+    out["post_seconds"] = max(0.0, time.perf_counter() - t0 - out["rename_seconds"])
+    return out
+
+
+class PostProcessor:
+    """后台处理池：submit 提交已下载文件及调用方上下文，collect 取回已完成的 (结果, 上下文)。"""
+
+    def __init__(self, cfg: PostProcessConfig) -> None:
+        self.cfg = cfg
+        self._pool: Optional[Executor] = None
+        if cfg.workers > 0:
+            pool_cls = ProcessPoolExecutor if cfg.executor == "process" else ThreadPoolExecutor
+            self._pool = pool_cls(max_workers=cfg.workers)
+        self._pending: List[Tuple[Future, Dict[str, Any], Any]] = []
+        self._ready: List[Tuple[Dict[str, Any], Any]] = []
+        logger.info("postprocess: workers=%s executor=%s verify_rows=%s convert=%s",
+                    cfg.workers, cfg.executor, cfg.verify_rows, bool(cfg.convert and cfg.cache_dir))
+
+    @property
+    def background(self) -> bool:
+        return self._pool is not None
+
+    def submit(self, path: str, digest: str, dest: str, context: Any) -> None:
+        job = {
+            "path": path,
+            "digest": digest,
+            "algo": self.cfg.digest_algo,
+            "dest": dest,
+            "verify": self.cfg.verify_rows,
+            "cache_dir": self.cfg.cache_dir if self.cfg.convert else "",
+        }
+        if self._pool is None:
+            self._ready.append((process_download(job), context))
+            return
+        self._pending.append((self._pool.submit(process_download, job), job, context))
+        logger.debug("postprocess: submitted path=%s pending=%s", path, len(self._pending))
+
+    def collect(self, block: bool = False) -> List[Tuple[Dict[str, Any], Any]]:
+        """取回已完成的结果；block=True 时等待全部在途任务完成。"""
+        if self._pending:
+            if block:
+                wait([f for f, _, _ in self._pending])
+            still: List[Tuple[Future, Dict[str, Any], Any]] = []
+            for fut, job, context in self._pending:
+                if not fut.done():
+                    still.append((fut, job, context))
+                    continue
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    logger.exception("postprocess: job failed")
+                    res = {"path": job["path"], "digest": job["digest"], "rows": None, "error": str(e),
+                           "rename_seconds": 0.0, "post_seconds": 0.0}
+                self._ready.append((res, context))
+            self._pending = still
+        ready, self._ready = self._ready, []
+        return ready
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._ready)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def open_postprocessor(root_cfg: dict) -> PostProcessor:
+    return PostProcessor(from_config(root_cfg))
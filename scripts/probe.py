@@ -0,0 +1,171 @@
+"""
+导出前的条数探测（probe.enabled=true）
+- 对每天（或每 probe.block_days 天一块）调用一次轻量的列表/搜索接口，只取总条数，不触发导出、机器人消息与下载
+- 请求头复用 http_export.compose_headers，请求体沿用 build_body 的 searchCooperationByCreateTime 结构
+  （再合并 probe.extra_body，如 {"pageNum": 1, "pageSize": 1}），限速与退避重试与导出请求一致
+- 结果持久化为密度表 probe.density_path（JSON），再次运行时只探测缺失的日期和最近 refresh_recent_days 天
+- 规划器按密度表切分窗口，使每个导出窗口的条数已知低于 max_count_per_file；探测为 0 的窗口可直接记为 no_data
+- 只有 count_field 明确命中的条数才记为 explicit；按常见字段名猜到的条数只用于规划，为 0 时不跳过导出
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+import json
+import logging
+import os
+
+from .http_export import ExportClient, DEFAULT_BASE_URL
+from .window_gen import generate_initial_windows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_PATH = "/clm/api/cooperation/searchCooperationRecords"
+FALLBACK_COUNT_KEYS = ("total", "totalCount", "total_count", "count")
+
+
+def _dig(data: Any, dotted: str) -> Any:
+    for key in dotted.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _find_count(data: Any, depth: int = 0) -> Optional[int]:
+    """count_field 未命中时，在响应中查找常见的总数字段。"""
+    if depth > 3 or not isinstance(data, dict):
+        return None
+    for key in FALLBACK_COUNT_KEYS:
+        if isinstance(data.get(key), (int, float)) and not isinstance(data.get(key), bool):
+            return int(data[key])
+    for value in data.values():
+        found = _find_count(value, depth + 1)
+        if found is not None:
+            return found
+    return None
+
+
+class CountProbe(ExportClient):
+    """条数探测客户端：与导出客户端共用连接池、请求头、限速和重试逻辑，只是请求地址与请求体附加字段不同。"""
+
+    def __init__(self, cfg: dict) -> None:
+        super().__init__(cfg)
+        pcfg = cfg.get("probe", {})
+        base = str(cfg.get("http", {}).get("base_url") or DEFAULT_BASE_URL).rstrip("/")
+        self.url = f"{base}{pcfg.get('path', DEFAULT_PROBE_PATH)}"
+        self.count_field = str(pcfg.get("count_field", "data.total"))
+        self.extra_body: Dict[str, Any] = dict(pcfg.get("extra_body") or {"pageNum": 1, "pageSize": 1})
+        logger.debug("probe: url=%s count_field=%s extra_body=%s", self.url, self.count_field, self.extra_body)
+
+    def count(self, from_date: str, to_date: str) -> Tuple[Optional[int], bool]:
+        """返回 (条数, 是否由 count_field 明确命中)；请求失败或找不到条数时为 (None, False)。"""
+        res = self.submit(from_date, to_date, extra_body=self.extra_body)
+        if not res.get("ok"):
+            logger.warning("probe: request failed fr=%s to=%s err=%s", from_date, to_date, res.get("error"))
+            return None, False
+        data = res.get("data")
+        value = _dig(data, self.count_field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value), True
+        found = _find_count(data)
+        if found is None:
+            logger.warning("probe: no count field in response fr=%s to=%s text=%s", from_date, to_date, (res.get("text") or "")[:200])
+        else:
+            logger.debug("probe: count_field=%s missed, guessed count=%s fr=%s to=%s", self.count_field, found, from_date, to_date)
+        return found, False
+
+
+class DensityMap:
+    """按天的条数表：{日期: {"count": 日均条数, "block": "起..止", "probed_at": ISO 时间, "explicit": 是否由 count_field 命中}}。"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.days: Dict[str, Dict[str, Any]] = {}
+        p = Path(path)
+        if p.exists():
+            try:
+                self.days = dict(json.loads(p.read_text(encoding="utf-8")).get("days", {}))
+            except Exception:
+                logger.exception("probe: density map unreadable, starting empty path=%s", path)
+
+    def record(self, fr: str, to: str, count: int, explicit: bool = True) -> None:
+        days = [d for d, _ in generate_initial_windows(fr, to, 1)]
+        now = datetime.now().isoformat(timespec="seconds")
+        for d in days:
+            self.days[d] = {"count": count / len(days), "block": f"{fr}..{to}", "probed_at": now, "explicit": explicit}
+
+    def count(self, day: str) -> Optional[float]:
+        entry = self.days.get(day)
+        return float(entry["count"]) if entry else None
+
+    def total(self, fr: str, to: str) -> Optional[float]:
+        """区间内各天条数之和；有任一天未探测时返回 None。"""
+        total = 0.0
+        for d, _ in generate_initial_windows(fr, to, 1):
+            c = self.count(d)
+            if c is None:
+                return None
+            total += c
+        return total
+
+    def empty(self, fr: str, to: str) -> bool:
+        """区间内每天都由 count_field 明确探测为 0 条时返回 True（旧密度表无 explicit 标记，按未明确处理）。"""
+        for d, _ in generate_initial_windows(fr, to, 1):
+            entry = self.days.get(d)
+            if not entry or not entry.get("explicit") or float(entry["count"]) != 0:
+                return False
+        return True
+
+    def save(self) -> None:
+        p = Path(self.path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + ".tmp")
+        tmp.write_text(json.dumps({"updated_at": datetime.now().isoformat(timespec="seconds"), "days": self.days},
+                                  ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, p)
+
+
+def _blocks_to_probe(dmap: DensityMap, fr: str, to: str, block_days: int, refresh_recent_days: int) -> List[Tuple[str, str]]:
+    """需要探测的连续日期块：缺失的日期，以及距今 refresh_recent_days 天内（仍可能新增记录）的日期。"""
+    fresh_before = (date.today() - timedelta(days=max(0, refresh_recent_days))).isoformat()
+    missing = [d for d, _ in generate_initial_windows(fr, to, 1) if dmap.count(d) is None or d > fresh_before]
+    blocks: List[Tuple[str, str]] = []
+    run: List[str] = []
+    for d in missing:
+        if run and (len(run) >= block_days or date.fromisoformat(d) != date.fromisoformat(run[-1]) + timedelta(days=1)):
+            blocks.append((run[0], run[-1]))
+            run = []
+        run.append(d)
+    if run:
+        blocks.append((run[0], run[-1]))
+    return blocks
+
+
+def probe_density(cfg: dict, fr: str, to: str) -> DensityMap:
+    """探测 [fr, to] 内尚无记录的日期，更新并保存密度表。"""
+    pcfg = cfg.get("probe", {})
+    dmap = DensityMap(str(pcfg.get("density_path", "./state/density_map.json")))
+    blocks = _blocks_to_probe(dmap, fr, to, max(1, int(pcfg.get("block_days", 1))),
+                              int(pcfg.get("refresh_recent_days", 3)))
+    if not blocks:
+        logger.info("probe: density map already covers %s..%s", fr, to)
+        return dmap
+    workers = max(1, int(pcfg.get("workers", 4)))
+    logger.info("probe: probing blocks=%s workers=%s", len(blocks), workers)
+    with CountProbe(cfg) as probe:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            counts = list(ex.map(lambda b: probe.count(*b), blocks))
+    failed = guessed = 0
+    for (b_fr, b_to), (count, explicit) in zip(blocks, counts):
+        if count is None:
+            failed += 1
+            continue
+        guessed += 0 if explicit else 1
+        dmap.record(b_fr, b_to, count, explicit)
+    dmap.save()
+    if guessed:
+        logger.warning("probe: count_field=%s missed in %s blocks, guessed counts are used for planning only",
+                       str(pcfg.get("count_field", "data.total")), guessed)
+    logger.info("probe: probed=%s failed=%s saved=%s", len(blocks) - failed, failed, dmap.path)
+    return dmap
@@ -0,0 +1,139 @@
+"""
+导出请求限速与退避
+- RateController：令牌桶 + AIMD（加性增、乘性减），所有导出请求共享
+  - 每次成功按 increase_step 提高速率（不超过 max_rate）
+  - 收到 429/5xx 时速率乘以 decrease_factor（不低于 min_rate），有 Retry-After 时在该时间内暂停发放令牌
+- backoff_delay：带抖动（full jitter）的指数退避，上限 max_backoff_seconds
+- parse_retry_after：解析 Retry-After（秒数或 HTTP 日期）
+"""
+from typing import Any, Dict, Optional
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import asyncio
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = (429,)
+DECREASE_COOLDOWN_SECONDS = 1.0
+
+
+def is_throttle_status(status: Optional[int]) -> bool:
+    return status is not None and (status in THROTTLE_STATUSES or 500 <= status < 600)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, jitter: bool = True) -> float:
+    """第 attempt 次失败后的等待秒数：min(cap, base * 2^(attempt-1))，开启抖动时在 [0, 该值] 内均匀取值。"""
+    delay = min(cap, base * (2 ** max(0, attempt - 1)))
+    return random.uniform(0, delay) if jitter else delay
+
+
+class RateController:
+    """线程安全的令牌桶，速率按 AIMD 调整。acquire/aacquire 先预留令牌再在锁外等待，同步与异步调用可共用。"""
+
+    def __init__(self, initial_rate: float = 2.0, min_rate: float = 0.2, max_rate: float = 10.0,
+                 increase_step: float = 0.2, decrease_factor: float = 0.5, burst: int = 2) -> None:
+        self.min_rate = max(0.01, min_rate)
+        self.max_rate = max(self.min_rate, max_rate)
+        self.rate = min(self.max_rate, max(self.min_rate, initial_rate))
+        self.increase_step = max(0.0, increase_step)
+        self.decrease_factor = min(1.0, max(0.01, decrease_factor))
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = -1e9
+        self._lock = threading.Lock()
+        # 统计信息
+        self.acquired = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def _reserve(self) -> float:
+        """预留一个令牌，返回需要等待的秒数。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            wait = max(0.0, self._paused_until - now)
+            self._tokens -= 1.0
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self.rate)
+            self.acquired += 1
+            self.waited_seconds += wait
+            return wait
+
+    def acquire(self) -> float:
+        wait = self._reserve()
+        if wait > 0:
+            logger.debug("rate_limit: wait %.2fs rate=%.2f/s", wait, self.rate)
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self) -> float:
+        wait = self._reserve()
+        if wait > 0:
+            logger.debug("rate_limit: wait %.2fs rate=%.2f/s", wait, self.rate)
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, status: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            old = self.rate
+            # 同一批并发请求几乎同时收到的限流信号只降速一次
+            if now - self._last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                self._last_decrease = now
+            self.throttled += 1
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            # 丢弃积攒的令牌，避免恢复后瞬间突发
+            self._tokens = min(self._tokens, 0.0)
+        logger.info("rate_limit: throttled status=%s retry_after=%s rate %.2f/s -> %.2f/s", status, retry_after, old, self.rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "rate_per_sec": round(self.rate, 3),
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
+
+
+def from_config(root_cfg: dict) -> Optional[RateController]:
+    rcfg = root_cfg.get("rate_limit", {})
+    if not bool(rcfg.get("enabled", True)):
+        return None
+    return RateController(
+        initial_rate=float(rcfg.get("initial_rate_per_sec", 2.0)),
+        min_rate=float(rcfg.get("min_rate_per_sec", 0.2)),
+        max_rate=float(rcfg.get("max_rate_per_sec", 10.0)),
+        increase_step=float(rcfg.get("increase_step", 0.2)),
+        decrease_factor=float(rcfg.get("decrease_factor", 0.5)),
+        burst=int(rcfg.get("burst", 2)),
+    )
@@ -0,0 +1,85 @@
+"""
+运行内的窗口重试调度
+- 导出失败/下载失败（failed）与等待消息超时（no_data）的窗口按带上限的指数延迟重新排队，
+  延迟期间其它窗口继续推进，不必等整个程序重跑
+- 每个窗口按原因分别计数：failed 最多重试 retry.window_retries 次，超时最多 retry.no_data_retries 次
+- 已安排重试的窗口在运行状态中记为 retry_pending，重试次数用尽后才写入 failed / no_data
+- 延迟：min(window_max_backoff_seconds, window_backoff_seconds * 2^(第几次重试-1))
+"""
+from typing import Dict, List, Optional, Tuple
+import heapq
+import itertools
+import logging
+import time
+
+from .rate_limit import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# (from, to, split_level, parent_id)
+Window = Tuple[str, str, int, str]
+
+
+class RetryScheduler:
+    def __init__(self, failed_retries: int = 2, no_data_retries: int = 0, base_seconds: float = 30.0,
+                 max_seconds: float = 300.0) -> None:
+        self.limits: Dict[str, int] = {"failed": max(0, failed_retries), "no_data": max(0, no_data_retries)}
+        self.base_seconds = max(0.0, base_seconds)
+        self.max_seconds = max(self.base_seconds, max_seconds)
+        self._heap: List[Tuple[float, int, Window]] = []
+        self._seq = itertools.count()
+        self._tries: Dict[Tuple[Window, str], int] = {}
+        self.scheduled = 0
+
+    def schedule(self, window: Window, reason: str) -> bool:
+        """窗口以 reason（failed / no_data）结束时调用；仍有重试次数则排队并返回 True。"""
+        key = (window, reason)
+        tries = self._tries.get(key, 0)
+        if tries >= self.limits.get(reason, 0):
+            return False
+        self._tries[key] = tries + 1
+        delay = backoff_delay(tries + 1, self.base_seconds, self.max_seconds, jitter=False)
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), window))
+        self.scheduled += 1
+        logger.info("retry: schedule fr=%s to=%s reason=%s retry=%s/%s in %.1fs",
+                    window[0], window[1], reason, tries + 1, self.limits.get(reason, 0), delay)
+        return True
+
+    def pop_due(self, now: Optional[float] = None) -> List[Window]:
+        now = time.monotonic() if now is None else now
+        due: List[Window] = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def seconds_until_next(self) -> Optional[float]:
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def wait_next(self, max_seconds: Optional[float] = None) -> None:
+        """没有其它工作时等待下一个重试到期（最多 max_seconds）。"""
+        wait = self.seconds_until_next()
+        if wait is None:
+            return
+        if max_seconds is not None:
+            wait = min(wait, max_seconds)
+        if wait > 0:
+            time.sleep(wait)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+def from_config(root_cfg: dict) -> Optional[RetryScheduler]:
+    rcfg = root_cfg.get("retry", {})
+    failed_retries = int(rcfg.get("window_retries", 2))
+    no_data_retries = int(rcfg.get("no_data_retries", 0))
+    if failed_retries <= 0 and no_data_retries <= 0:
+        return None
+    return RetryScheduler(
+        failed_retries=failed_retries,
+        no_data_retries=no_data_retries,
+        base_seconds=float(rcfg.get("window_backoff_seconds", 30)),
+        max_seconds=float(rcfg.get("window_max_backoff_seconds", 300)),
+    )
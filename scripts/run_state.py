@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Set, Dict, Any
+from typing import List, Set, Dict, Any, Optional, Iterator
 import csv
+import logging
+
+logger = logging.getLogger(__name__)
 
 HEADERS: List[str] = [
     "window_id",
@@ -11,6 +14,8 @@ HEADERS: List[str] = [
     "status",
     "declared_count",
     "split_level",
+    "parent_id",
+    "children",
     "retries",
     "skip_reason",
     "exception",
@@ -19,6 +24,12 @@ HEADERS: List[str] = [
     "start_time",
     "end_time",
     "duration_ms",
+    "chat_ms",
+    "export_ms",
+    "wait_ms",
+    "download_ms",
+    "rename_ms",
+    "post_ms",
 ]
 
 
@@ -28,6 +39,7 @@ class RunStateConfig:
     encoding: str = "utf-8-sig"
     line_ending: str = "crlf"
     flush: bool = True
+    flush_every: int = 1
     resume_mode: str = "resume"
     completed_statuses: List[str] = None  # type: ignore
 
@@ -39,6 +51,7 @@ def from_config(root_cfg: dict) -> RunStateConfig:
         encoding=rs.get("encoding", "utf-8-sig"),
         line_ending=rs.get("line_ending", "crlf"),
         flush=rs.get("flush", True),
+        flush_every=int(rs.get("flush_every", 1)),
         resume_mode=rs.get("resume_mode", "resume"),
         completed_statuses=rs.get("completed_statuses", ["with_data", "no_data", "manual"]),
     )
@@ -60,6 +73,24 @@ def ensure_csv_exists(cfg: RunStateConfig) -> None:
             writer = csv.writer(f, lineterminator=_lineterminator(cfg))
             writer.writerow(HEADERS)
             f.flush()
+        return
+    _upgrade_header(cfg)
+
+
+def _upgrade_header(cfg: RunStateConfig) -> None:
+    # 旧版本 CSV 缺少新增列时，按新列头重写一次（缺失列留空），避免追加行与列头错位
+    p = Path(cfg.csv_path)
+    with p.open("r", encoding=cfg.encoding, newline="") as f:
+        reader = csv.DictReader(f)
+        if list(reader.fieldnames or []) == HEADERS:
+            return
+        rows = list(reader)
+    with p.open("w", encoding=cfg.encoding, newline="") as f:
+        writer = csv.writer(f, lineterminator=_lineterminator(cfg))
+        writer.writerow(HEADERS)
+        for row in rows:
+            writer.writerow([row.get(k) or "" for k in HEADERS])
+        f.flush()
 
 
 def read_completed_window_ids(cfg: RunStateConfig, completed_statuses: List[str]) -> Set[str]:
@@ -67,16 +98,25 @@ def read_completed_window_ids(cfg: RunStateConfig, completed_statuses: List[str]
     if not p.exists():
         return set()
     result: Set[str] = set()
+    done = set(completed_statuses)
     with p.open("r", encoding=cfg.encoding, newline="") as f:
         reader = csv.DictReader(f)
         for row in reader:
             status = (row.get("status") or "").strip()
             wid = (row.get("window_id") or "").strip()
-            if wid and status in set(completed_statuses):
+            if wid and status in done:
                 result.add(wid)
     return result
 
 
+def read_records(cfg: RunStateConfig) -> List[Dict[str, str]]:
+    p = Path(cfg.csv_path)
+    if not p.exists():
+        return []
+    with p.open("r", encoding=cfg.encoding, newline="") as f:
+        return list(csv.DictReader(f))
+
+
 def append_record(cfg: RunStateConfig, row: Dict[str, Any]) -> None:
     p = Path(cfg.csv_path)
     ensure_csv_exists(cfg)
@@ -87,3 +127,98 @@ def append_record(cfg: RunStateConfig, row: Dict[str, Any]) -> None:
         writer.writerow(values)
         if cfg.flush:
             f.flush()
+
+
+class RunStateStore:
+    """运行状态存储：启动时读取一次 CSV 并建立按 window_id 的内存索引，之后只追加。
+
+    - CSV 仍是对外的“事实源”与人工查看视图，列头与 HEADERS 一致
+    - 追加时保持同一个文件句柄，每 flush_every 行刷新一次（flush=false 时仅在 close 时刷新）
+    - 状态、最近一次尝试、拆分子窗口等查询均为 O(1)
+    """
+
+    def __init__(self, cfg: RunStateConfig) -> None:
+        self.cfg = cfg
+        self.completed_statuses: Set[str] = set(cfg.completed_statuses or ["with_data", "no_data", "manual"])
+        self._rows: List[Dict[str, str]] = []
+        self._latest: Dict[str, Dict[str, str]] = {}
+        self._attempts: Dict[str, int] = {}
+        self._completed: Set[str] = set()
+        self._children: Dict[str, List[str]] = {}
+        ensure_csv_exists(cfg)
+        for row in read_records(cfg):
+            self._index(row)
+        logger.debug("run_state: loaded rows=%s windows=%s completed=%s", len(self._rows), len(self._latest), len(self._completed))
+        self._fh = Path(cfg.csv_path).open("a", encoding=cfg.encoding, newline="")
+        self._writer = csv.writer(self._fh, lineterminator=_lineterminator(cfg))
+        self._unflushed = 0
+
+    def _index(self, row: Dict[str, str]) -> None:
+        self._rows.append(row)
+        wid = (row.get("window_id") or "").strip()
+        if not wid:
+            return
+        status = (row.get("status") or "").strip()
+        self._latest[wid] = row
+        self._attempts[wid] = self._attempts.get(wid, 0) + 1
+        if status in self.completed_statuses:
+            self._completed.add(wid)
+        if status == "split":
+            children = [c.strip() for c in (row.get("children") or "").split(";") if c.strip()]
+            if children:
+                self._children[wid] = children
+
+    def append(self, row: Dict[str, Any]) -> None:
+        values: List[Any] = [row.get(k, "") for k in HEADERS]
+        self._writer.writerow(values)
+        self._index({k: "" if v is None else str(v) for k, v in zip(HEADERS, values)})
+        self._unflushed += 1
+        if self.cfg.flush and self._unflushed >= max(1, self.cfg.flush_every):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._fh.closed:
+            return
+        self._fh.flush()
+        self._unflushed = 0
+
+    def close(self) -> None:
+        if self._fh.closed:
+            return
+        self.flush()
+        self._fh.close()
+
+    def __enter__(self) -> "RunStateStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def latest(self, window_id: str) -> Optional[Dict[str, str]]:
+        return self._latest.get(window_id)
+
+    def status(self, window_id: str) -> str:
+        row = self._latest.get(window_id)
+        return (row.get("status") or "").strip() if row else ""
+
+    def attempts(self, window_id: str) -> int:
+        return self._attempts.get(window_id, 0)
+
+    def is_completed(self, window_id: str) -> bool:
+        return window_id in self._completed
+
+    def completed_ids(self) -> Set[str]:
+        return set(self._completed)
+
+    def split_children(self, window_id: str) -> List[str]:
+        """该窗口最后一次 split 记录的子窗口 ID 列表，用于按拆分树续跑。"""
+        return list(self._children.get(window_id, []))
+
+    def records(self, status: Optional[str] = None) -> Iterator[Dict[str, str]]:
+        for row in self._rows:
+            if status is None or (row.get("status") or "").strip() == status:
+                yield row
+
+
+def open_store(root_cfg: dict) -> RunStateStore:
+    return RunStateStore(from_config(root_cfg))
@@ -7,18 +7,110 @@ Step 4：Playwright 网页自动化
 - 点击“下载文件”，保存到 download_dir
 - 返回 (保存路径, declared_count)
 """
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List, Set, Any, Dict
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 import os
 import re
 import time
 import logging
 import hashlib
+import uuid
+
+from .file_fetch import FileFetcher, cookie_header
+from .hashing import DownloadedFile, copy_with_digest
 
 
 MESSENGER_URL = "https://li.feishu.cn/next/messenger"
+BUTTON_TEXT = "下载文件"
+# 与 get_by_text 一致只匹配可见文本：排除 <script>/<style> 中碰巧含“下载文件”的文本节点，否则按钮数与序号会错位
+BUTTON_XPATH = "//*[not(self::script or self::style)][contains(text(),'下载文件')]"
 logger = logging.getLogger(__name__)
 
+# 页面内的 MutationObserver：会话 DOM 变化后（合并 settle_ms 内的连续变化）重新统计“下载文件”按钮数
+# 与最后一条消息文案的签名，Python 侧通过 wait_for_function 在浏览器内等待变化，无需逐次轮询 DOM。
+_WATCH_JS = """
+(settleMs) => {
+  if (window.__feishuExportWatch) return window.__feishuExportWatch.count;
+  const XPATH = "%s";
+  const nearText = (el) => { let n = el; for (let i = 0; i < 5 && n; i++) { if (n.innerText && n.innerText.includes('共计')) return n.innerText; n = n.parentElement; } return ''; };
+  const hash = (s) => { let h = 5381; for (let i = 0; i < s.length; i++) { h = ((h << 5) + h + s.charCodeAt(i)) | 0; } return (h >>> 0).toString(16); };
+  const buttons = () => {
+    const r = document.evaluate(XPATH, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const out = [];
+    for (let i = 0; i < r.snapshotLength; i++) out.push(r.snapshotItem(i));
+    return out;
+  };
+  const state = { count: 0, tailSig: '', buttons: buttons, nearText: nearText };
+  const scan = () => {
+    const bs = buttons();
+    const tail = bs.length ? nearText(bs[bs.length - 1]).replace(/\\s+/g, ' ').trim() : '';
+    state.count = bs.length;
+    state.tailSig = tail ? hash(tail) : '';
+  };
+  let timer = null, first = 0;
+  const observer = new MutationObserver(() => {
+    const now = Date.now();
+    if (timer) { clearTimeout(timer); } else { first = now; }
+    if (now - first > settleMs * 4) { timer = null; scan(); return; }
+    timer = setTimeout(() => { timer = null; scan(); }, settleMs);
+  });
+  observer.observe(document.body || document.documentElement, { childList: true, subtree: true, characterData: true });
+  scan();
+  window.__feishuExportWatch = state;
+  return state.count;
+}
+""" % BUTTON_XPATH
+_WATCH_STATE_JS = "() => { const w = window.__feishuExportWatch; return w ? [w.count, w.tailSig] : null; }"
+_WATCH_WAIT_JS = ("([n, sig]) => { const w = window.__feishuExportWatch; "
+                  "return !!w && (w.count > n || (!!sig && !!w.tailSig && w.tailSig !== sig)); }")
+# 取按钮所在消息中的文件链接：按钮或其祖先的 href/data-*，否则在同一消息容器内找带链接的元素
+_FILE_URL_JS = """
+el => {
+  const pick = (n) => {
+    if (!n || !n.getAttribute) return '';
+    const v = n.getAttribute('href') || n.getAttribute('data-url') || n.getAttribute('data-href') || n.getAttribute('data-download-url') || '';
+    return (v && !v.startsWith('javascript') && v !== '#') ? new URL(v, location.href).href : '';
+  };
+  let n = el;
+  for (let i = 0; i < 5 && n; i++) { const v = pick(n); if (v) return v; n = n.parentElement; }
+  n = el;
+  for (let i = 0; i < 5 && n; i++) {
+    const a = n.querySelector ? n.querySelector('a[href], [data-download-url], [data-url]') : null;
+    const v = pick(a);
+    if (v) return v;
+    if (n.innerText && n.innerText.includes('共计')) break;
+    n = n.parentElement;
+  }
+  return '';
+}
+"""
+# 在另一个页面中按消息文案定位同一条消息的“下载文件”按钮（同文案取最后一条），找不到返回 -1
+_FIND_BUTTON_JS = """
+([xpath, text]) => {
+  const norm = (s) => (s || '').replace(/\\s+/g, ' ').trim();
+  const nearText = (el) => { let n = el; for (let i = 0; i < 5 && n; i++) { if (n.innerText && n.innerText.includes('共计')) return n.innerText; n = n.parentElement; } return ''; };
+  const r = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+  const want = norm(text);
+  let found = -1;
+  for (let i = 0; i < r.snapshotLength; i++) { if (norm(nearText(r.snapshotItem(i))) === want) found = i; }
+  return found;
+}
+"""
+# 会话列表中的条目（或其 4 层内的祖先）是否为当前选中项：aria-selected / aria-current / active、selected 类名
+_SELECTED_JS = """
+el => {
+  for (let n = el, i = 0; i < 5 && n; i++, n = n.parentElement) {
+    if (!n.getAttribute) continue;
+    const cur = n.getAttribute('aria-current');
+    if (n.getAttribute('aria-selected') === 'true' || (cur && cur !== 'false')) return true;
+    if (/(^|[\\s_-])(active|selected)([\\s_-]|$)/i.test(n.getAttribute('class') || '')) return true;
+  }
+  return false;
+}
+"""
+_WATCH_TEXTS_JS = ("(start) => { const w = window.__feishuExportWatch; if (!w) return []; "
+                   "return w.buttons().slice(start, w.count).map(b => w.nearText(b)); }")
+
 
 def _ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
@@ -39,39 +131,178 @@ def _parse_declared_count(text: str) -> Optional[int]:
     return None
 
 
+def _parse_date_range(text: str) -> Optional[Tuple[str, str]]:
+    # 从消息文案中提取日期区间（如 2025-03-01 ~ 2025-03-07 / 2025年3月1日至2025年3月7日），用于流水线匹配窗口
+    found = re.findall(r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})", text or "")
+    if len(found) < 2:
+        return None
+    dates = [f"{int(y):04d}-{int(m):02d}-{int(d):02d}" for y, m, d in found[:2]]
+    return (dates[0], dates[1])
+
+
 class BrowserSession:
-    def __init__(self, cfg: dict) -> None:
+    def __init__(self, cfg: dict, headless: Optional[bool] = None) -> None:
         dcfg = cfg.get("download", {})
         self.user_data_dir = dcfg.get("user_data_dir", "./.browser_profile")
         self.download_dir = dcfg.get("download_dir", "./output/raw")
         self.bot_chat_name = dcfg.get("bot_chat_name", "飞书合同")
         self.max_wait_seconds = int(dcfg.get("max_wait_seconds", 90))
+        # 会话页面地址，可指向本地替身（scripts/mock_feishu.py）
+        self.messenger_url = str(dcfg.get("messenger_url") or MESSENGER_URL)
+        # observer：页面内 MutationObserver 推送变化（默认）；poll：旧的定时采样 DOM
+        self.detection = str(dcfg.get("detection", "observer")).lower()
+        self.settle_ms = int(dcfg.get("settle_ms", 300))
+        self.watch_poll_ms = int(dcfg.get("watch_poll_ms", 50))
+        # 会话就绪判断：chat_ready_selector 可见（默认为消息输入框），可选用 chat_title_selector 校验当前会话标题
+        self.chat_ready_selector = str(dcfg.get("chat_ready_selector", "[contenteditable='true']"))
+        self.chat_title_selector = str(dcfg.get("chat_title_selector", "") or "")
+        self.ready_timeout_seconds = float(dcfg.get("ready_timeout_seconds", 20))
+        self._opened_pages: Set[int] = set()
+        # 观察器（重新）注入后尚未等到会话历史渲染稳定；稳定前的按钮数不能作为基线
+        self._watch_settled = False
+        # 无界面运行需先用 --login 在有界面模式下完成一次扫码（登录态保存在 user_data_dir）
+        self.headless = bool(dcfg.get("headless", False)) if headless is None else headless
+        # 下载页面数：第 1 个页面负责监听消息，其余页面（同一浏览器上下文，共享登录态）分担点击下载
+        self.pages = max(1, int(dcfg.get("pages", 1)))
+        # 工作页面只在流水线批量下载（download_many）中使用，而该路径要求 in_flight>1 且消息带日期区间；否则不打开
+        pcfg = cfg.get("pipeline", {})
+        if self.pages > 1 and not (int(pcfg.get("in_flight", 1)) > 1 and bool(pcfg.get("message_has_range", False))):
+            logger.info("download_pages: pages=%s ignored, batch downloads need pipeline.in_flight>1 "
+                        "and pipeline.message_has_range=true; using 1 page", self.pages)
+            self.pages = 1
+        self._workers: List[Any] = []
+        # ui：点击“下载文件”由浏览器下载（默认）；direct：取消息中的文件链接，带会话 Cookie 直接下载，失败时回退到 ui
+        self.download_mode = str(dcfg.get("mode", "ui")).lower()
+        self._fetcher: Optional[FileFetcher] = FileFetcher(cfg) if self.download_mode == "direct" else None
+        # 落盘时同步计算的摘要算法（记入 run_windows.csv 的 file_md5）
+        self.digest_algo = str(dcfg.get("digest_algo", "md5")).lower()
+        # 最近一次 wait_and_download_new 的分阶段耗时（秒）：wait=等待消息，download=下载落盘
+        self.last_timings: Dict[str, float] = {}
         _ensure_dir(self.download_dir)
         self._p = sync_playwright().start()
+        logger.debug("playwright: launch context user_data_dir=%s headless=%s pages=%s", self.user_data_dir, self.headless, self.pages)
         self._context = self._p.chromium.launch_persistent_context(
             user_data_dir=self.user_data_dir,
-            headless=False,
+            headless=self.headless,
             accept_downloads=True,
         )
-        self._page = self._context.new_page()
+        # 持久化上下文启动时自带一个空白页，直接复用
+        self._page = self._context.pages[0] if self._context.pages else self._context.new_page()
         self._page.set_default_timeout(30_000)
         self.ensure_chat_open()
 
-    def ensure_chat_open(self) -> None:
-        page = self._page
-        page.goto(MESSENGER_URL)
-        time.sleep(2)
+    def __enter__(self) -> "BrowserSession":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _chat_ready(self, page: Any = None) -> bool:
+        """机器人会话是否已打开且可见：仍在 messenger 页面、就绪元素可见，且当前会话确为机器人会话。
+
+        当前会话的校验：设置了 chat_title_selector 时要求标题包含 bot_chat_name；否则要求会话列表中的机器人条目
+        为选中项。两者都无法确认时返回 False（重新打开会话），避免其它会话打开时误判为就绪。
+        """
+        page = page or self._page
+        try:
+            if id(page) not in self._opened_pages or page.is_closed() or not page.url.startswith(self.messenger_url):
+                return False
+            if not page.locator(self.chat_ready_selector).first.is_visible():
+                return False
+            if self.chat_title_selector:
+                title = page.locator(self.chat_title_selector).first.inner_text(timeout=1_000)
+                return self.bot_chat_name in (title or "")
+            item = page.get_by_role("link", name=self.bot_chat_name).or_(page.get_by_text(self.bot_chat_name)).first
+            if bool(item.evaluate(_SELECTED_JS, timeout=1_000)):
+                return True
+            logger.debug("chat_ready: cannot confirm '%s' is the active chat, reopen", self.bot_chat_name)
+            return False
+        except Exception:
+            return False
+
+    def ensure_chat_open(self, force: bool = False, page: Any = None) -> bool:
+        """确保机器人会话处于打开状态；会话已就绪时不再重新加载页面。返回会话是否就绪。"""
+        page = page or self._page
+        if not force and self._chat_ready(page):
+            logger.debug("ensure_chat_open: chat ready, skip navigation")
+            return True
+        timeout_ms = max(1, int(self.ready_timeout_seconds * 1000))
+        start = time.monotonic()
+        self._opened_pages.discard(id(page))
+        page.goto(self.messenger_url, wait_until="domcontentloaded")
         try:
-            locator = page.get_by_role("link", name=self.bot_chat_name)
-            if locator.count() == 0:
-                locator = page.get_by_text(self.bot_chat_name)
+            locator = page.get_by_role("link", name=self.bot_chat_name).or_(page.get_by_text(self.bot_chat_name))
+            # 等会话列表渲染出机器人会话再点击，替代固定等待
+            locator.first.wait_for(state="visible", timeout=timeout_ms)
             locator.first.click()
+            page.locator(self.chat_ready_selector).first.wait_for(state="visible", timeout=timeout_ms)
+            self._opened_pages.add(id(page))
         except Exception:
-            pass
+            logger.warning("ensure_chat_open: chat '%s' not ready within %ss", self.bot_chat_name, self.ready_timeout_seconds)
+        opened = id(page) in self._opened_pages
+        logger.debug("ensure_chat_open: navigated opened=%s elapsed=%.2fs", opened, time.monotonic() - start)
+        return opened
+
+    def _buttons(self):
+        # observer 模式下按钮序号须与页面内 XPath 统计一致
+        if self.detection == "observer":
+            return self._page.locator("xpath=" + BUTTON_XPATH)
+        return self._page.get_by_text(BUTTON_TEXT)
+
+    def _watch_state(self) -> Optional[Tuple[int, str]]:
+        """读取页面内观察器的 (按钮数, 尾消息签名)；页面刷新后观察器丢失时重新注入。"""
+        try:
+            st = self._page.evaluate(_WATCH_STATE_JS)
+            if st is None:
+                self._page.evaluate(_WATCH_JS, self.settle_ms)
+                self._watch_settled = False
+                st = self._page.evaluate(_WATCH_STATE_JS)
+                logger.debug("watch: observer installed count=%s", st[0] if st else None)
+            return (int(st[0]), str(st[1] or "")) if st else None
+        except Exception:
+            logger.debug("watch: read observer state failed", exc_info=True)
+            return None
+
+    def _settled_watch_state(self) -> Optional[Tuple[int, str]]:
+        """读取观察器状态；观察器刚注入时先等 (按钮数, 尾消息签名) 稳定，避免历史消息尚未渲染完就取基线。
+
+        观察器本身在变化停止 settle_ms 后才重新统计，因此要求状态连续 2*settle_ms 不变，最多等待 ready_timeout_seconds。
+        """
+        st = self._watch_state()
+        if st is None or self._watch_settled:
+            return st
+        start = time.monotonic()
+        stable_since = start
+        while time.monotonic() - start < self.ready_timeout_seconds:
+            time.sleep(max(0.01, self.watch_poll_ms / 1000.0))
+            cur = self._watch_state()
+            if cur is None:
+                return None
+            if cur != st:
+                st, stable_since = cur, time.monotonic()
+            elif (time.monotonic() - stable_since) * 1000 >= 2 * self.settle_ms:
+                break
+        self._watch_settled = True
+        logger.debug("watch: baseline settled count=%s elapsed=%.2fs", st[0], time.monotonic() - start)
+        return st
+
+    def _wait_for_change(self, count: int, sig: str, timeout_seconds: float) -> bool:
+        """在浏览器内等待按钮数超过 count 或尾消息签名变化，返回是否在超时前发生。"""
+        if self._watch_state() is None:
+            return False
+        try:
+            self._page.wait_for_function(_WATCH_WAIT_JS, arg=[count, sig], polling=self.watch_poll_ms,
+                                         timeout=max(1, int(timeout_seconds * 1000)))
+            return True
+        except PlaywrightTimeoutError:
+            return False
+        except Exception:
+            logger.debug("watch: wait failed", exc_info=True)
+            return False
 
     def snapshot_download_button_count(self) -> int:
         try:
-            return self._page.get_by_text("下载文件").count()
+            return self._buttons().count()
         except Exception:
             return 0
 
@@ -93,7 +324,7 @@ class BrowserSession:
             time.sleep(max(0.05, interval))
         return max(0, last)
 
-    def _text_near(self, btn_locator) -> str:
+    def _text_near(self, btn_locator, fallback: bool = True) -> str:
         txt = ""
         try:
             txt = btn_locator.evaluate(
@@ -101,7 +332,7 @@ class BrowserSession:
             ) or ""
         except Exception:
             txt = ""
-        if not txt:
+        if not txt and fallback:
             try:
                 txt = self._page.locator("xpath=(//*[contains(text(),'共计')])[last()]").inner_text()
             except Exception:
@@ -127,6 +358,10 @@ class BrowserSession:
             return norm[:16]
 
     def snapshot_state(self) -> Tuple[int, str]:
+        if self.detection == "observer":
+            st = self._settled_watch_state()
+            if st is not None:
+                return st
         cnt = self._stable_count()
         sig = self._tail_signature() if cnt > 0 else ""
         return cnt, sig
@@ -146,7 +381,25 @@ class BrowserSession:
                 text_near = ""
         return int(_parse_declared_count(text_near) or 0)
 
-    def wait_and_download_new(self, pre_count: int, pre_sig: str = "") -> Optional[Tuple[str, int]]:
+    def wait_and_download_new(self, pre_count: int, pre_sig: str = "") -> Optional[Tuple[DownloadedFile, int]]:
+        self.last_timings = {}
+        start = time.monotonic()
+        if self.detection == "observer":
+            if not self._wait_for_change(pre_count, pre_sig, self.max_wait_seconds):
+                self.last_timings["wait"] = time.monotonic() - start
+                return None
+            cnt_now, _ = self.snapshot_state()
+            self.last_timings["wait"] = time.monotonic() - start
+            logger.debug("watch: new message count=%s latency=%.2fs", cnt_now, self.last_timings["wait"])
+            if cnt_now <= 0:
+                return None
+            btn_last = self._buttons().nth(cnt_now - 1)
+            dl_start = time.monotonic()
+            save_path = self._download_button(btn_last)
+            self.last_timings["download"] = time.monotonic() - dl_start
+            if not save_path:
+                return None
+            return (save_path, self._declared_near(btn_last))
         page = self._page
         start_ts = time.time()
         while time.time() - start_ts < self.max_wait_seconds:
@@ -162,6 +415,7 @@ class BrowserSession:
         except Exception:
             cnt_now, sig_now = pre_count, ""
         should = (cnt_now > pre_count) or (pre_sig and sig_now and sig_now != pre_sig)
+        self.last_timings["wait"] = time.monotonic() - start
         if not should:
             return None
         try:
@@ -172,137 +426,217 @@ class BrowserSession:
             return None
         idx = max(0, cnt_now - 1)
         btn_last = button.nth(idx)
-        save_path: Optional[str] = None
-        try:
-            with page.expect_download() as dl_info:
-                btn_last.click()
-            download = dl_info.value
-            suggested = download.suggested_filename
-            dest = os.path.join(self.download_dir, suggested)
-            download.save_as(dest)
-            save_path = dest
-        except Exception:
-            save_path = None
+        dl_start = time.monotonic()
+        save_path = self._download_button(btn_last)
+        self.last_timings["download"] = time.monotonic() - dl_start
         if not save_path:
             return None
         declared = self._declared_near(btn_last)
         return (save_path, declared)
 
-    def close(self) -> None:
+    def _file_url(self, btn_locator) -> str:
         try:
-            self._context.close()
+            return str(btn_locator.evaluate(_FILE_URL_JS) or "")
         except Exception:
-            pass
+            logger.debug("file_url: evaluate failed", exc_info=True)
+            return ""
+
+    def _cookie_for(self, url: str) -> str:
         try:
-            self._p.stop()
+            return cookie_header(self._context.cookies(url))
         except Exception:
-            pass
-
-
-def login_and_download(cfg: dict) -> Optional[Tuple[str, int]]:
-    dcfg = cfg.get("download", {})
-    user_data_dir = dcfg.get("user_data_dir", "./.browser_profile")
-    download_dir = dcfg.get("download_dir", "./output/raw")
-    bot_chat_name = dcfg.get("bot_chat_name", "飞书合同")
-    max_wait_seconds = int(dcfg.get("max_wait_seconds", 90))
-
-    _ensure_dir(download_dir)
-
-    with sync_playwright() as p:
-        logger.debug(
-            "playwright: launch context user_data_dir=%s headless=%s accept_downloads=%s",
-            user_data_dir,
-            False,
-            True,
-        )
-        context = p.chromium.launch_persistent_context(
-            user_data_dir=user_data_dir,
-            headless=False,
-            accept_downloads=True,
-        )
-        page = context.new_page()
-        page.set_default_timeout(30_000)
-
-        # 进入飞书网页版
-        logger.debug("playwright: goto %s", MESSENGER_URL)
-        page.goto(MESSENGER_URL)
-
-        # 进入会话列表或等待手动扫码完成
-        # 若需要登录，用户手动扫码；此处仅等待页面稳定
-        time.sleep(2)
+            return ""
 
-        # 定位机器人会话
+    def _direct_job(self, btn_locator, idx: int) -> Optional[Tuple[str, str, str, str]]:
+        url = self._file_url(btn_locator)
+        if not url:
+            logger.debug("direct: no file url in message idx=%s", idx)
+            return None
+        return (url, self._cookie_for(url), self.download_dir, f"export_{idx}.xlsx")
+
+    def _download_button(self, btn_locator, idx: int = 0) -> Optional[DownloadedFile]:
+        if self._fetcher is not None:
+            job = self._direct_job(btn_locator, idx)
+            saved = self._fetcher.fetch(*job) if job else None
+            if saved:
+                return saved
+            logger.info("direct: fall back to ui download")
+        return self._click_download(btn_locator, idx)
+
+    def _click_download(self, btn_locator, idx: int = 0) -> Optional[DownloadedFile]:
+        return self._save_download(self._start_download(self._page, btn_locator), idx)
+
+    def _start_download(self, page: Any, btn_locator) -> Any:
+        """点击按钮并返回 Playwright Download 对象（下载在浏览器中继续进行），失败返回 None。"""
         try:
-            # 优先使用 role=link/name 匹配
-            locator = page.get_by_role("link", name=bot_chat_name)
-            if locator.count() == 0:
-                locator = page.get_by_text(bot_chat_name)
-            logger.debug("playwright: click chat name=%s count=%s", bot_chat_name, locator.count())
-            locator.first.click()
+            with page.expect_download() as dl_info:
+                btn_locator.click()
+            download = dl_info.value
+            logger.debug("download_button: url=%s", download.url)
+            return download
         except Exception:
-            # 若无法定位，提示用户手动点击到机器人会话，并继续后续步骤
-            logger.warning("playwright: cannot auto-locate chat '%s', please click it manually", bot_chat_name)
-
-        # 轮询等待“下载文件”按钮出现
-        start_ts = time.time()
-        declared_count: Optional[int] = None
-        button = page.get_by_text("下载文件")
-        while time.time() - start_ts < max_wait_seconds:
-            try:
-                if button.count() > 0:
-                    logger.debug("playwright: found download button count=%s", button.count())
-                    break
-            except PlaywrightTimeoutError:
-                pass
-            time.sleep(1)
-
-        if button.count() == 0:
-            # 无消息，返回 None 供上层处理为 no_data
-            context.close()
-            logger.info("playwright: no download button within %ss, return None", max_wait_seconds)
+            logger.exception("download_button: download failed")
             return None
 
-        # 取最新一条“下载文件”按钮
-        idx = button.count() - 1
-        btn_last = button.nth(idx)
+    def _save_download(self, download: Any, idx: int = 0) -> Optional[DownloadedFile]:
+        """等待下载完成，把浏览器临时文件复制到 download_dir，复制的同时计算摘要（代替 save_as 后再整读一遍）。
 
-        # 尝试解析同一消息容器中的文案，提取共计数
-        text_near = ""
+        真实导出同一天的文件同名（suggested_filename 相同），按该名保存会让同一批下载互相覆盖，
+        因此保存为唯一的临时文件名 download_<序号>_<随机串><扩展名>，窗口对应确定后再重命名为标准名。
+        """
+        if download is None:
+            return None
         try:
-            text_near = btn_last.evaluate(
-                "el => { let n=el; for(let i=0;i<5 && n; i++){ if(n.innerText && n.innerText.includes('共计')) return n.innerText; n=n.parentElement;} return ''; }"
-            ) or ""
+            suffix = os.path.splitext(download.suggested_filename or "")[1] or ".xlsx"
+            dest = os.path.join(self.download_dir, f"download_{idx}_{uuid.uuid4().hex[:8]}{suffix}")
+            logger.debug("download_button: suggested=%s saved_as=%s", download.suggested_filename, dest)
+            src = download.path()
+            if src is None:
+                # 连接远程浏览器时拿不到本地临时文件，保存后摘要留空，由后台处理池补算（见 postprocess.py）
+                download.save_as(dest)
+                return DownloadedFile(path=dest, size=os.path.getsize(dest), digest="")
+            return copy_with_digest(src, dest, self.digest_algo)
         except Exception:
-            text_near = ""
+            logger.exception("download_button: save failed")
+            return None
 
-        if not text_near:
-            # 兜底：全局找最新包含“共计”的元素文本（可能不精确，但可用于计数）
+    def _download_pages(self) -> List[Any]:
+        """返回参与点击下载的页面；额外页面按需创建并打开机器人会话，打不开的页面不参与。"""
+        while len(self._workers) < self.pages - 1:
+            page = self._context.new_page()
+            page.set_default_timeout(30_000)
+            if not self.ensure_chat_open(page=page):
+                page.close()
+                self.pages = len(self._workers) + 1
+                logger.warning("download_pages: worker page unavailable, use %s page(s)", self.pages)
+                break
+            self._workers.append(page)
+        live = [p for p in self._workers if not p.is_closed()]
+        return [self._page] + live
+
+    def _locate_on(self, page: Any, idx: int, text: str) -> Tuple[Any, Any]:
+        """在 page 上定位与主页面第 idx 条消息相同的按钮；找不到时退回主页面。"""
+        if page is not self._page and text:
             try:
-                text_near = page.locator("xpath=(//*[contains(text(),'共计')])[last()]").inner_text()
+                if not self._chat_ready(page):
+                    self.ensure_chat_open(page=page)
+                i = int(page.evaluate(_FIND_BUTTON_JS, [BUTTON_XPATH, text]))
+                if i >= 0:
+                    return page, page.locator("xpath=" + BUTTON_XPATH).nth(i)
             except Exception:
-                text_near = ""
-        declared_count = _parse_declared_count(text_near) or 0
-        logger.debug("playwright: parsed declared_count=%s text_len=%s", declared_count, len(text_near))
+                logger.debug("download_pages: locate on worker page failed", exc_info=True)
+        return self._page, self._buttons().nth(idx)
+
+    def _click_many(self, indices: List[int]) -> List[Optional[DownloadedFile]]:
+        """先在各页面依次点击（轮流分配）启动全部下载，再逐个等待保存；浏览器中的多个下载同时进行。"""
+        pages = self._download_pages()
+        started: List[Any] = []
+        for k, idx in enumerate(indices):
+            page = pages[k % len(pages)]
+            text = self._text_near(self._buttons().nth(idx), fallback=False) if page is not self._page else ""
+            target_page, btn = self._locate_on(page, idx, text)
+            started.append(self._start_download(target_page, btn))
+        return [self._save_download(dl, idx) for dl, idx in zip(started, indices)]
+
+    def poll_new_messages(self, seen_count: int, wait_seconds: float = 0.0) -> List[Tuple[int, str]]:
+        """返回序号 >= seen_count 的“下载文件”按钮及其所在消息文案，按出现顺序排列。
+
+        流水线模式下会话中可能同时出现多条新消息，因此只取按钮所在消息容器内的文案，
+        不使用“全局最后一条共计”兜底，避免把 A 窗口的共计数算到 B 窗口上。
+        wait_seconds > 0 时最多等待这么久直到出现新消息（observer 模式在浏览器内等待，消息到达即返回）。
+        """
+        if self.detection == "observer":
+            if wait_seconds > 0:
+                self._wait_for_change(seen_count, "", wait_seconds)
+            try:
+                texts = self._page.evaluate(_WATCH_TEXTS_JS, max(0, seen_count)) or []
+            except Exception:
+                logger.debug("watch: read messages failed", exc_info=True)
+                texts = []
+            return [(seen_count + i, str(t or "")) for i, t in enumerate(texts)]
+        cnt = self._stable_count()
+        if cnt <= seen_count:
+            if wait_seconds > 0:
+                time.sleep(wait_seconds)
+            return []
+        try:
+            button = self._buttons()
+        except Exception:
+            return []
+        messages: List[Tuple[int, str]] = []
+        for idx in range(max(0, seen_count), cnt):
+            messages.append((idx, self._text_near(button.nth(idx), fallback=False)))
+        return messages
+
+    def download_at(self, idx: int) -> Optional[DownloadedFile]:
+        """点击第 idx 个“下载文件”按钮并保存，返回保存结果（路径、字节数、摘要）。"""
+        try:
+            button = self._buttons()
+            if button.count() <= idx:
+                return None
+        except Exception:
+            return None
+        return self._download_button(button.nth(idx), idx)
+
+    def download_many(self, indices: List[int]) -> List[Optional[DownloadedFile]]:
+        """下载多条消息的文件，返回与 indices 一一对应的保存结果（路径、字节数、摘要）。
+
+        direct 模式下先在页面内取出各条消息的文件链接，再用线程池并行下载；
+        ui 模式（及 direct 取不到链接/下载失败的消息）由下载页面池点击下载，多个下载在浏览器中同时进行。
+        """
+        if len(indices) <= 1:
+            return [self.download_at(i) for i in indices]
+        if self._fetcher is None:
+            return self._click_many(indices)
+        try:
+            button = self._buttons()
+            jobs = [self._direct_job(button.nth(i), i) for i in indices]
+        except Exception:
+            logger.debug("direct: resolve file urls failed", exc_info=True)
+            jobs = [None for _ in indices]
+        ready = [(k, job) for k, job in enumerate(jobs) if job is not None]
+        results: List[Optional[DownloadedFile]] = [None] * len(indices)
+        start = time.monotonic()
+        for (k, _), saved in zip(ready, self._fetcher.fetch_many([job for _, job in ready])):
+            results[k] = saved
+        logger.debug("direct: fetched %s/%s files in %.2fs", sum(1 for r in results if r), len(indices), time.monotonic() - start)
+        fallback = [k for k, r in enumerate(results) if r is None]
+        if fallback:
+            for k, saved in zip(fallback, self._click_many([indices[k] for k in fallback])):
+                results[k] = saved
+        return results
 
-        # 捕获下载事件并保存到 download_dir
-        save_path: Optional[str] = None
+    def close(self) -> None:
+        if self._fetcher is not None:
+            self._fetcher.close()
         try:
-            with page.expect_download() as dl_info:
-                btn_last.click()
-            download = dl_info.value
-            suggested = download.suggested_filename
-            dest = os.path.join(download_dir, suggested)
-            logger.debug("playwright: save download suggested=%s dest=%s", suggested, dest)
-            download.save_as(dest)
-            save_path = dest
+            self._context.close()
+        except Exception:
+            pass
+        try:
+            self._p.stop()
         except Exception:
-            logger.exception("playwright: download failed")
-            save_path = None
+            pass
 
-        context.close()
 
-        if save_path and declared_count is not None:
-            logger.info("playwright: success path=%s declared=%s", save_path, int(declared_count))
-            return (save_path, int(declared_count))
-        logger.info("playwright: return None (save_path or declared_count missing)")
+def login_and_download(cfg: dict) -> Optional[Tuple[str, int]]:
+    """单次下载：等待会话中出现“下载文件”按钮并下载最新一条，返回 (保存路径, 共计数)；无消息返回 None。"""
+    with BrowserSession(cfg) as session:
+        result = session.wait_and_download_new(0, "")
+    if result is None:
+        logger.info("playwright: no download within %ss, return None", session.max_wait_seconds)
         return None
+    logger.info("playwright: success path=%s declared=%s", result[0].path, result[1])
+    return (result[0].path, result[1])
+
+
+def interactive_login(cfg: dict, timeout_seconds: float = 300) -> bool:
+    """以有界面模式打开浏览器，等待扫码登录并打开机器人会话；登录态保存在 user_data_dir，之后可无界面运行。"""
+    dcfg = dict(cfg.get("download", {}), ready_timeout_seconds=timeout_seconds, pages=1)
+    with BrowserSession(dict(cfg, download=dcfg), headless=False) as session:
+        ok = session.ensure_chat_open()
+    if ok:
+        logger.info("login: chat '%s' ready, login state saved to %s", session.bot_chat_name, session.user_data_dir)
+    else:
+        logger.warning("login: chat '%s' not ready within %ss", session.bot_chat_name, timeout_seconds)
+    return ok
@@ -44,3 +44,14 @@ def generate_initial_windows(start_date: str, end_date: str, days: int) -> List[
         cur = win_end + timedelta(days=1)
 
     return windows
+
+
+def bisect_window(start_date: str, end_date: str) -> List[Tuple[str, str]]:
+    """把闭区间窗口按日期二分为前后两半（前半多一天）；单日窗口无法再分，原样返回。"""
+    start = _parse(start_date)
+    end = _parse(end_date)
+    days = (end - start).days + 1
+    if days <= 1:
+        return [(_fmt(start), _fmt(end))]
+    mid = start + timedelta(days=(days + 1) // 2 - 1)
+    return [(_fmt(start), _fmt(mid)), (_fmt(mid + timedelta(days=1)), _fmt(end))]
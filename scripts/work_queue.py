@@ -0,0 +1,327 @@
+"""
+多机共享的窗口工作队列（queue.backend=sqlite）
+- 窗口（含拆分出的子窗口）存放在一个 SQLite 文件中，各节点以租约（lease）方式领取：
+  领取时记录 owner 与到期时间，后台心跳线程定期续租；节点崩溃后租约到期，窗口自动被其它节点重新领取
+- 每个节点使用各自登录的浏览器配置与 Cookie，结果仍写入本节点的运行状态 CSV；队列只负责协调“谁处理哪个窗口”
+- 各节点必须登录不同的飞书账号：机器人会话按账号区分，共用一个会话时逐窗口模式取“第一条新消息”会拿到其它节点的导出结果。
+  节点加入队列时登记账号标识（queue.account，留空取导出 Cookie 中 session 的摘要），同一账号已有存活节点时拒绝启动
+- 窗口只能由当前持有租约的节点完成：租约过期后被其它节点重新领取的窗口，原节点的结果不再写入队列（记为租约丢失）
+- 拆分记录会把子窗口作为新的待领取窗口写入队列，由任意节点继续处理
+- 第一个启动的节点负责写入初始窗口；队列已有窗口时其它节点直接加入。已有队列的时间范围与本节点配置不一致时拒绝加入
+  （queue.join_any=true 时照常加入并处理队列中的范围）
+
+状态：pending（待领取）| leased（已租出）| done（with_data/no_data/manual）| split（已拆分）| failed
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+import hashlib
+import logging
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DONE_STATUSES = ("with_data", "no_data", "manual")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS windows (
+    window_id TEXT PRIMARY KEY,
+    from_date TEXT NOT NULL,
+    to_date TEXT NOT NULL,
+    split_level INTEGER NOT NULL DEFAULT 0,
+    parent_id TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT NOT NULL DEFAULT '',
+    lease_expires REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_windows_state ON windows (state, lease_expires);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class WorkQueueConfig:
+    path: str
+    worker_id: str
+    lease_seconds: float = 300.0
+    heartbeat_seconds: float = 60.0
+    idle_poll_seconds: float = 5.0
+    batch: int = 0
+    account: str = ""
+    join_any: bool = False
+
+
+def account_id(root_cfg: dict) -> str:
+    """节点的账号标识：优先 queue.account，否则取导出 Cookie 中 session（没有时取整个 Cookie）的摘要。"""
+    explicit = str(root_cfg.get("queue", {}).get("account", "") or "").strip()
+    if explicit:
+        return explicit
+    cookie = str(root_cfg.get("export_headers", {}).get("cookie", "") or "").strip()
+    if not cookie:
+        return ""
+    m = re.search(r"(?:^|;\s*)session=([^;]+)", cookie)
+    return "cookie:" + hashlib.sha256((m.group(1) if m else cookie).encode("utf-8")).hexdigest()[:16]
+
+
+def from_config(root_cfg: dict) -> Optional[WorkQueueConfig]:
+    qcfg = root_cfg.get("queue", {})
+    backend = str(qcfg.get("backend", "none") or "none").lower()
+    if backend in ("", "none"):
+        return None
+    if backend != "sqlite":
+        raise ValueError(f"不支持的 queue.backend: {backend}（可选: none, sqlite）")
+    lease_seconds = float(qcfg.get("lease_seconds", 300))
+    return WorkQueueConfig(
+        path=str(qcfg.get("path", "./state/work_queue.sqlite")),
+        worker_id=str(qcfg.get("worker_id") or f"{socket.gethostname()}-{os.getpid()}"),
+        lease_seconds=lease_seconds,
+        heartbeat_seconds=float(qcfg.get("heartbeat_seconds", max(1.0, lease_seconds / 5))),
+        idle_poll_seconds=float(qcfg.get("idle_poll_seconds", 5)),
+        batch=int(qcfg.get("batch", 0)),
+        account=account_id(root_cfg),
+        join_any=bool(qcfg.get("join_any", False)),
+    )
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # isolation_level=None：由代码显式 BEGIN IMMEDIATE，领取窗口时先拿写锁，避免两个节点领到同一窗口
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class WorkQueue:
+    def __init__(self, cfg: WorkQueueConfig) -> None:
+        self.cfg = cfg
+        self.worker_id = cfg.worker_id
+        Path(cfg.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = _connect(cfg.path)
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            # 某些网络文件系统不支持 WAL，退回默认的回滚日志
+            logger.warning("work_queue: WAL not available, using rollback journal path=%s", cfg.path)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+        self.lost_leases = 0
+        try:
+            self._register()
+        except Exception:
+            self._conn.close()
+            raise
+        logger.info("work_queue: open path=%s worker=%s lease=%ss heartbeat=%ss",
+                    cfg.path, self.worker_id, cfg.lease_seconds, cfg.heartbeat_seconds)
+
+    def _write(self, fn: Any) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _register(self) -> None:
+        """登记本节点的账号；同一账号已有其它存活（心跳未超过租约时长）的节点时抛出 RuntimeError。"""
+        account = self.cfg.account
+        if not account:
+            logger.warning("work_queue: no account id (queue.account / export cookie), cannot check for shared accounts")
+            return
+        now = time.time()
+
+        def _reg(conn: sqlite3.Connection) -> List[str]:
+            others = [r["worker_id"] for r in conn.execute(
+                "SELECT worker_id FROM workers WHERE account=? AND worker_id<>? AND heartbeat_at>=?",
+                (account, self.worker_id, now - self.cfg.lease_seconds)).fetchall()]
+            if not others:
+                conn.execute("INSERT OR REPLACE INTO workers (worker_id, account, heartbeat_at) VALUES (?, ?, ?)",
+                             (self.worker_id, account, now))
+            return others
+
+        others = self._write(_reg)
+        if others:
+            raise RuntimeError(f"工作队列中已有使用同一账号的节点 {others}：各节点必须登录不同的飞书账号"
+                               f"（机器人会话按账号区分，共用会话会把其它节点的导出消息当作本节点的结果）")
+
+    def seed(self, windows: List[Tuple[str, str, str, int, str]], run_range: str = "") -> bool:
+        """windows 为 [(window_id, from, to, split_level, parent_id)]。
+        队列为空时写入初始窗口并返回 True；已有窗口时（其它节点已写入）不改动并返回 False。
+
+        已有队列中的 failed 窗口重新置为 pending，与断点续跑“失败窗口重跑”的语义一致。
+        已有队列的时间范围（run_range）与本节点不一致时抛出 ValueError，除非 join_any=True。
+        """
+        now = time.time()
+
+        def _seed(conn: sqlite3.Connection) -> bool:
+            existing = conn.execute("SELECT COUNT(*) FROM windows").fetchone()[0]
+            if existing:
+                row = conn.execute("SELECT value FROM meta WHERE key='range'").fetchone()
+                if row and run_range and row["value"] != run_range:
+                    if not self.cfg.join_any:
+                        raise ValueError(f"工作队列 {self.cfg.path} 的时间范围为 {row['value']}，与本节点配置的 {run_range} 不一致；"
+                                         f"开始新的时间范围请换一个 queue.path，确需加入已有队列请设置 queue.join_any: true")
+                    logger.warning("work_queue: queue range %s differs from configured %s; joining existing queue (join_any)",
+                                   row["value"], run_range)
+                conn.execute("UPDATE windows SET state='pending', owner='', lease_expires=0, updated_at=? WHERE state='failed'",
+                             (now,))
+                return False
+            conn.executemany(
+                "INSERT OR IGNORE INTO windows (window_id, from_date, to_date, split_level, parent_id, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(wid, fr, to, level, parent_id, now) for wid, fr, to, level, parent_id in windows],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('range', ?)", (run_range,))
+            return True
+
+        seeded = self._write(_seed)
+        logger.info("work_queue: seed windows=%s seeded=%s", len(windows), seeded)
+        return seeded
+
+    def lease(self, n: int) -> List[Tuple[str, str, int, str]]:
+        """领取最多 n 个窗口（待领取的或租约已过期的），子窗口（split_level 大）优先，其次按日期。"""
+        now = time.time()
+
+        def _lease(conn: sqlite3.Connection) -> List[Tuple[str, str, int, str]]:
+            rows = conn.execute(
+                "SELECT window_id, from_date, to_date, split_level, parent_id, owner, state FROM windows"
+                " WHERE state='pending' OR (state='leased' AND lease_expires < ?)"
+                " ORDER BY split_level DESC, from_date LIMIT ?",
+                (now, max(1, n)),
+            ).fetchall()
+            for r in rows:
+                if r["state"] == "leased":
+                    logger.warning("work_queue: re-lease expired window_id=%s from worker=%s", r["window_id"], r["owner"])
+                conn.execute(
+                    "UPDATE windows SET state='leased', owner=?, lease_expires=?, attempts=attempts+1, updated_at=?"
+                    " WHERE window_id=?",
+                    (self.worker_id, now + self.cfg.lease_seconds, now, r["window_id"]),
+                )
+            return [(r["from_date"], r["to_date"], int(r["split_level"]), r["parent_id"]) for r in rows]
+
+        leased = self._write(_lease)
+        if leased:
+            logger.debug("work_queue: leased %s windows worker=%s", len(leased), self.worker_id)
+        return leased
+
+    def complete(self, row: Dict[str, Any], children: Optional[List[Tuple[str, str, str]]] = None) -> bool:
+        """按运行状态行更新队列：split 时把子窗口 [(window_id, from, to)] 写入为待领取。
+
+        只有本节点仍持有租约时才生效；租约已过期并被其它节点重新领取（或已完成）时不改动队列，返回 False（租约丢失）。
+        """
+        wid = str(row.get("window_id") or "")
+        status = str(row.get("status") or "")
+        state = "done" if status in DONE_STATUSES else status
+        now = time.time()
+        level = int(row.get("split_level") or 0)
+
+        def _complete(conn: sqlite3.Connection) -> int:
+            cur = conn.execute(
+                "UPDATE windows SET state=?, status=?, lease_expires=0, updated_at=?"
+                " WHERE window_id=? AND state='leased' AND owner=?",
+                (state, status, now, wid, self.worker_id),
+            )
+            if cur.rowcount and state == "split" and children:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO windows (window_id, from_date, to_date, split_level, parent_id, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    [(cid, fr, to, level + 1, wid, now) for cid, fr, to in children],
+                )
+            return cur.rowcount
+
+        if not self._write(_complete):
+            self.lost_leases += 1
+            logger.warning("work_queue: lost lease on window_id=%s (re-leased or finished by another worker), "
+                           "status=%s not applied", wid, status)
+            return False
+        return True
+
+    def outstanding(self) -> int:
+        """尚未结束的窗口数（pending + leased，含其它节点持有的）。"""
+        with self._lock:
+            return int(self._conn.execute(
+                "SELECT COUNT(*) FROM windows WHERE state IN ('pending', 'leased')").fetchone()[0])
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {r["state"]: int(r["n"]) for r in
+                    self._conn.execute("SELECT state, COUNT(*) AS n FROM windows GROUP BY state").fetchall()}
+
+    def _renew(self, conn: sqlite3.Connection) -> int:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute("UPDATE windows SET lease_expires=?, updated_at=? WHERE state='leased' AND owner=?",
+                           (now + self.cfg.lease_seconds, now, self.worker_id))
+        conn.execute("UPDATE workers SET heartbeat_at=? WHERE worker_id=?", (now, self.worker_id))
+        conn.execute("COMMIT")
+        return cur.rowcount
+
+    def start_heartbeat(self) -> None:
+        """后台线程每 heartbeat_seconds 为本节点持有的全部租约续期（线程使用独立的数据库连接）。"""
+        if self._heartbeat is not None:
+            return
+
+        def _beat() -> None:
+            conn = _connect(self.cfg.path)
+            try:
+                while not self._stop.wait(self.cfg.heartbeat_seconds):
+                    try:
+                        n = self._renew(conn)
+                        logger.debug("work_queue: heartbeat renewed=%s worker=%s", n, self.worker_id)
+                    except Exception:
+                        logger.exception("work_queue: heartbeat failed")
+            finally:
+                conn.close()
+
+        self._heartbeat = threading.Thread(target=_beat, name="queue-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def release_all(self) -> None:
+        """正常退出时把本节点仍持有的租约放回待领取，其它节点无需等待过期。"""
+        def _release(conn: sqlite3.Connection) -> int:
+            return conn.execute("UPDATE windows SET state='pending', owner='', lease_expires=0, updated_at=?"
+                                " WHERE state='leased' AND owner=?", (time.time(), self.worker_id)).rowcount
+        n = self._write(_release)
+        if n:
+            logger.info("work_queue: released %s leased windows worker=%s", n, self.worker_id)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=5)
+            self._heartbeat = None
+        try:
+            self.release_all()
+            self._write(lambda conn: conn.execute("DELETE FROM workers WHERE worker_id=?", (self.worker_id,)))
+        except Exception:
+            logger.exception("work_queue: release on close failed")
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def open_queue(root_cfg: dict) -> Optional[WorkQueue]:
+    cfg = from_config(root_cfg)
+    return WorkQueue(cfg) if cfg is not None else None